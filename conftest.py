@@ -125,6 +125,13 @@ def testdatadir(request):
     return datadir
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        '--benchmark', default='', metavar='SIZES',
+        help='run the search benchmarks on corpora of these comma separated '
+             'sizes, e.g. 10000,100000')
+
+
 def pytest_configure(config):
     from django.conf import settings
 
@@ -146,6 +153,10 @@ def pytest_configure(config):
     settings.STATICFILES_STORAGE = (
         'django.contrib.staticfiles.storage.StaticFilesStorage')
 
+    # Tests run in transactions which are never committed
+    settings.SEARCH_DEFERRED_INDEXING = False
+    settings.THUMBNAILS_IN_BACKGROUND = False
+
 class CatalogMocker:
     """A CatalogMocker.
     A instance of CatalogMocker is a (reusable) context manager.
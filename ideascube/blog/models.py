@@ -10,6 +10,7 @@ from unidecode import unidecode
 from ideascube.models import (
     LanguageField, SortedTaggableManager, TimeStampedModel)
 from ideascube.search.models import SearchableQuerySet, SearchMixin
+from ideascube.search.utils import html_to_text
 
 
 # Monkeypatch TagBase.slugify, see:
@@ -67,6 +68,8 @@ class Content(SearchMixin, TimeStampedModel, models.Model):
     objects = ContentQuerySet.as_manager()
     tags = TaggableManager(
         blank=True, manager=SortedTaggableManager, verbose_name=_('Topics'))
+    index_prefetch = ('tags',)
+    thumbnail_fields = ('image',)
 
     def __str__(self):
         return self.title
@@ -74,10 +77,18 @@ class Content(SearchMixin, TimeStampedModel, models.Model):
     def get_absolute_url(self):
         return reverse('blog:content_detail', kwargs={'pk': self.pk})
 
+    @classmethod
+    def get_index_queryset(cls):
+        return super().get_index_queryset().select_related('author')
+
+    @property
+    def index_title(self):
+        return self.title
+
     @property
     def index_strings(self):
-        return (self.title, self.text, str(self.author),
-                u' '.join(self.tags.names()))
+        names = [tag.name for tag in self.tags.all()]
+        return (html_to_text(self.text), str(self.author), u' '.join(names))
 
     @property
     def index_public(self):
@@ -85,7 +96,7 @@ class Content(SearchMixin, TimeStampedModel, models.Model):
 
     @property
     def index_tags(self):
-        return self.tags.slugs()
+        return [tag.slug for tag in self.tags.all()]
 
     @property
     def index_lang(self):
@@ -39,8 +39,7 @@ class Index(FilterableViewMixin, OrderableViewMixin, ListView):
             # This tells the search system to only look at published articles
             context['public'] = True
 
-        self._set_available_langs(context)
-        self._set_available_tags(context)
+        self._set_facets(context)
         return context
 
 index = Index.as_view()
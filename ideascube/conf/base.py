@@ -58,6 +58,7 @@ MIDDLEWARE = (
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ideascube.search.middleware.DeferredIndexingMiddleware',
 )
 
 TEMPLATES = [
@@ -233,6 +234,13 @@ if os.path.exists('/usr/share/ideascube/static'):
     STATICFILES_DIRS.append('/usr/share/ideascube/static')
 MEDIA_URL = '/media/'
 
+# The widths of the thumbnails of the images of the media storage
+THUMBNAIL_WIDTHS = (320, 640, 1280)
+THUMBNAILS_IN_BACKGROUND = True
+
+# Store the identical media files only once
+MEDIA_DEDUPLICATION = False
+
 
 # Ideas Box specifics
 STORAGE_ROOT = os.environ.get('STORAGE_ROOT',
@@ -336,5 +344,14 @@ BACKUP_FORMAT = 'gztar'  # One of 'tar', 'bztar', 'gztar'
 TAGGIT_CASE_INSENSITIVE = True
 TAGGIT_TAGS_FROM_STRING = 'ideascube.utils.tag_splitter'
 DATABASE_ROUTERS = ['ideascube.db_router.DatabaseRouter']
+# Update the search index when transactions are committed, rather than on
+# every save
+SEARCH_DEFERRED_INDEXING = True
+# The kiwix-serve instance serving the installed ZIM files, which the global
+# search also queries
+KIWIX_SERVER_URL = 'http://kiwix.{}'.format(DOMAIN)
+KIWIX_SEARCH_TIMEOUT = 1  # In seconds, for all the ZIM files.
+KIWIX_SEARCH_CACHE_TIMEOUT = 60  # In seconds.
+KIWIX_SEARCH_RESULTS = 5  # Per ZIM file.
 
 IDEASCUBE_CONFIGURATION_EXTRA_REGISTRY = {}
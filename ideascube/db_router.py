@@ -1,6 +1,7 @@
 
 _database_to_use = {
-    ('search', 'search'): 'transient'
+    ('search', 'search'): 'transient',
+    ('search', 'searchtext'): 'transient',
 }
 
 
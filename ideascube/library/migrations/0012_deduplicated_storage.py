@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import ideascube.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_auto_20161028_1633'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookspecimen',
+            name='file',
+            field=models.FileField(blank=True, storage=ideascube.storage.DeduplicatedStorage(), upload_to='library/digital', verbose_name='digital file'),
+        ),
+    ]
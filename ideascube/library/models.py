@@ -9,6 +9,8 @@ from ideascube.models import (
     LanguageField, SortedTaggableManager, TimeStampedModel)
 from ideascube.monitoring.models import StockItem, Specimen
 from ideascube.search.models import SearchableQuerySet, SearchMixin
+from ideascube.search.utils import html_to_text
+from ideascube.storage import deduplicated_storage
 
 
 class BookQuerySet(SearchableQuerySet, models.QuerySet):
@@ -63,6 +65,8 @@ class Book(StockItem, SearchMixin, TimeStampedModel):
 
     objects = BookQuerySet.as_manager()
     tags = TaggableManager(blank=True, manager=SortedTaggableManager)
+    index_prefetch = ('tags',)
+    thumbnail_fields = ('cover',)
 
     class Meta:
         ordering = ['name']
@@ -73,14 +77,20 @@ class Book(StockItem, SearchMixin, TimeStampedModel):
     def get_absolute_url(self):
         return reverse('library:book_detail', kwargs={'pk': self.pk})
 
+    @property
+    def index_title(self):
+        return self.name
+
     @property
     def index_strings(self):
-        return (self.name, self.isbn, self.authors, self.subtitle,
-                self.description, self.serie, u' '.join(self.tags.names()))
+        names = [tag.name for tag in self.tags.all()]
+        return (self.isbn, self.authors, self.subtitle,
+                html_to_text(self.description),
+                self.serie, u' '.join(names))
 
     @property
     def index_tags(self):
-        return self.tags.slugs()
+        return [tag.slug for tag in self.tags.all()]
 
     @property
     def index_lang(self):
@@ -107,6 +117,7 @@ class BookSpecimen(Specimen, TimeStampedModel):
                                 blank=True)
     file = models.FileField(verbose_name=_('digital file'),
                             upload_to='library/digital',
+                            storage=deduplicated_storage,
                             blank=True)
 
     @property
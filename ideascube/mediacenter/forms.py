@@ -1,6 +1,7 @@
 from django import forms
 from django.conf import settings
 
+from ideascube.search.utils import schedule_indexing
 from ideascube.widgets import LangSelect, RichTextEntry
 
 from .models import Document
@@ -50,8 +51,8 @@ class DocumentForm(forms.ModelForm):
         document = super().save(commit=commit)
 
         if commit:
-            # Need to save a second time to index the m2m
-            document.save()
+            # The tags were saved after the document, index them too
+            schedule_indexing(document)
 
         return document
 
@@ -87,8 +88,8 @@ class PackagedDocumentForm(forms.ModelForm):
             document.preview = preview
 
         if commit:
-            if not document.id:
-                document.save()
-            self.save_m2m()
             document.save()
+            self.save_m2m()
+            # The tags were saved after the document, index them too
+            schedule_indexing(document)
         return document
@@ -1,15 +1,66 @@
 # -*- coding: utf-8 -*-
 import os
 import argparse
-from pathlib import Path
+from itertools import islice
 
 from django.conf import settings
+from django.db import connections, router, transaction
 
 from ideascube.management.base import BaseCommandWithSubcommands
 from ideascube.management.args import date_argument
 from ideascube.mediacenter.models import Document
+from ideascube.storage import deduplicated_storage
+from ideascube.thumbnails import get_thumbnail_name
 from ideascube.utils import printerr
 
+try:
+    from os import scandir
+except ImportError:
+    # Python 3.4
+    scandir = None
+
+
+# Where the files of the documents are uploaded, in the media storage
+LEFTOVER_ROOTS = ('mediacenter/document', 'mediacenter/preview')
+
+# The number of file names held in memory
+CHUNK_SIZE = 500
+
+
+def _list_directory(path):
+    """Yield the name of each entry of a directory, and if it is a directory
+
+    os.scandir streams the entries without a stat of each one, but it is
+    only there from Python 3.5. The directories which are symbolic links
+    are left out, like os.walk does not go into them.
+    """
+    try:
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        yield entry.name, True
+                    continue
+
+                yield entry.name, False
+
+            return
+
+        names = os.listdir(path)
+
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        entry = os.path.join(path, name)
+
+        if os.path.isdir(entry):
+            if not os.path.islink(entry):
+                yield name, True
+            continue
+
+        yield name, False
+
 
 class Command(BaseCommandWithSubcommands):
     help = 'Remove files from the mediacenter.'
@@ -98,51 +149,114 @@ class Command(BaseCommandWithSubcommands):
             self.clean_leftover(options)
 
     def clean_leftover(self, options):
-        files_to_remove, dirs_in_fs = self._get_leftover_files()
+        leftover_files = self._get_leftover_files()
         if options['dry_run']:
             print("Files to remove are :")
-            for _file in files_to_remove:
-                print(" - '{}'".format(_file))
+            for name in leftover_files:
+                print(" - '{}'".format(os.path.join(settings.MEDIA_ROOT, name)))
         else:
-            for f in files_to_remove:
+            for name in leftover_files:
+                path = os.path.join(settings.MEDIA_ROOT, name)
                 try:
-                    f.unlink()
+                    os.unlink(path)
                 except Exception as e:
-                    printerr("ERROR while deleting {}".format(f))
+                    printerr("ERROR while deleting {}".format(path))
                     printerr("Exception is {}".format(e))
-            for d in sorted(dirs_in_fs, reverse=True):
+                    continue
+
+                for width in settings.THUMBNAIL_WIDTHS:
+                    thumbnail = os.path.join(
+                        settings.MEDIA_ROOT, get_thumbnail_name(name, width))
+                    if os.path.exists(thumbnail):
+                        os.unlink(thumbnail)
+
+            # The subdirectories before their parents
+            for path in reversed(self.directories):
                 try:
-                    d.rmdir()
+                    os.rmdir(path)
                 except OSError:
                     pass
 
+            # The contents which were only used by the removed files
+            deduplicated_storage.prune()
+
+    def _iter_files(self):
+        """Yield the name of each media file, relative to MEDIA_ROOT
+
+        The subdirectories of the roots are listed in self.directories,
+        each one after its parent.
+        """
+        self.directories = []
+        for root in LEFTOVER_ROOTS:
+            yield from self._iter_directory_files(
+                os.path.join(settings.MEDIA_ROOT, root))
+
+    def _iter_directory_files(self, path):
+        subdirs = []
+        for name, is_dir in _list_directory(path):
+            if is_dir:
+                subdirs.append(os.path.join(path, name))
+                continue
+            yield os.path.relpath(
+                os.path.join(path, name), settings.MEDIA_ROOT)
+
+        for subdir in subdirs:
+            self.directories.append(subdir)
+            yield from self._iter_directory_files(subdir)
+
     def _get_leftover_files(self):
-        # List all (original and preview) files in the fs
-        original_files_root_dir = os.path.join(settings.MEDIA_ROOT,
-                                               'mediacenter/document')
-        files_in_fs = set(
-            Path(original_files_root_dir).glob('**/*'))
-
-        preview_files_root_dir = os.path.join(settings.MEDIA_ROOT,
-                                    'mediacenter/preview')
-        files_in_fs.update(
-            Path(preview_files_root_dir).glob('**/*'))
-
-        dirs_in_fs = {p for p in files_in_fs if p.is_dir()}
-        files_in_fs.difference_update(dirs_in_fs)
-
-        # Remove known original paths.
-        original_pathes = Document.objects.all().values_list(
-            'original', flat=True)
-        original_pathes = (Path(settings.MEDIA_ROOT, path)
-                           for path in original_pathes)
-        files_in_fs.difference_update(original_pathes)
-
-        # Remove known preview paths.
-        preview_pathes = Document.objects.all().values_list(
-            'preview', flat=True)
-        preview_pathes = (Path(settings.MEDIA_ROOT, path)
-                          for path in preview_pathes if path)
-        files_in_fs.difference_update(preview_pathes)
-
-        return files_in_fs, dirs_in_fs
+        """Yield the name of each media file without a document
+
+        There can be hundreds of thousands of files, so neither them nor the
+        documents are loaded in memory: the names of the files are written
+        to a temporary table, chunk by chunk, and compared with the
+        documents there.
+        """
+        connection = connections[router.db_for_read(Document)]
+        qn = connection.ops.quote_name
+        table = qn(Document._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS mediacenter_files '
+                '(name TEXT PRIMARY KEY)')
+            cursor.execute('DELETE FROM mediacenter_files')
+
+            try:
+                files = self._iter_files()
+                scanned = 0
+                with transaction.atomic(using=connection.alias):
+                    while True:
+                        chunk = [(name,) for name in islice(files, CHUNK_SIZE)]
+                        if not chunk:
+                            break
+                        cursor.executemany(
+                            'INSERT INTO mediacenter_files (name) VALUES (%s)',
+                            chunk)
+                        scanned += len(chunk)
+                        # The progress goes to stderr, not to mix it with
+                        # the list of files
+                        printerr(
+                            '\rScanned {} files'.format(scanned), end='')
+
+                if scanned:
+                    printerr()
+
+                cursor.execute(
+                    'SELECT name FROM mediacenter_files '
+                    'WHERE name NOT IN '
+                    '(SELECT {0} FROM {2} WHERE {0} IS NOT NULL) '
+                    'AND name NOT IN '
+                    '(SELECT {1} FROM {2} WHERE {1} IS NOT NULL) '
+                    'ORDER BY name'.format(
+                        qn('original'), qn('preview'), table))
+
+                while True:
+                    rows = cursor.fetchmany(CHUNK_SIZE)
+                    if not rows:
+                        break
+                    for name, in rows:
+                        yield name
+
+            finally:
+                cursor.execute('DROP TABLE mediacenter_files')
@@ -1,17 +1,22 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 import codecs
 import csv
+import json
 import mimetypes
 import os
 import sys
 
 from django.core.files import File
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import translation
 from progressist import ProgressBar
 
 from ideascube.mediacenter.models import Document
 from ideascube.mediacenter.forms import DocumentForm
 from ideascube.mediacenter.utils import guess_kind_from_content_type
+from ideascube.search.utils import deferred_indexing
 from ideascube.templatetags.ideascube_tags import smart_truncate
 from ideascube.management.utils import Reporter
 
@@ -34,6 +39,13 @@ class Command(BaseCommand):
                             help='Define csv encoding.')
         parser.add_argument('--dry-run', action='store_true',
                             help='Only check data, do not save.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of medias saved in each transaction.')
+        parser.add_argument('--jobs', type=int, default=4,
+                            help='Number of medias copied at the same time.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Import all the medias again, even when a '
+                                 'previous import was interrupted.')
 
     def abort(self, msg):
         self.stderr.write(msg)
@@ -41,12 +53,12 @@ class Command(BaseCommand):
 
     def load(self, path):
         with codecs.open(path, 'r', encoding=self.encoding) as f:
-            content = f.read()
             try:
-                dialect = csv.Sniffer().sniff(content)
+                dialect = csv.Sniffer().sniff(f.read(64 * 1024))
             except csv.Error:
                 dialect = csv.unix_dialect()
-            return csv.DictReader(content.splitlines(), dialect=dialect)
+            f.seek(0)
+            yield from csv.DictReader(f, dialect=dialect)
 
     def handle(self, *args, **options):
         path = os.path.abspath(options['path'])
@@ -57,15 +69,94 @@ class Command(BaseCommand):
         if not os.path.exists(path):
             self.abort('Path does not exist: {}'.format(path))
         self.ROOT = os.path.dirname(path)
-        rows = list(self.load(path))
-        bar = Bar(total=sum(1 for i in rows))
-        for row in bar.iter(rows):
-            self.add(row)
+        self.checkpoint_path = '{}.checkpoint'.format(path)
+
+        # The forms are validated in other threads
+        self.language = translation.get_language()
+
+        # The documents which were already imported, instead of one query
+        # per row. Like Document.objects.filter(...).last(), the last one
+        # in the default ordering wins.
+        self.documents = {}
+        for title, kind, pk in Document.objects.values_list(
+                'title', 'kind', 'pk'):
+            self.documents[(title, kind)] = pk
+
+        done = 0
+        if not self.dry_run and not options['restart']:
+            done = self.load_checkpoint(path)
+            if done:
+                print('Resuming the import after {} rows'.format(done))
+
+        bar = Bar(total=sum(1 for i in self.load(path)))
+        batch = []
+        with ThreadPoolExecutor(max_workers=options['jobs']) as executor:
+            for i, row in enumerate(bar.iter(self.load(path))):
+                if i < done:
+                    continue
+
+                key = self.prepare(row)
+                if key is None:
+                    continue
+
+                if key in [metadata['key'] for metadata in batch]:
+                    # The previous row must be imported before this one can
+                    # find it
+                    self.add(executor, batch, path, i)
+                    batch = []
+
+                    if key in self.documents and not self.update:
+                        self.report.warning(
+                            'Document exists (Use --update for reimport)',
+                            row['title'])
+                        continue
+
+                batch.append(row)
+                if len(batch) >= options['batch_size']:
+                    self.add(executor, batch, path, i + 1)
+                    batch = []
+
+            if batch:
+                self.add(executor, batch, path, None)
+
+        if not self.dry_run and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
         print(self.report)
         if self.report.has_errors():
             sys.exit(1)
 
-    def add(self, metadata):
+    def load_checkpoint(self, path):
+        """Return the number of rows imported before an interruption"""
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return 0
+
+        stat = os.stat(path)
+        if checkpoint.get('size') != stat.st_size or (
+                checkpoint.get('mtime') != stat.st_mtime):
+            # This is not the file which was being imported
+            return 0
+
+        return checkpoint.get('rows', 0)
+
+    def save_checkpoint(self, path, rows):
+        stat = os.stat(path)
+        tmp_path = '{}.tmp'.format(self.checkpoint_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(
+                {'size': stat.st_size, 'mtime': stat.st_mtime, 'rows': rows},
+                f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def prepare(self, metadata):
+        """Check the metadata of a row
+
+        Return the title and kind of the document, or None if it must not be
+        imported.
+        """
         title = metadata.get('title').strip()
         if not title:
             self.report.error('Missing title', metadata)
@@ -88,56 +179,115 @@ class Command(BaseCommand):
             kind = guess_kind_from_content_type(content_type) or Document.OTHER
             metadata['kind'] = kind
 
-        instance = Document.objects.filter(title=title, kind=kind).last()
-        if instance and not self.update:
+        if (title, kind) in self.documents and not self.update:
             self.report.warning('Document exists (Use --update for reimport)',
                                 title)
             return
 
+        metadata['key'] = (title, kind)
+        return metadata['key']
+
+    def add(self, executor, batch, path, rows):
+        """Import a batch of rows
+
+        The files are checked and copied in parallel, then the documents
+        are saved in a single transaction, and indexed all at once.
+
+        Once they are saved, the number of rows done is written to the
+        checkpoint, unless the file is done (rows is None).
+        """
+        pks = [self.documents.get(metadata.pop('key')) for metadata in batch]
+        instances = Document.objects.in_bulk([pk for pk in pks if pk])
+        opened = []
+        try:
+            forms = []
+            for metadata, pk in zip(batch, pks):
+                form = self.get_form(metadata, instances.get(pk), opened)
+                if form is not None:
+                    forms.append((metadata, form))
+
+            checks = [executor.submit(self.check, form) for _, form in forms]
+            valid = []
+            for (metadata, form), check in zip(forms, checks):
+                errors = check.result()
+                for error in errors:
+                    self.report.error(error, metadata)
+                if not errors:
+                    valid.append((metadata, form))
+        finally:
+            for f in opened:
+                f.close()
+
+        if self.dry_run:
+            for metadata, _ in valid:
+                self.report.notice('Metadata valid', metadata['title'])
+            return
+
+        with deferred_indexing():
+            with transaction.atomic():
+                for _, form in valid:
+                    doc = form.save()
+                    self.documents[(doc.title, doc.kind)] = doc.pk
+                    self.report.notice('Uploaded media', str(doc))
+
+        if rows is not None:
+            self.save_checkpoint(path, rows)
+
+    def get_form(self, metadata, instance, opened):
+        original = metadata.get('path')
         original_path = os.path.join(self.ROOT, original)
         preview = metadata.get('preview')
         preview_path = os.path.join(self.ROOT, preview) if preview else None
         of = pf = None
+
         try:
+            of = open(original_path, 'rb')
+            opened.append(of)
+        except OSError as e:
+            self.report.error("Cannot open path", e)
+
+        if preview:
             try:
-                of = open(original_path, 'rb')
+                pf = open(preview_path, 'rb')
+                opened.append(pf)
             except OSError as e:
                 self.report.error("Cannot open path", e)
 
-            if preview:
-                try:
-                    pf = open(preview_path, 'rb')
-                except OSError as e:
-                    self.report.error("Cannot open path", e)
-
-            if not of:
-                return
-            if preview and not pf:
-                return
-
-            original = File(of, name=original)
-            if pf:
-                preview = File(pf, name=preview)
-                self.save(metadata, original, instance, preview)
-            else:
-                self.save(metadata, original, instance)
-        finally:
-            if of is not None:
-                of.close()
-            if pf is not None:
-                pf.close()
+        if not of:
+            return
+        if preview and not pf:
+            return
 
-    def save(self, metadata, original, instance, preview=None):
-        files = dict(original=original, preview=preview)
-        form = DocumentForm(data=metadata, files=files, instance=instance)
+        files = dict(original=File(of, name=original), preview=None)
+        if pf:
+            files['preview'] = File(pf, name=preview)
 
-        if form.is_valid():
-            if self.dry_run:
-                self.report.notice('Metadata valid', metadata['title'])
-            else:
-                doc = form.save()
-                self.report.notice('Uploaded media', str(doc))
-        else:
-            for field, error in form.errors.items():
-                self.report.error('{}: {}'.format(field, error.as_text()),
-                                  metadata)
+        return DocumentForm(data=metadata, files=files, instance=instance)
+
+    def check(self, form):
+        """Validate the form of a document and copy its files
+
+        Return the validation errors.
+
+        This runs in the thread pool. The validation can query the
+        database, with connections of its own to each thread, which are
+        closed when done.
+        """
+        try:
+            with translation.override(self.language):
+                if not form.is_valid():
+                    return [
+                        '{}: {}'.format(field, error.as_text())
+                        for field, error in form.errors.items()]
+
+            if not self.dry_run:
+                for name in ('original', 'preview'):
+                    # What saving the document would do, one file at a time
+                    file = getattr(form.instance, name)
+                    if file and not file._committed:
+                        file.save(file.name, file.file, save=False)
+
+            return []
+
+        finally:
+            connections.close_all()
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import ideascube.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediacenter', '0016_auto_20170921_1402'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='original',
+            field=models.FileField(help_text='Maximum size : 500 Mo.', max_length=10240, storage=ideascube.storage.DeduplicatedStorage(), upload_to='mediacenter/document', verbose_name='Source file'),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='preview',
+            field=models.ImageField(blank=True, max_length=10240, storage=ideascube.storage.DeduplicatedStorage(), upload_to='mediacenter/preview', verbose_name='Preview picture'),
+        ),
+    ]
@@ -7,6 +7,8 @@ from taggit.managers import TaggableManager
 from ideascube.models import (
     LanguageField, SortedTaggableManager, TimeStampedModel)
 from ideascube.search.models import SearchableQuerySet, SearchMixin
+from ideascube.search.utils import html_to_text
+from ideascube.storage import deduplicated_storage
 
 
 class DocumentQuerySet(SearchableQuerySet, models.QuerySet):
@@ -58,10 +60,12 @@ class Document(SearchMixin, TimeStampedModel):
     lang = LanguageField(verbose_name=_('Language'), max_length=10, blank=True)
     original = models.FileField(verbose_name=_('Source file'),
                                 upload_to='mediacenter/document',
+                                storage=deduplicated_storage,
                                 max_length=10240,
                                 help_text=_('Maximum size : 500 Mo.'))
     preview = models.ImageField(verbose_name=_('Preview picture'),
                                 upload_to='mediacenter/preview',
+                                storage=deduplicated_storage,
                                 max_length=10240,
                                 blank=True)
     credits = models.CharField(verbose_name=_('Authorship'),
@@ -76,6 +80,8 @@ class Document(SearchMixin, TimeStampedModel):
     tags = TaggableManager(verbose_name=_('Topics'),
                            blank=True,
                            manager=SortedTaggableManager)
+    index_prefetch = ('tags',)
+    thumbnail_fields = ('original', 'preview')
 
     package_id = models.CharField(verbose_name=_('package'), max_length=100,
                                   blank=True)
@@ -93,10 +99,14 @@ class Document(SearchMixin, TimeStampedModel):
     def get_absolute_url(self):
         return reverse('mediacenter:document_detail', kwargs={'pk': self.pk})
 
+    @property
+    def index_title(self):
+        return self.title
+
     @property
     def index_strings(self):
-        return (self.title, self.summary, self.credits,
-                u' '.join(self.tags.names()))
+        names = [tag.name for tag in self.tags.all()]
+        return (html_to_text(self.summary), self.credits, u' '.join(names))
 
     @property
     def index_lang(self):
@@ -116,7 +126,8 @@ class Document(SearchMixin, TimeStampedModel):
 
     @property
     def index_tags(self):
-        return list(self.tags.slugs()) + list(self.tags.names())
+        tags = self.tags.all()
+        return [tag.slug for tag in tags] + [tag.name for tag in tags]
 
     @property
     def slug(self):
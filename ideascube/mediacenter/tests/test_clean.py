@@ -11,6 +11,7 @@ from django.core.files import File
 
 from ideascube.mediacenter.models import Document
 from ideascube.mediacenter.forms import DocumentForm
+from ideascube.thumbnails import get_thumbnail
 from .factories import DocumentFactory
 
 pytestmark = pytest.mark.django_db
@@ -324,3 +325,83 @@ def test_clean_media_by_type_and_dates():
     assert dt2_documents.filter(kind=Document.AUDIO).count() == 0
     assert dt2_documents.filter(kind=Document.OTHER).count() == 2
     assert dt2_documents.filter(kind=Document.VIDEO).count() == 0
+
+
+def test_clean_leftover_should_scan_the_files_in_chunks(settings, mocker, capsys):
+    mocker.patch(
+        'ideascube.mediacenter.management.commands.clean.CHUNK_SIZE', 2)
+    documents = [
+        DocumentFactory(original__from_path=os.path.join(DATA_PATH, 'a-video.mp4'),
+                        preview__from_path=os.path.join(DATA_PATH, 'an-image.jpg'))
+        for i in range(3)]
+    leftover = Path(settings.MEDIA_ROOT, 'mediacenter/document/sub/dir/file')
+    leftover.parent.mkdir(parents=True)
+    leftover.touch()
+    Path(settings.MEDIA_ROOT, 'mediacenter/preview/other').touch()
+    call_command('clean', 'leftover-files')
+    for document in documents:
+        assert os.path.exists(document.original.path)
+        assert os.path.exists(document.preview.path)
+    assert not leftover.exists()
+    assert not leftover.parent.parent.exists()
+    assert not Path(settings.MEDIA_ROOT, 'mediacenter/preview/other').exists()
+    _, err = capsys.readouterr()
+    assert 'Scanned 8 files' in err
+
+
+def test_clean_leftover_should_list_the_files_without_scandir(settings, monkeypatch):
+    # Like on Python 3.4
+    monkeypatch.setattr(
+        'ideascube.mediacenter.management.commands.clean.scandir', None)
+    document = DocumentFactory(
+        original__from_path=os.path.join(DATA_PATH, 'a-video.mp4'))
+    leftover = Path(settings.MEDIA_ROOT, 'mediacenter/document/sub/dir/file')
+    leftover.parent.mkdir(parents=True)
+    leftover.touch()
+    call_command('clean', 'leftover-files')
+    assert os.path.exists(document.original.path)
+    assert not leftover.parent.parent.exists()
+
+
+def test_clean_leftover_should_remove_the_thumbnails(settings):
+    settings.THUMBNAIL_WIDTHS = (10,)
+    with open(os.path.join(DATA_PATH, 'an-image.jpg'), 'rb') as f:
+        document = Document.objects.create(
+            title='An image', original=File(f, name='an-image.jpg'))
+    thumbnail = Path(settings.MEDIA_ROOT, get_thumbnail(document.original.name, 10))
+    assert thumbnail.exists()
+    Document.objects.all().delete()
+    call_command('clean', 'leftover-files')
+    assert not thumbnail.exists()
+
+
+def test_clean_leftover_should_remove_the_unused_deduplicated_contents(settings):
+    settings.MEDIA_DEDUPLICATION = True
+    documents = [
+        DocumentFactory(original__from_path=os.path.join(DATA_PATH, 'a-video.mp4'))
+        for i in range(2)]
+    original_path = documents[0].original.path
+    assert os.stat(original_path).st_nlink == 3
+    documents[1].delete()
+    call_command('clean', 'leftover-files')
+    assert os.stat(original_path).st_nlink == 2
+    documents[0].delete()
+    call_command('clean', 'leftover-files')
+    assert not os.path.exists(original_path)
+    assert not list(Path(settings.MEDIA_ROOT, 'blobs').glob('*/*'))
+
+
+def test_clean_leftover_should_keep_the_deduplicated_contents_of_forms(settings):
+    settings.MEDIA_DEDUPLICATION = True
+    kept = create_document('')
+    removed = create_document('')
+    removed_path = removed.original.path
+    removed.delete()
+    call_command('clean', 'leftover-files')
+    assert not os.path.exists(removed_path)
+    assert os.path.exists(kept.original.path)
+    assert os.stat(kept.original.path).st_nlink == 2
+    assert os.stat(kept.preview.path).st_nlink == 2
+    with open(kept.original.path, 'rb') as f:
+        with open(os.path.join(DATA_PATH, 'a-video.mp4'), 'rb') as expected:
+            assert f.read() == expected.read()
@@ -4,6 +4,8 @@ from django.core.management import call_command
 
 import pytest
 
+from ideascube.mediacenter.forms import DocumentForm
+from ideascube.mediacenter.management.commands.import_medias import Command
 from ideascube.mediacenter.models import Document
 
 pytestmark = pytest.mark.django_db
@@ -16,8 +18,9 @@ def write_metadata(metadata):
 
 
 def teardown_function(function):
-    if os.path.exists(CSV_PATH):
-        os.remove(CSV_PATH)
+    for path in (CSV_PATH, CSV_PATH + '.checkpoint'):
+        if os.path.exists(path):
+            os.remove(path)
 
 
 def test_should_import_medias():
@@ -183,3 +186,116 @@ def test_import_media_allow_subdir():
     for document in Document.objects.all():
         assert os.path.dirname(document.original.path).endswith('/subdir')
         assert os.path.dirname(document.preview.path).endswith('/subdir')
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('batch_size', [1, 2, 100])
+def test_should_import_medias_in_batches(batch_size, jobs):
+    metadata = ('kind,title,summary,credits,path,lang\n'
+                'video,my video,my video summary,BSF,a-video.mp4,ar\n'
+                'pdf,my doc,my doc summary,BSF,a-pdf.pdf,en\n'
+                'image,my image,my image summary,BSF,an-image.jpg,es\n')
+    write_metadata(metadata)
+    call_command(
+        'import_medias', CSV_PATH, batch_size=batch_size, jobs=jobs)
+    assert sorted(Document.objects.values_list('title', flat=True)) == [
+        'my doc', 'my image', 'my video']
+    assert Document.objects.search('summary').count() == 3
+    assert not os.path.exists(CSV_PATH + '.checkpoint')
+
+
+def test_should_not_import_twice_a_media_of_the_same_file():
+    metadata = ('kind,title,summary,credits,path,lang\n'
+                'video,my video,my video summary,BSF,a-video.mp4,ar\n'
+                'video,my video,another summary,BSF,a-video.mp4,ar\n')
+    write_metadata(metadata)
+    call_command('import_medias', CSV_PATH)
+    assert Document.objects.get().summary == 'my video summary'
+
+
+def test_should_update_twice_a_media_of_the_same_file():
+    metadata = ('kind,title,summary,credits,path,lang\n'
+                'video,my video,my video summary,BSF,a-video.mp4,ar\n'
+                'video,my video,another summary,BSF,a-video.mp4,ar\n')
+    write_metadata(metadata)
+    call_command('import_medias', CSV_PATH, update=True)
+    assert Document.objects.get().summary == 'another summary'
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_should_resume_an_interrupted_import(mocker, jobs):
+    metadata = ('kind,title,summary,credits,path,lang\n'
+                'video,my video,my video summary,BSF,a-video.mp4,ar\n'
+                'pdf,my doc,my doc summary,BSF,a-pdf.pdf,en\n'
+                'image,my image,my image summary,BSF,an-image.jpg,es\n')
+    write_metadata(metadata)
+    save = DocumentForm.save
+
+    def interrupt(form, *args, **kwargs):
+        if form.data['title'] == 'my image':
+            raise KeyboardInterrupt
+        return save(form, *args, **kwargs)
+
+    mocker.patch.object(DocumentForm, 'save', interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        call_command('import_medias', CSV_PATH, batch_size=1, jobs=jobs)
+
+    assert Document.objects.count() == 2
+    assert os.path.exists(CSV_PATH + '.checkpoint')
+
+    mocker.stopall()
+    Document.objects.filter(title='my doc').delete()
+    call_command('import_medias', CSV_PATH, batch_size=1, jobs=jobs)
+    assert sorted(Document.objects.values_list('title', flat=True)) == [
+        'my image', 'my video']
+    assert not os.path.exists(CSV_PATH + '.checkpoint')
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_should_resume_an_import_interrupted_while_copying(mocker, jobs):
+    metadata = ('kind,title,summary,credits,path,lang\n'
+                'video,my video,my video summary,BSF,a-video.mp4,ar\n'
+                'pdf,my doc,my doc summary,BSF,a-pdf.pdf,en\n'
+                'image,my image,my image summary,BSF,an-image.jpg,es\n')
+    write_metadata(metadata)
+    check = Command.check
+
+    def interrupt(command, form):
+        if form.data['title'] == 'my doc':
+            raise KeyboardInterrupt
+        return check(command, form)
+
+    mocker.patch.object(Command, 'check', interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        call_command('import_medias', CSV_PATH, batch_size=2, jobs=jobs)
+
+    assert not Document.objects.count()
+    assert not os.path.exists(CSV_PATH + '.checkpoint')
+
+    mocker.stopall()
+    call_command('import_medias', CSV_PATH, batch_size=2, jobs=jobs)
+    assert sorted(Document.objects.values_list('title', flat=True)) == [
+        'my doc', 'my image', 'my video']
+    assert not os.path.exists(CSV_PATH + '.checkpoint')
+
+
+def test_should_restart_an_interrupted_import():
+    metadata = ('kind,title,summary,credits,path,lang\n'
+                'video,my video,my video summary,BSF,a-video.mp4,ar\n')
+    write_metadata(metadata)
+    with open(CSV_PATH + '.checkpoint', 'w') as f:
+        stat = os.stat(CSV_PATH)
+        f.write('{"size": %d, "mtime": %r, "rows": 1}' % (
+            stat.st_size, stat.st_mtime))
+
+    call_command('import_medias', CSV_PATH)
+    assert not Document.objects.count()
+
+    with open(CSV_PATH + '.checkpoint', 'w') as f:
+        f.write('{"size": %d, "mtime": %r, "rows": 1}' % (
+            stat.st_size, stat.st_mtime))
+
+    call_command('import_medias', CSV_PATH, restart=True)
+    assert Document.objects.count() == 1
@@ -50,21 +50,14 @@ class Index(NoHiddenDocumentMixin, FilterableViewMixin, OrderableViewMixin, List
     template_name = 'mediacenter/index.html'
     paginate_by = 24
 
-    def _set_available_kinds(self, context):
-        available_kinds = self._search_for_attr_from_context('kind', context)
-        context['available_kinds'] = [
-            (kind, label) for kind, label in Document.KIND_CHOICES
-            if kind in available_kinds]
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         # This tells the search system to not look at hidden documents
         context['public'] = True
 
-        self._set_available_kinds(context)
-        self._set_available_langs(context)
-        self._set_available_tags(context, limit=100)
+        self._set_facets(
+            context, tags_limit=100, kinds=Document.KIND_CHOICES)
         # We assume that if there is a source, it is a package_id.
         package_id = context.get('source')
         if package_id:
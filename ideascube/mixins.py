@@ -1,4 +1,3 @@
-from collections import Counter
 import csv
 from io import BytesIO, StringIO
 from datetime import datetime
@@ -43,38 +42,41 @@ class OrderableViewMixin:
 
 class FilterableViewMixin:
 
-    def _search_for_attr_from_context(self, attr, context):
+    def _get_facets(self, context, tags_limit=None):
         search = {'model': self.model.__name__}
         if context.get('q'):
             search['text__match'] = context['q']
-        if context.get('kind') and attr != 'kind':
+        if context.get('kind'):
             search['kind'] = context['kind']
-        if context.get('lang') and attr != 'lang':
+        if context.get('lang'):
             search['lang'] = context['lang']
-        if context.get('source') and attr != 'source':
+        if context.get('source'):
             search['source'] = context['source']
         if context.get('tags'):
             search['tags__match'] = context['tags']
         if context.get('public') is not None:
             search['public'] = context['public']
-        return Search.objects.filter(**search).values_list(attr, flat=True).distinct()
+        return Search.facets(tags_limit=tags_limit, **search)
 
-    def _set_available_langs(self, context):
-        available_langs = self._search_for_attr_from_context('lang', context)
+    def _set_facets(self, context, tags_limit=20, kinds=None):
+        """Set the available filters, with the number of matching objects
+
+        The kinds are only set if their (value, label) choices are given.
+        """
+        facets = self._get_facets(context, tags_limit=tags_limit)
+        context['facets'] = facets
         context['available_langs'] = [
             (lang, LANG_INFO.get(lang, {}).get('name_local', lang))
-            for lang in available_langs]
-
-    def _set_available_tags(self, context, limit=20):
-        all_ = Counter()
-        for slugs in self._search_for_attr_from_context('tags', context):
-            for slug in slugs.strip('|').split('|'):
-                if not slug:
-                    continue
-                all_[slug] += 1
-        common = [slug for slug, count in all_.most_common(limit)]
+            for lang, count in facets['lang']]
+        common = [slug for slug, count in facets['tags']]
         context['available_tags'] = Tag.objects.filter(slug__in=common)
 
+        if kinds is not None:
+            available_kinds = dict(facets['kind'])
+            context['available_kinds'] = [
+                (kind, label) for kind, label in kinds
+                if kind in available_kinds]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         for key in ('q', 'kind', 'lang', 'source'):
@@ -15,6 +15,8 @@ from taggit.managers import _TaggableManager
 
 from ideascube.search.models import SearchMixin, SearchableQuerySet
 
+# Registers the generation of the thumbnails
+from . import thumbnails  # noqa
 from .utils import classproperty, get_all_languages
 
 
@@ -340,8 +342,22 @@ class User(SearchMixin, TimeStampedModel, AbstractBaseUser):
 
 
 class SortedTaggableManager(_TaggableManager):
+    def _is_prefetched(self):
+        try:
+            return self.is_cached(self.instance)
+
+        except AttributeError:
+            # Nothing was ever prefetched on this instance
+            return False
+
     def get_queryset(self, *args, **kwargs):
         qs = super().get_queryset(*args, **kwargs)
+
+        if self._is_prefetched():
+            # The prefetch queryset was already sorted (it goes through this
+            # method too), sorting again would throw the cache away.
+            return qs
+
         return qs.order_by('name')
 
 
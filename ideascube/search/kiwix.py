@@ -0,0 +1,176 @@
+"""Search the ZIM files served by kiwix-serve, along with the index
+
+The ZIM files are the ones listed in the library.xml file which the Kiwix
+catalog handler writes. Each of them is searched through the search
+endpoint of kiwix-serve, all of them concurrently.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
+import logging
+import os
+from urllib.error import URLError
+from urllib.parse import urlencode, urljoin
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.cache import cache
+from lxml import etree
+
+
+logger = logging.getLogger(__name__)
+
+# The damping of the reciprocal rank fusion: the higher, the less the first
+# results of each list weigh compared to the next ones
+RRF_K = 60
+
+
+class KiwixResult(object):
+    """A page of a ZIM file matching a search"""
+    def __init__(self, book_title, title, url, snippet=''):
+        self.slug = book_title
+        self.title = title
+        self.url = url
+        self.snippet = snippet
+
+    def __str__(self):
+        return self.title
+
+    def __eq__(self, other):
+        return isinstance(other, KiwixResult) and self.url == other.url
+
+    def __repr__(self):
+        return '<KiwixResult: {}>'.format(self.url)
+
+    def get_absolute_url(self):
+        return self.url
+
+
+def _get_library_path():
+    # Where the Kiwix catalog handler installs the ZIM files
+    install_dir = getattr(
+        settings, 'CATALOG_KIWIX_INSTALL_DIR',
+        os.path.join(settings.STORAGE_ROOT, 'kiwix'))
+    return os.path.join(install_dir, 'library.xml')
+
+
+def get_books():
+    """Return the (name, title) of the installed ZIM files
+
+    The name is the one kiwix-serve knows them by, that is the name of their
+    file without the extension.
+    """
+    try:
+        library = etree.parse(_get_library_path())
+
+    except (OSError, etree.XMLSyntaxError):
+        return []
+
+    books = []
+
+    for book in library.findall('book'):
+        name = os.path.basename(book.get('path', ''))
+
+        if name.endswith('.zim'):
+            name = name[:-4]
+
+        if name:
+            books.append((name, book.get('title') or name))
+
+    return books
+
+
+def _parse_results(content):
+    """Parse the OpenSearch RSS results of kiwix-serve"""
+    results = []
+
+    for item in etree.fromstring(content).findall('channel/item'):
+        results.append({
+            'title': item.findtext('title', ''),
+            'url': urljoin(
+                settings.KIWIX_SERVER_URL, item.findtext('link', '')),
+            'snippet': item.findtext('description', ''),
+        })
+
+    return results
+
+
+def search_book(name, query, limit):
+    """Return the results of a ZIM file for a query, as dicts
+
+    They are cached for a while, so are the failures, so that an unavailable
+    kiwix-serve does not slow down all the searches.
+    """
+    key = 'kiwix-search:{}'.format(hashlib.md5(
+        '{}|{}|{}'.format(name, query, limit).encode('utf-8')).hexdigest())
+    results = cache.get(key)
+
+    if results is not None:
+        return results
+
+    url = '{}/search?{}'.format(settings.KIWIX_SERVER_URL, urlencode({
+        'content': name, 'pattern': query, 'pageLength': limit,
+        'format': 'xml'}))
+
+    try:
+        with urlopen(url, timeout=settings.KIWIX_SEARCH_TIMEOUT) as response:
+            results = _parse_results(response.read())[:limit]
+
+    except (OSError, URLError, etree.XMLSyntaxError) as e:
+        logger.warning('Could not search %s: %s', name, e)
+        results = []
+
+    cache.set(key, results, settings.KIWIX_SEARCH_CACHE_TIMEOUT)
+    return results
+
+
+def search_kiwix(query, limit=None):
+    """Search all the installed ZIM files for a query
+
+    Return a list of KiwixResult for each ZIM file, in the order of the
+    library. The ZIM files are searched concurrently, the ones which did not
+    answer within KIWIX_SEARCH_TIMEOUT have no results.
+    """
+    books = get_books()
+
+    if not books or not query:
+        return []
+
+    if limit is None:
+        limit = settings.KIWIX_SEARCH_RESULTS
+
+    executor = ThreadPoolExecutor(max_workers=min(len(books), 8))
+    futures = [
+        executor.submit(search_book, name, query, limit)
+        for name, _ in books]
+
+    # Do not wait for the slow ones, their threads finish on their own
+    wait(futures, timeout=settings.KIWIX_SEARCH_TIMEOUT)
+    executor.shutdown(wait=False)
+    results = []
+
+    for (_, title), future in zip(books, futures):
+        if not future.done() or future.exception() is not None:
+            results.append([])
+            continue
+
+        results.append([
+            KiwixResult(title, **result) for result in future.result()])
+
+    return results
+
+
+def merge_results(*ranked_lists):
+    """Merge lists of results, each ranked by its own relevancy
+
+    The scores of the various search engines can't be compared, so this uses
+    the reciprocal rank fusion: each result scores according to its rank in
+    its list. Equal scores are in the order of the lists.
+    """
+    scored = []
+
+    for index, results in enumerate(ranked_lists):
+        for rank, result in enumerate(results):
+            scored.append((-1 / (RRF_K + rank + 1), index, rank, result))
+
+    scored.sort(key=lambda item: item[:3])
+    return [item[-1] for item in scored]
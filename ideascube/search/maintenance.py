@@ -0,0 +1,485 @@
+from collections import defaultdict
+import logging
+import threading
+import time
+import zlib
+
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .utils import (
+    INDEX_BATCH_SIZE, create_index_table, format_modified_at,
+    get_last_modified_at, has_fts5, set_watermark, update_index)
+
+
+logger = logging.getLogger(__name__)
+
+
+# The objects are compared by ranges of that many primary keys, only the
+# ranges which differ are then compared object by object
+VERIFY_BUCKET_SIZE = 1000
+
+# The number of pages of the full-text index written by each merge step,
+# which is as long as the index is locked for writing
+MERGE_PAGES = 200
+
+# The FTS5 structure record, which lists the segments of the index
+FTS5_STRUCTURE_ROWID = 10
+
+# The states of the index after its last consistency check
+CONSISTENT = 'consistent'
+REPAIRING = 'repairing'
+REPAIRED = 'repaired'
+REPAIR_FAILED = 'failed'
+
+# Held while the index is being checked and repaired, once at a time
+_healing = threading.Lock()
+
+
+def _update_index(model_name, pks):
+    pks = sorted(pks)
+
+    for i in range(0, len(pks), INDEX_BATCH_SIZE):
+        update_index(model_name, pks[i:i + INDEX_BATCH_SIZE])
+
+
+def _get_versions(model, pk_range=None):
+    """Yield the (pk, modified_at) of the objects of a model"""
+    qs = model._default_manager.order_by()
+
+    if pk_range is not None:
+        qs = qs.filter(pk__gte=pk_range[0], pk__lt=pk_range[1])
+
+    if get_last_modified_at(model) is None:
+        for pk in qs.values_list('pk', flat=True).iterator():
+            yield pk, None
+
+        return
+
+    for pk, modified_at in qs.values_list('pk', 'modified_at').iterator():
+        yield pk, format_modified_at(modified_at)
+
+
+def _get_indexed_versions(model_name, pk_range=None):
+    """Yield the (object_id, modified_at) of the index entries of a model"""
+    sql = 'SELECT object_id, modified_at FROM idx_meta WHERE model = %s'
+    params = [model_name]
+
+    if pk_range is not None:
+        sql += ' AND object_id >= %s AND object_id < %s'
+        params.extend(pk_range)
+
+    with connections['transient'].cursor() as cursor:
+        cursor.execute(sql, params)
+        yield from cursor.fetchall()
+
+
+def _get_checksums(versions):
+    """Return the number of objects and their checksum, by range of pks"""
+    buckets = defaultdict(lambda: (0, 0))
+
+    for pk, modified_at in versions:
+        count, checksum = buckets[pk // VERIFY_BUCKET_SIZE]
+        version = '{}|{}'.format(pk, modified_at).encode('utf-8')
+        buckets[pk // VERIFY_BUCKET_SIZE] = (
+            count + 1, checksum ^ zlib.crc32(version))
+
+    return buckets
+
+
+def verify_index(model):
+    """Return the pks of the objects of a model which are not indexed as
+    they are now
+
+    That is the objects missing from the index, the ones indexed before
+    their last modification and the deleted ones.
+    The objects and the index entries are first compared by counts and
+    checksums of ranges of pks.
+    """
+    name = model.__name__
+    objects = _get_checksums(_get_versions(model))
+    indexed = _get_checksums(_get_indexed_versions(name))
+    outdated = set()
+
+    for bucket in set(objects) | set(indexed):
+        if objects.get(bucket) == indexed.get(bucket):
+            continue
+
+        pk_range = (
+            bucket * VERIFY_BUCKET_SIZE, (bucket + 1) * VERIFY_BUCKET_SIZE)
+        versions = list(_get_versions(model, pk_range))
+        indexed_versions = list(_get_indexed_versions(name, pk_range))
+
+        outdated.update(
+            pk for pk, _ in set(versions) ^ set(indexed_versions))
+
+    return outdated
+
+
+def reindex_incremental(verify=True, reporthook=None, model_names=None):
+    """Only reindex the objects modified or deleted since the last time
+
+    Objects modified after the watermark of their model are indexed again,
+    the deleted objects are removed from the index according to their
+    tombstones. With verify, the whole index is then compared to the
+    objects, and repaired.
+
+    The search index stays available all along.
+
+    Only the models named in model_names are reindexed, if given.
+
+    The optional reporthook is called after each model with its name, the
+    number of updated objects, the number of repaired objects and the time
+    it took, in seconds.
+    """
+    from ideascube.search.models import SearchMixin
+    reindexed = {}
+
+    for model in SearchMixin.registered_types.values():
+        start = time.monotonic()
+        name = model.__name__
+
+        if model_names is not None and name not in model_names:
+            continue
+        watermark = get_last_modified_at(model)
+
+        with connections['transient'].cursor() as cursor:
+            cursor.execute(
+                'SELECT modified_at FROM idx_watermarks WHERE model = %s',
+                [name])
+            row = cursor.fetchone()
+            cursor.execute(
+                'SELECT object_id FROM idx_tombstones WHERE model = %s',
+                [name])
+            deleted = {pk for pk, in cursor.fetchall()}
+
+        if row is None or watermark is None:
+            # Never indexed, or not timestamped: everything has changed
+            modified = set(model._default_manager.values_list('pk', flat=True))
+
+        else:
+            modified = set(model._default_manager.filter(
+                modified_at__gt=parse_datetime(row[0])).values_list(
+                    'pk', flat=True))
+
+        _update_index(name, modified | deleted)
+
+        with transaction.atomic(using='transient'):
+            with connections['transient'].cursor() as cursor:
+                set_watermark(cursor, name, watermark)
+
+                if deleted:
+                    cursor.executemany(
+                        'DELETE FROM idx_tombstones '
+                        'WHERE model = %s AND object_id = %s',
+                        [(name, pk) for pk in deleted])
+
+        repaired = set()
+
+        if verify:
+            repaired = verify_index(model)
+            _update_index(name, repaired)
+
+        reindexed[name] = (len(modified | deleted), len(repaired))
+
+        if reporthook is not None:
+            reporthook(
+                name, len(modified | deleted), len(repaired),
+                time.monotonic() - start)
+
+    return reindexed
+
+
+def check_consistency():
+    """Compare the objects of each searchable model with their index entries
+
+    Return the names of the models whose number of objects or most recent
+    modification differ from the index, as after restoring a backup or
+    losing the transient database. This only counts, it is cheap.
+    """
+    from ideascube.search.models import SearchMixin
+    diverged = []
+
+    for name, model in sorted(SearchMixin.registered_types.items()):
+        expected = (
+            model._default_manager.count(), get_last_modified_at(model))
+
+        with connections['transient'].cursor() as cursor:
+            cursor.execute(
+                'SELECT count(*), max(modified_at) FROM idx_meta '
+                'WHERE model = %s', [name])
+            indexed = tuple(cursor.fetchone())
+
+        if indexed != expected:
+            diverged.append(name)
+
+    return diverged
+
+
+def get_index_health():
+    """Return the result of the last consistency check of the index
+
+    That is a dict with the state of the index, the names of the models
+    which diverged, when it was checked and when it was last repaired. None
+    if it was never checked.
+    """
+    try:
+        with connections['transient'].cursor() as cursor:
+            cursor.execute(
+                'SELECT state, models, checked_at, repaired_at '
+                'FROM idx_health')
+            row = cursor.fetchone()
+
+    except DatabaseError:
+        # There is no index at all
+        return None
+
+    if row is None:
+        return None
+
+    state, models, checked_at, repaired_at = row
+    return {
+        'state': state,
+        'models': models.split(',') if models else [],
+        'checked_at': parse_datetime(checked_at),
+        'repaired_at': repaired_at and parse_datetime(repaired_at),
+    }
+
+
+def _set_index_health(state, model_names=None):
+    now = timezone.now().isoformat()
+
+    with connections['transient'].cursor() as cursor:
+        if model_names is None:
+            # The end of a repair
+            cursor.execute(
+                'UPDATE idx_health SET state = %s, repaired_at = %s',
+                [state, now])
+            return
+
+        cursor.execute(
+            'INSERT OR REPLACE INTO idx_health '
+            '(id, state, models, checked_at, repaired_at) '
+            'VALUES (1, %s, %s, %s, (SELECT repaired_at FROM idx_health))',
+            [state, ','.join(model_names), now])
+
+
+def _repair_index(model_names, background):
+    try:
+        reindex_incremental(verify=True, model_names=model_names)
+
+    except Exception:
+        logger.exception('Could not repair the search index')
+        _set_index_health(REPAIR_FAILED)
+
+    else:
+        _set_index_health(REPAIRED)
+
+    finally:
+        _healing.release()
+
+        if background:
+            # The connections of this thread would otherwise stay open
+            connections.close_all()
+
+
+def heal_index(background=True):
+    """Check the consistency of the index, and repair it if needed
+
+    The transient database is not backed up with the content, so the index
+    can get out of sync with it. This check is cheap, it is meant to run as
+    a recurring task, see the "search check" command.
+
+    The models which diverged are reindexed incrementally, in a thread
+    unless background is False, while the index stays available. The
+    outcome is recorded, see get_index_health().
+
+    Return the names of the models which diverged, or None if the index is
+    already being repaired.
+    """
+    if not _healing.acquire(blocking=False):
+        return None
+
+    try:
+        # The tables may have been lost with the transient database
+        create_index_table(force=False)
+        diverged = check_consistency()
+        _set_index_health(REPAIRING if diverged else CONSISTENT, diverged)
+
+    except Exception:
+        _healing.release()
+        raise
+
+    if not diverged:
+        _healing.release()
+
+    elif background:
+        threading.Thread(
+            target=_repair_index, args=(diverged, True),
+            name='search-index-repair').start()
+
+    else:
+        _repair_index(diverged, False)
+
+    return diverged
+
+
+def _read_varint(data, offset):
+    """Decode the SQLite variable-length integer at offset in data
+
+    Return it with the offset of the following byte.
+    """
+    value = 0
+
+    for i in range(8):
+        byte = data[offset + i]
+        value = (value << 7) | (byte & 0x7f)
+
+        if not byte & 0x80:
+            return value, offset + i + 1
+
+    return (value << 8) | data[offset + 8], offset + 9
+
+
+def _get_fts5_segments(structure):
+    """Return the number of segments on each level of an FTS5 index
+
+    See fts5StructureDecode in the SQLite sources for the format.
+    """
+    offset = 4  # The configuration cookie
+    fields_per_segment = 3
+
+    if structure[4:8] == b'\xff\xff\xff\xff':
+        # Newer SQLite versions also store the tombstones of each segment
+        offset += 4
+        fields_per_segment = 8
+
+    levels, offset = _read_varint(structure, offset)
+    _, offset = _read_varint(structure, offset)  # Total segments
+    _, offset = _read_varint(structure, offset)  # Write counter
+    segments = []
+
+    for _ in range(levels):
+        _, offset = _read_varint(structure, offset)  # Segments being merged
+        count, offset = _read_varint(structure, offset)
+        segments.append(count)
+
+        for _ in range(count * fields_per_segment):
+            _, offset = _read_varint(structure, offset)
+
+    return segments
+
+
+def get_index_segments():
+    """Return the number of segments of the full-text index, by level"""
+    with connections['transient'].cursor() as cursor:
+        if has_fts5():
+            cursor.execute(
+                'SELECT block FROM idx_data WHERE id = %s',
+                [FTS5_STRUCTURE_ROWID])
+            row = cursor.fetchone()
+            segments = _get_fts5_segments(bytes(row[0])) if row else []
+            return {
+                level: count for level, count in enumerate(segments)
+                if count}
+
+        cursor.execute('SELECT level, count(*) FROM idx_segdir GROUP BY level')
+        return dict(cursor.fetchall())
+
+
+def merge_index(pages=MERGE_PAGES, optimize=False, time_budget=None):
+    """Merge the segments of the full-text index, a few pages at a time
+
+    Each step is a short transaction writing about that many pages, so that
+    the index keeps being searched and updated in between. Levels of the
+    index with a few segments are merged, or all of them into a single one
+    with optimize.
+
+    Stop when there is nothing left to merge, or when the time budget (in
+    seconds) is spent. Return the number of steps which did some work.
+    """
+    connection = connections['transient']
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    steps = 0
+
+    if has_fts5():
+        # A negative number of pages makes FTS5 merge all the segments
+        sql = "INSERT INTO idx(idx, rank) VALUES ('merge', %s)"
+        params = [-pages if optimize else pages]
+
+    else:
+        sql = "INSERT INTO idx(idx) VALUES (%s)"
+        params = ['merge={},{}'.format(pages, 2 if optimize else 8)]
+
+    while deadline is None or time.monotonic() < deadline:
+        with transaction.atomic(using='transient'):
+            with connection.cursor() as cursor:
+                changes = connection.connection.total_changes
+                cursor.execute(sql, params)
+                changes = connection.connection.total_changes - changes
+
+        # The merge command itself counts as one change
+        if changes < 2:
+            break
+
+        steps += 1
+
+    return steps
+
+
+def check_index():
+    """Check the integrity of the index
+
+    Return the list of the problems found, empty if the index is fine.
+    """
+    problems = []
+
+    with connections['transient'].cursor() as cursor:
+        try:
+            cursor.execute("INSERT INTO idx(idx) VALUES ('integrity-check')")
+
+        except DatabaseError as e:
+            problems.append('The full-text index is corrupted: {}'.format(e))
+
+        cursor.execute('PRAGMA quick_check')
+        problems.extend(
+            'The index database is corrupted: {}'.format(message)
+            for message, in cursor.fetchall() if message != 'ok')
+
+        cursor.execute('SELECT count(*) FROM idx')
+        fulltext_count = cursor.fetchone()[0]
+        cursor.execute('SELECT count(*) FROM idx_meta')
+        meta_count = cursor.fetchone()[0]
+
+        if fulltext_count != meta_count:
+            problems.append(
+                'The full-text index has {} entries, but there are metadata '
+                'for {} entries'.format(fulltext_count, meta_count))
+
+    return problems
+
+
+def get_index_stats():
+    """Return the number of segments, the size and the entries of the index
+
+    The sizes are in bytes, for the whole transient database. The entries
+    are counted by model.
+    """
+    with connections['transient'].cursor() as cursor:
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_count')
+        size = cursor.fetchone()[0] * page_size
+        cursor.execute('PRAGMA freelist_count')
+        free = cursor.fetchone()[0] * page_size
+        cursor.execute(
+            'SELECT model, count(*) FROM idx_meta GROUP BY model ORDER BY model')
+        models = cursor.fetchall()
+
+    return {
+        'segments': get_index_segments(),
+        'size': size,
+        'free': free,
+        'models': models,
+    }
@@ -1,14 +1,55 @@
 from django.core.management.base import BaseCommand
 
+from ideascube.search.maintenance import reindex_incremental
 from ideascube.search.utils import reindex_content
 
 
 class Command(BaseCommand):
     help = 'Reindex all the searchable objects'
 
-    def handle(self, *args, **kwargs):
-        indexed = reindex_content()
-        for name, count in indexed.items():
-            if count:
-                self.stdout.write('Indexed {} content.'.format(name))
-        self.stdout.write('Done reindexing.')
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of objects to load from the database at once.')
+        parser.add_argument(
+            '--jobs', type=int, default=1,
+            help='Number of processes extracting the text to index.')
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help=('Only reindex the content modified or deleted since the '
+                  'last time, then verify and repair the index.'))
+        parser.add_argument(
+            '--no-verify', dest='verify', action='store_false',
+            help='Do not verify the index after an incremental reindexing.')
+
+    def report(self, name, count, duration):
+        if not count:
+            return
+
+        rate = count / duration if duration else count
+        self.stdout.write(
+            'Indexed {} {} content in {:.2f}s ({:.0f} per second).'.format(
+                count, name, duration, rate))
+
+    def report_incremental(self, name, count, repaired, duration):
+        if not count and not repaired:
+            return
+
+        self.stdout.write(
+            'Updated {} {} content and repaired {} in {:.2f}s.'.format(
+                count, name, repaired, duration))
+
+    def handle(self, *args, **options):
+        if options['incremental']:
+            reindexed = reindex_incremental(
+                verify=options['verify'], reporthook=self.report_incremental)
+            total = sum(count + repaired
+                        for count, repaired in reindexed.values())
+            self.stdout.write('Done reindexing {} objects.'.format(total))
+            return
+
+        indexed = reindex_content(
+            chunk_size=options['chunk_size'], jobs=options['jobs'],
+            reporthook=self.report)
+        total = sum(indexed.values())
+        self.stdout.write('Done reindexing {} objects.'.format(total))
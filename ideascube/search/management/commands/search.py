@@ -0,0 +1,107 @@
+import sys
+import time
+
+from ideascube.management.base import BaseCommandWithSubcommands
+from ideascube.search.maintenance import (
+    MERGE_PAGES, REPAIR_FAILED, check_index, get_index_health,
+    get_index_stats, heal_index, merge_index)
+from ideascube.search.spelling import build_trigram_index
+from ideascube.utils import printerr
+
+
+def format_size(size):
+    return '{:.1f} MiB'.format(size / 1024 / 1024)
+
+
+class Command(BaseCommandWithSubcommands):
+    help = 'Maintain the search index'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        maintain = self.subs.add_parser(
+            'maintain',
+            help=('Merge the segments of the full-text index, rebuild the '
+                  'spelling corrections and check the integrity of the '
+                  'index. This can run while the server is in use, and '
+                  'should be scheduled as a recurring task.'))
+        maintain.add_argument(
+            '--pages', type=int, default=MERGE_PAGES,
+            help='Number of pages of the index to merge at each step.')
+        maintain.add_argument(
+            '--time-budget', type=float,
+            help='Stop merging after that many seconds.')
+        maintain.add_argument(
+            '--optimize', action='store_true',
+            help='Merge all the segments of the index into a single one.')
+        maintain.add_argument(
+            '--no-check', dest='check', action='store_false',
+            help='Do not check the integrity of the index.')
+        maintain.set_defaults(func=self.maintain)
+
+        stats = self.subs.add_parser(
+            'stats', help='Print statistics about the search index')
+        stats.set_defaults(func=self.stats)
+
+        check = self.subs.add_parser(
+            'check',
+            help=('Check that the index is consistent with the content, and '
+                  'reindex what differs. This is cheap, and should be '
+                  'scheduled as a recurring task.'))
+        check.set_defaults(func=self.check)
+
+    def maintain(self, options):
+        start = time.monotonic()
+        steps = merge_index(
+            pages=options['pages'], optimize=options['optimize'],
+            time_budget=options['time_budget'])
+        self.stdout.write('Merged the index in {} steps ({:.2f}s).'.format(
+            steps, time.monotonic() - start))
+
+        start = time.monotonic()
+        terms = build_trigram_index()
+        self.stdout.write(
+            'Rebuilt the spelling corrections of {} terms ({:.2f}s).'.format(
+                terms, time.monotonic() - start))
+
+        self.stats(options)
+
+        if not options['check']:
+            return
+
+        problems = check_index()
+
+        if problems:
+            for problem in problems:
+                printerr(problem)
+
+            printerr('Run the "reindex" command to rebuild the index.')
+            sys.exit(1)
+
+        self.stdout.write('The index is consistent.')
+
+    def stats(self, options):
+        stats = get_index_stats()
+        segments = stats['segments']
+        self.stdout.write('Segments: {} ({})'.format(
+            sum(segments.values()), ', '.join(
+                'level {}: {}'.format(level, count)
+                for level, count in sorted(segments.items()))))
+        self.stdout.write('Size: {} ({} free)'.format(
+            format_size(stats['size']), format_size(stats['free'])))
+
+        for model, count in stats['models']:
+            self.stdout.write('{}: {} entries'.format(model, count))
+
+    def check(self, options):
+        diverged = heal_index(background=False)
+
+        if not diverged:
+            self.stdout.write('The index is consistent with the content.')
+            return
+
+        if get_index_health()['state'] == REPAIR_FAILED:
+            printerr('Could not reindex: {}'.format(', '.join(diverged)))
+            sys.exit(1)
+
+        self.stdout.write('Reindexed: {}.'.format(', '.join(diverged)))
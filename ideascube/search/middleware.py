@@ -0,0 +1,12 @@
+from .utils import deferred_indexing
+
+
+class DeferredIndexingMiddleware:
+    """Index the objects saved during a request only once, at its end"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deferred_indexing():
+            return self.get_response(request)
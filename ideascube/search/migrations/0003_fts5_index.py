@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from ideascube.search.utils import create_index_table
+
+
+def migrate(*_):
+    # Recreates the FTS4 index table with the new schema (FTS5 if available),
+    # the post_migrate signal will then reindex the content.
+    create_index_table(force=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('search', '0002_drop_old_index_table')]
+
+    operations = [
+        migrations.RunPython(
+            migrate, hints={'model_name': 'search', 'using': 'transient'}),
+    ]
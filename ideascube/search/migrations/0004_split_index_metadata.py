@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # The tables are not managed by Django, they are recreated with the new
+    # schema before migrating, and the post_migrate signal reindexes the
+    # content.
+
+    dependencies = [('search', '0003_fts5_index')]
+
+    operations = [
+        migrations.AlterModelTable(name='search', table='idx_meta'),
+        migrations.CreateModel(
+            name='SearchText',
+            fields=[],
+            options={
+                'db_table': 'idx',
+                'managed': False,
+            },
+        ),
+    ]
@@ -1,20 +1,38 @@
-from django.db import models
+from collections import Counter, OrderedDict
+import copy
+
+from django.core.signals import request_finished
+from django.db import connections, models
+from django.db.models import prefetch_related_objects
 from django.db.backends.signals import connection_created
 from django.db.models.signals import post_save, pre_delete
 from django.db.models.base import ModelBase
 from django.dispatch import receiver
 
-from .utils import rank
+from .spelling import get_corrected_query
+from .utils import (
+    INDEX_COLUMNS, add_tombstone, create_hits_table, drop_hits_tables,
+    format_modified_at, get_cache_key, get_or_compute, get_rank_sql,
+    get_snippet_sql, rank, replace_index_entries, schedule_indexing,
+    to_fts_query)
 from ..utils import MetaRegistry
 
 
+# Stay well below the maximum number of SQL variables of old SQLite versions
+HYDRATE_BATCH_SIZE = 500
+
+# The metadata columns for which we count the values matching a search
+FACET_FIELDS = ('lang', 'kind', 'source')
+
 class Match(models.Lookup):
     lookup_name = 'match'
 
     def as_sql(self, qn, connection):
-        lhs, lhs_params = self.process_lhs(qn, connection)
+        # Match against the whole table, that is all the full-text indexed
+        # columns, so that the ranking can weight them.
+        lhs = qn.quote_name_unless_alias(self.lhs.alias)
         rhs, rhs_params = self.process_rhs(qn, connection)
-        params = lhs_params + rhs_params
+        params = [to_fts_query(p) for p in rhs_params]
         return '{0} MATCH {1}'.format(lhs, rhs), params
 
 
@@ -27,18 +45,19 @@ class TagMatch(models.Lookup):
     lookup_name = 'match'
 
     def as_sql(self, qn, connection):
-        lhs, lhs_params = self.process_lhs(qn, connection)
+        # Resolved with the inverted index of tags, rather than scanning the
+        # tags column of every row in the index.
+        rowid = '{}.rowid'.format(qn.quote_name_unless_alias(self.lhs.alias))
         rhs, rhs_params = self.process_rhs(qn, connection)
-        params = lhs_params + rhs_params
-        params = params[0]
+        params = rhs_params[0]
         if not params:
             # Not tags to match to.
             # Search for stuff with no tag
-            params = ['']
-        out = '({0} LIKE {1})'.format(lhs, rhs)
-        out = ' AND '.join([out]*len(params))
-        out = '({})'.format(out)
-        return out, ['%|{}|%'.format(p.lower()) for p in params]
+            return '{} NOT IN (SELECT docid FROM idx_tags)'.format(rowid), []
+        docids = ' INTERSECT '.join(
+            ['SELECT docid FROM idx_tags WHERE tag = %s'] * len(params))
+        out = '{} IN ({})'.format(rowid, docids)
+        return out, [p.lower() for p in params]
 
 
 class SearchTagField(models.Field):
@@ -48,37 +67,376 @@ SearchTagField.register_lookup(TagMatch)
 
 class SearchQuerySet(models.QuerySet):
     def order_by_relevancy(self):
-        extra = {'relevancy': 'rank(matchinfo(idx))'}
-        return self.extra(select=extra).order_by('-relevancy')
+        """Order by relevancy, only valid on a full-text query"""
+        extra = {'relevancy': get_rank_sql()}
+        # The rowid makes the order stable, for pagination
+        return self.extra(select=extra).order_by('-relevancy', 'rowid')
+
+    def with_snippets(self):
+        """Select the snippet of the text of each match, only valid on a
+        full-text query"""
+        return self.extra(select={'snippet': get_snippet_sql()})
+
+
+class SearchResults(object):
+    """The lazy results of a search
+
+    Slicing it only fetches and hydrates that page of results, pushing down
+    the LIMIT and OFFSET into the index query. It can thus be given to a
+    Paginator.
+
+    Counting stops at count_ceiling, so that broad queries don't need to
+    look at all their matches.
+    """
+    def __init__(self, queryset, count_ceiling=None):
+        self.queryset = queryset
+        self.count_ceiling = count_ceiling
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            # Neither the ordering nor the relevancy are needed to count
+            qs = self.queryset.order_by().values('rowid')
+
+            if self.count_ceiling is not None:
+                qs = qs[:self.count_ceiling]
+
+            self._count = qs.count()
+
+        return self._count
+
+    @property
+    def is_capped(self):
+        return (self.count_ceiling is not None
+                and self.count() >= self.count_ceiling)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        fields = ['model', 'object_id']
+
+        if 'snippet' in self.queryset.query.extra_select:
+            fields.append('snippet')
+
+        hits = self.queryset.values_list(*fields)
+
+        if isinstance(key, slice):
+            return Search.hydrate(hits[key])
+
+        return Search.hydrate(hits[key:key + 1])[0]
 
 
 class Search(models.Model):
-    """Model that handle the search."""
-    rowid = models.IntegerField(primary_key=True)
+    """Model that handle the search.
+
+    These are the metadata of the index entries, in a regular table. Their
+    text is in the full-text table, see SearchText.
+    """
+    rowid = models.AutoField(primary_key=True)
     model = models.CharField(max_length=64)
     object_id = models.IntegerField()
     public = models.BooleanField(default=True)
-    text = SearchField()
     lang = models.Field()
     kind = models.Field()
     tags = SearchTagField()
     source = models.Field()
+    modified_at = models.Field()
 
     objects = SearchQuerySet.as_manager()
 
     class Meta:
-        db_table = 'idx'
+        db_table = 'idx_meta'
         managed = False
 
+    @staticmethod
+    def _get_lookups(kwargs):
+        """The text is matched in the full-text table"""
+        lookups = dict(kwargs)
+
+        if 'text__match' in lookups:
+            lookups['fulltext__text__match'] = lookups.pop('text__match')
+
+        return lookups
+
+    @classmethod
+    def _filter(cls, **kwargs):
+        qs = Search.objects.filter(**cls._get_lookups(kwargs))
+        if 'text__match' in kwargs:
+            qs = qs.order_by_relevancy().with_snippets()
+        else:
+            qs = qs.order_by('rowid')
+        return qs
+
     @classmethod
     def ids(cls, **kwargs):
-        qs = Search.objects.filter(**kwargs).order_by_relevancy()
-        return qs.values_list('object_id', flat=True)
+        """Return the ids of the matching objects, cached until the index
+        changes"""
+        def compute():
+            qs = cls._filter(**kwargs).values_list('object_id', flat=True)
+            return list(qs.distinct())
+
+        return get_or_compute(get_cache_key('ids', kwargs), compute)
 
     @classmethod
-    def search(cls, **kwargs):
-        qs = Search.objects.filter(**kwargs).order_by_relevancy()
-        return (SearchMixin.registered_types[r.model].objects.get(pk=r.object_id) for r in qs)
+    def search(cls, count_ceiling=None, **kwargs):
+        return SearchResults(cls._filter(**kwargs), count_ceiling)
+
+    @classmethod
+    def facets(cls, tags_limit=None, **kwargs):
+        """Count the values of the metadata of the objects matching a search
+
+        Return a dict mapping each of FACET_FIELDS and 'tags' to a list of
+        (value, count) tuples, the most common values first. Only the
+        tags_limit most common tags are returned.
+
+        The count for a value of lang, kind or source ignores the filter on
+        that same field, so that they tell what selecting another value would
+        give. Tags are counted with all the filters.
+
+        Everything is computed with a single query on the index, and cached
+        until the index changes.
+        """
+        key = get_cache_key('facets', dict(kwargs, tags_limit=tags_limit))
+        facets = get_or_compute(
+            key, lambda: cls._get_facets(tags_limit, kwargs))
+
+        # JSON made lists of the tuples
+        return {
+            name: [tuple(item) for item in items]
+            for name, items in facets.items()}
+
+    @classmethod
+    def _get_facets(cls, tags_limit, filters):
+        selected = {
+            field: filters.pop(field) for field in FACET_FIELDS
+            if filters.get(field)}
+        qs = cls.objects.filter(**cls._get_lookups(filters)).order_by()
+
+        # The number of matches for each combination of the fields, from
+        # which we can count each field with the filters on the others.
+        fields_sql, fields_params = qs.values(
+            *FACET_FIELDS).query.sql_with_params()
+        tags_sql, tags_params = qs.filter(**selected).values(
+            'rowid').query.sql_with_params()
+        sql = (
+            'SELECT {fields}, NULL, count(*) FROM ({fields_sql}) '
+            'GROUP BY {fields} '
+            'UNION ALL '
+            'SELECT * FROM ('
+            'SELECT {nulls}, tag, count(*) AS count FROM idx_tags '
+            'WHERE docid IN ({tags_sql}) GROUP BY tag '
+            'ORDER BY count DESC, tag LIMIT %s)').format(
+                fields=', '.join(FACET_FIELDS), fields_sql=fields_sql,
+                nulls=', '.join(['NULL'] * len(FACET_FIELDS)),
+                tags_sql=tags_sql)
+        params = fields_params + tags_params + (
+            -1 if tags_limit is None else tags_limit,)
+
+        counters = {field: Counter() for field in FACET_FIELDS}
+        tags = []
+
+        with connections['transient'].cursor() as cursor:
+            cursor.execute(sql, params)
+
+            for row in cursor.fetchall():
+                values, tag, count = row[:-2], row[-2], row[-1]
+
+                if tag is not None:
+                    tags.append((tag, count))
+                    continue
+
+                values = dict(zip(FACET_FIELDS, values))
+
+                for field, counter in counters.items():
+                    if not values[field]:
+                        continue
+
+                    if any(values[other] != value
+                           for other, value in selected.items()
+                           if other != field):
+                        continue
+
+                    counter[values[field]] += count
+
+        facets = {
+            field: sorted(counter.items(), key=lambda i: (-i[1], i[0]))
+            for field, counter in counters.items()}
+        facets['tags'] = tags
+        return facets
+
+    @classmethod
+    def grouped_search(cls, limit=5, count_ceiling=None, **kwargs):
+        """Return the best matches of each searchable model
+
+        Return an OrderedDict mapping the name of each model with matches to
+        a (count, objects) tuple, objects being its limit most relevant
+        matches. This way the many weak matches of a model can't crowd out
+        the few strong matches of another one. The models come in the order
+        of their most relevant match.
+
+        Counting stops at count_ceiling, for each model.
+
+        Everything is fetched with a single query on the index, and cached
+        until the index changes.
+        """
+        key = get_cache_key(
+            'grouped', dict(kwargs, limit=limit, count_ceiling=count_ceiling))
+        groups = get_or_compute(
+            key, lambda: cls._get_groups(limit, count_ceiling, kwargs))
+
+        hits = [(name, pk, snippet)
+                for name, _, group_hits in groups
+                for pk, snippet in group_hits]
+        objects = {
+            (obj.__class__.__name__, obj.pk): obj
+            for obj in cls.hydrate(hits)}
+
+        return OrderedDict(
+            (name, (count, [objects[(name, pk)] for pk, _ in group_hits
+                            if (name, pk) in objects]))
+            for name, count, group_hits in groups)
+
+    @classmethod
+    def _get_groups(cls, limit, count_ceiling, filters):
+        model_names = sorted(SearchMixin.registered_types)
+
+        if filters.get('model'):
+            model_names = [filters.pop('model')]
+
+        qs = cls._filter(**filters)
+
+        if 'text__match' not in filters:
+            # All the matches are as relevant, and there is no text to
+            # extract snippets from
+            qs = qs.extra(select={'relevancy': 'NULL', 'snippet': 'NULL'})
+
+        # Old SQLite versions have no window functions: this is rather one
+        # LIMITed query per model, all of them in a UNION ALL, along with
+        # the counts, for which the object_id is NULL.
+        parts, params = [], []
+
+        for name in model_names:
+            hits_sql, hits_params = qs.filter(model=name).values_list(
+                'model', 'object_id', 'relevancy', 'snippet')[:limit].query \
+                .sql_with_params()
+            parts.append(
+                'SELECT model, object_id, snippet, relevancy '
+                'FROM ({})'.format(hits_sql))
+            params.extend(hits_params)
+
+        counted = qs.order_by().values('model')
+
+        if count_ceiling is None:
+            count_sql, count_params = counted.query.sql_with_params()
+            parts.append(
+                'SELECT model, NULL, NULL, count(*) FROM ({}) '
+                'GROUP BY model'.format(count_sql))
+            params.extend(count_params)
+
+        else:
+            for name in model_names:
+                count_sql, count_params = counted.filter(
+                    model=name)[:count_ceiling].query.sql_with_params()
+                parts.append(
+                    'SELECT %s, NULL, NULL, count(*) FROM ({})'.format(
+                        count_sql))
+                params.append(name)
+                params.extend(count_params)
+
+        groups = OrderedDict()
+        counts = {}
+
+        with connections['transient'].cursor() as cursor:
+            cursor.execute(' UNION ALL '.join(parts), params)
+
+            for name, object_id, snippet, value in cursor.fetchall():
+                if object_id is None:
+                    counts[name] = value
+                    continue
+
+                # The first hit of each model is its most relevant one
+                group = groups.setdefault(
+                    name, {'relevancy': value, 'hits': []})
+                group['hits'].append((object_id, snippet))
+
+        # Sorting is stable, models as relevant stay in alphabetical order
+        ordered = sorted(
+            groups.items(), key=lambda item: -(item[1]['relevancy'] or 0))
+        return [
+            [name, counts.get(name, 0), group['hits']]
+            for name, group in ordered]
+
+    @staticmethod
+    def hydrate(hits):
+        """Return the objects for these (model, object_id[, snippet]) index
+        hits
+
+        There is one query per model (per batch of ids), and the objects are
+        returned in the same order as the hits. Hits for objects which do not
+        exist any more are ignored.
+
+        The snippets become the search_snippet attribute of the objects. The
+        long texts of the objects are not loaded, the snippets are there to
+        show them.
+        """
+        hits = list(hits)
+        ids_by_model = OrderedDict()
+
+        for hit in hits:
+            ids_by_model.setdefault(hit[0], []).append(hit[1])
+
+        objects = {}
+
+        for model_name, ids in ids_by_model.items():
+            try:
+                model = SearchMixin.registered_types[model_name]
+
+            except KeyError:
+                # Not a searchable model any more
+                continue
+
+            texts = [
+                field.name for field in model._meta.concrete_fields
+                if isinstance(field, models.TextField)]
+            qs = model._default_manager.defer(*texts)
+
+            for i in range(0, len(ids), HYDRATE_BATCH_SIZE):
+                batch = ids[i:i + HYDRATE_BATCH_SIZE]
+
+                for pk, obj in qs.in_bulk(batch).items():
+                    objects[(model_name, pk)] = obj
+
+        results = []
+
+        for hit in hits:
+            obj = objects.get(tuple(hit[:2]))
+
+            if obj is None:
+                continue
+
+            if len(hit) > 2:
+                obj.search_snippet = hit[2]
+
+            results.append(obj)
+
+        return results
+
+
+class SearchText(models.Model):
+    """The full-text table of the index, with the same rowids as Search"""
+    search = models.OneToOneField(
+        Search, primary_key=True, db_column='rowid', related_name='fulltext',
+        on_delete=models.DO_NOTHING)
+    title = models.TextField()
+    text = SearchField()
+
+    class Meta:
+        db_table = 'idx'
+        managed = False
 
 
 class MetaSearchMixin(MetaRegistry, ModelBase):
@@ -88,9 +446,17 @@ class MetaSearchMixin(MetaRegistry, ModelBase):
 class SearchMixin(models.Model, metaclass=MetaSearchMixin):
     """Inherit from this mixin to make your model searchable."""
 
+    # The relations which the index_* properties use, fetched for all the
+    # indexed objects at once
+    index_prefetch = ()
+
     class Meta:
         abstract = True
 
+    @property
+    def index_title(self):
+        return None
+
     @property
     def index_strings(self):
         return []
@@ -115,32 +481,57 @@ class SearchMixin(models.Model, metaclass=MetaSearchMixin):
     def index_source(self):
         return None
 
+    @property
+    def index_modified_at(self):
+        return format_modified_at(getattr(self, 'modified_at', None))
+
     def is_indexable(self):
         return True
 
-    def index(self):
-        if not self.is_indexable():
-            return
+    @classmethod
+    def get_index_queryset(cls):
+        """Return the queryset used to (re)index the whole model.
+
+        Override it to select what the index_* properties need, the
+        index_prefetch relations are already prefetched.
+        """
+        return cls._default_manager.prefetch_related(*cls.index_prefetch)
+
+    def get_index_values(self):
         text = u" ".join([s for s in self.index_strings if s])
         tags = u"|{}|".format(u"|".join(self.index_tags))
-        defaults = {
+        return {
+            'model': self.__class__.__name__,
+            'object_id': self.pk,
+            'title': self.index_title,
             'text': text,
             'public': self.index_public,
             'lang': self.index_lang,
             'kind': self.index_kind,
             'source': self.index_source,
-            'tags': tags
+            'tags': tags,
+            'modified_at': self.index_modified_at,
         }
-        Search.objects.update_or_create(
-            model=self.__class__.__name__,
-            object_id=self.pk,
-            defaults=defaults
-        )
+
+    def get_index_row(self):
+        values = self.get_index_values()
+        return tuple(values[column] for column in INDEX_COLUMNS)
+
+    def index(self):
+        if not self.is_indexable():
+            return
+
+        # On a copy, so that this cache can't hide a later change of the
+        # relations, for example the tags saved after the object
+        instance = copy.copy(self)
+        instance._prefetched_objects_cache = {}
+        prefetch_related_objects([instance], *self.index_prefetch)
+
+        replace_index_entries(
+            self.__class__.__name__, [self.pk], [instance.get_index_row()])
 
     def deindex(self):
-        Search.objects.filter(
-            model=self.__class__.__name__,
-            object_id=self.pk).delete()
+        replace_index_entries(self.__class__.__name__, [self.pk], [])
 
 
 class SearchableQuerySet(object):
@@ -156,25 +547,56 @@ class SearchableQuerySet(object):
             kwargs['source'] = source
         if tags:
             kwargs['tags__match'] = tags
-        ids = Search.ids(**kwargs).distinct()
-        # Force the execution of the request here
-        # as we can request on several db in the same time.
-        ids = list(ids)
-        return self.filter(pk__in=ids)
+        ids = Search.ids(**kwargs)
+
+        if not ids and query:
+            # Maybe the query was misspelled
+            corrected = get_corrected_query(query)
+
+            if corrected:
+                kwargs['text__match'] = corrected
+                ids = Search.ids(**kwargs)
+
+        return self.filter_by_hits(ids)
+
+    def filter_by_hits(self, ids):
+        """Only keep the objects with these ids, in that order
+
+        The ids are written to a temporary table which the query joins,
+        rather than sent as SQL parameters. Their order (e.g the relevancy)
+        only applies if the queryset was not explicitly ordered.
+        """
+        table = create_hits_table(connections[self.db], ids)
+        qs = self.extra(
+            tables=[table],
+            where=['{}.object_id = {}.{}'.format(
+                table, self.model._meta.db_table,
+                self.model._meta.pk.column)])
+
+        if not self.query.order_by:
+            qs = qs.extra(order_by=['{}.position'.format(table)])
+
+        return qs
 
 
 @receiver(post_save)
 def index(sender, instance, **kwargs):
     if issubclass(sender, SearchMixin):
-        instance.index()
+        schedule_indexing(instance)
 
 
 @receiver(pre_delete)
 def deindex(sender, instance, **kwargs):
     if issubclass(sender, SearchMixin):
-        instance.deindex()
+        add_tombstone(sender.__name__, instance.pk)
+        schedule_indexing(instance, deleted=True)
+
+
+@receiver(request_finished)
+def drop_search_hits(sender, **kwargs):
+    drop_hits_tables()
 
 
 @receiver(connection_created)
 def add_rank_function(sender, connection, **kwargs):
-    connection.connection.create_function("rank", 1, rank)
+    connection.connection.create_function("rank", -1, rank)
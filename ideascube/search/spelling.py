@@ -0,0 +1,124 @@
+from django.db import connections, transaction
+
+from .utils import has_fts5, normalize_word
+
+
+# How similar a term must be to a misspelled word to correct it, as the
+# proportion of their trigrams they have in common
+MIN_SIMILARITY = 0.3
+
+# Stay well below the maximum number of SQL variables of old SQLite versions
+TRIGRAMS_BATCH_SIZE = 500
+
+
+def get_trigrams(term):
+    """Return the set of trigrams of a term
+
+    The term is padded, so that its first and last letters weigh as much as
+    the others.
+    """
+    term = '  {} '.format(term)
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def _get_terms():
+    """Return the (term, number of documents) of the index vocabulary"""
+    with connections['transient'].cursor() as cursor:
+        if has_fts5():
+            cursor.execute('SELECT term, doc FROM idx_vocab_rows')
+
+        else:
+            cursor.execute(
+                "SELECT term, documents FROM idx_vocab_rows WHERE col = '*'")
+
+        return cursor.fetchall()
+
+
+def build_trigram_index():
+    """Fill the inverted index of the trigrams of the index vocabulary
+
+    This reads the whole vocabulary, so it is not done while serving the
+    pages: it runs after the full reindexing, and in the "search maintain"
+    command. Until then, the terms indexed in the meantime are not offered
+    as corrections.
+
+    Return the number of terms.
+    """
+    terms = [
+        (term, documents) for term, documents in _get_terms()
+        if len(term) >= 3 and not term.isdigit()]
+
+    with transaction.atomic(using='transient'):
+        with connections['transient'].cursor() as cursor:
+            cursor.execute('DELETE FROM idx_terms')
+            cursor.execute('DELETE FROM idx_trigrams')
+
+            for i in range(0, len(terms), TRIGRAMS_BATCH_SIZE):
+                batch = [
+                    (term, documents, get_trigrams(term))
+                    for term, documents in terms[i:i + TRIGRAMS_BATCH_SIZE]]
+                cursor.executemany(
+                    'INSERT INTO idx_terms (term, documents, trigrams) '
+                    'VALUES (%s, %s, %s)',
+                    [(term, documents, len(trigrams))
+                     for term, documents, trigrams in batch])
+                cursor.executemany(
+                    'INSERT INTO idx_trigrams (trigram, term) VALUES (%s, %s)',
+                    [(trigram, term)
+                     for term, _, trigrams in batch for trigram in trigrams])
+
+    return len(terms)
+
+
+def get_corrections(word, limit=5):
+    """Return the indexed terms most similar to a word
+
+    The most similar come first, then the ones in the most documents. Only
+    the terms sharing trigrams with the word are looked at.
+    """
+    trigrams = sorted(get_trigrams(normalize_word(word)))
+
+    # The Jaccard index of the sets of trigrams of the word and of the term
+    similarity = 'CAST(count(*) AS REAL) / (%s + t.trigrams - count(*))'
+    sql = (
+        'SELECT t.term, {similarity} AS similarity '
+        'FROM idx_trigrams AS g JOIN idx_terms AS t ON t.term = g.term '
+        'WHERE g.trigram IN ({trigrams}) '
+        'GROUP BY t.term HAVING similarity >= %s '
+        'ORDER BY similarity DESC, t.documents DESC, t.term '
+        'LIMIT %s').format(
+            similarity=similarity,
+            trigrams=', '.join(['%s'] * len(trigrams)))
+
+    with connections['transient'].cursor() as cursor:
+        cursor.execute(
+            sql, [len(trigrams)] + trigrams + [MIN_SIMILARITY, limit])
+        return [term for term, _ in cursor.fetchall()]
+
+
+def get_corrected_query(query):
+    """Return the query with its misspelled words corrected
+
+    Words which are indexed terms are left alone. Return None when there is
+    nothing to correct.
+    """
+    words = query.split()
+    corrected = []
+
+    with connections['transient'].cursor() as cursor:
+        for word in words:
+            term = normalize_word(word.rstrip('*'))
+            cursor.execute(
+                'SELECT count(*) FROM idx_terms WHERE term = %s', [term])
+
+            if len(term) < 3 or cursor.fetchone()[0]:
+                corrected.append(word)
+                continue
+
+            corrections = get_corrections(term, limit=1)
+            corrected.append(corrections[0] if corrections else word)
+
+    if corrected == words:
+        return None
+
+    return ' '.join(corrected)
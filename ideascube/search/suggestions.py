@@ -0,0 +1,39 @@
+from django.db import connections
+
+from .utils import normalize_word
+
+
+# The highest code point, which sorts after any other character
+LAST_CHARACTER = '\U0010ffff'
+
+
+def get_suggestions(prefix, model=None, lang=None, public=None, limit=10):
+    """Return the indexed terms starting with prefix, the most frequent first
+
+    The terms can be restricted to the documents of a model or a language,
+    and to the public documents.
+    """
+    prefix = normalize_word(prefix)
+
+    if not prefix:
+        return []
+
+    # A range of the primary key of idx_words
+    where = ['word >= %s', 'word < %s']
+    params = [prefix, prefix + LAST_CHARACTER]
+
+    filters = (('model', model), ('lang', lang), ('public', public))
+
+    for column, value in filters:
+        if value is not None:
+            where.append('{} = %s'.format(column))
+            params.append(value)
+
+    sql = (
+        'SELECT word, sum(documents) AS documents FROM idx_words '
+        'WHERE {} GROUP BY word ORDER BY documents DESC, word '
+        'LIMIT %s').format(' AND '.join(where))
+
+    with connections['transient'].cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return [word for word, _ in cursor.fetchall()]
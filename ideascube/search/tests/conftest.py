@@ -0,0 +1,97 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+from socketserver import ThreadingMixIn
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from django.core.cache import cache
+
+
+RSS = '''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>Search: {pattern}</title>
+    {items}
+  </channel>
+</rss>
+'''
+ITEM = '''<item>
+  <title>{title}</title>
+  <link>/{name}/A/{title}</link>
+  <description>About {pattern}</description>
+</item>
+'''
+
+
+class KiwixHandler(BaseHTTPRequestHandler):
+    """A stand-in for the search endpoint of kiwix-serve"""
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        name, pattern = params['content'][0], params['pattern'][0]
+        self.server.requests.append(name)
+
+        if name == 'slow':
+            time.sleep(1)
+
+        if name == 'broken':
+            self.send_error(500)
+            return
+
+        items = ''.join(
+            ITEM.format(name=name, title='{} {}'.format(pattern, i),
+                        pattern=pattern)
+            for i in range(int(params['pageLength'][0])))
+        body = RSS.format(pattern=pattern, items=items).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class KiwixServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, library_dir):
+        super().__init__(('127.0.0.1', 0), KiwixHandler)
+        self.library_path = os.path.join(library_dir, 'library.xml')
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def write_library(self, *books):
+        """Install ZIM files, given as (name, title)"""
+        library = ''.join(
+            '<book id="{0}" path="data/content/{0}.zim" title="{1}"/>'.format(
+                name, title)
+            for name, title in books)
+
+        with open(self.library_path, 'w', encoding='utf-8') as f:
+            f.write('<library>{}</library>'.format(library))
+
+
+@pytest.yield_fixture()
+def kiwix(settings):
+    """A stand-in for kiwix-serve, with no ZIM file installed yet"""
+    server = KiwixServer(settings.CATALOG_KIWIX_INSTALL_DIR)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    settings.KIWIX_SERVER_URL = server.url
+    settings.KIWIX_SEARCH_RESULTS = 2
+    cache.clear()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,327 @@
+"""Benchmarks of the search, on synthetic corpora
+
+They are skipped unless the sizes of the corpora are given:
+
+    py.test -m benchmark --benchmark=10000,100000,1000000 ideascube/search
+
+Each corpus is made of multilingual documents, blog contents and users,
+which are indexed one by one through SearchMixin.index. The typical queries
+are then timed, as well as a full reindex_content, and a report is printed
+with the median and 95th percentile of each measure, and the size of the
+index.
+"""
+import bisect
+import math
+import random
+import time
+
+import pytest
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+
+from taggit.models import Tag, TaggedItem
+
+from ideascube.blog.models import Content
+from ideascube.mediacenter.models import Document
+from ideascube.models import User
+from ideascube.search.models import Search
+from ideascube.search.spelling import build_trigram_index
+from ideascube.search.utils import bump_index_generation, reindex_content
+
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db]
+
+# The syllables the words of each language are made of
+SYLLABLES = {
+    'en': ['the', 'ing', 'wa', 'ter', 'ch', 'ild', 'ro', 'ad', 'sch', 'ool',
+           'ly', 'an', 'ight', 'ea', 'sh', 'ow', 'er', 'un'],
+    'fr': ['é', 'co', 'le', 'mai', 'son', 'è', 're', 'eau', 'ç', 'ou',
+           'ent', 'ville', 'pê', 'che', 'in', 'ti', 'on', 'au'],
+    'ar': ['ال', 'كت', 'اب', 'مد', 'رس', 'ة', 'ما', 'ء', 'سو', 'ق', 'بي',
+           'ت', 'نو', 'ر', 'عل', 'م', 'حي', 'اة'],
+    'sw': ['ki', 'ta', 'bu', 'sho', 'le', 'ma', 'ji', 'wa', 'to', 'to',
+           'nyu', 'mba', 'cha', 'ku', 'la', 'mu', 'zi', 'ki'],
+    'fa': ['کت', 'اب', 'خا', 'نه', 'مد', 'رسه', 'آب', 'نا', 'ن', 'دو',
+           'ست', 'گل', 'شه', 'ر', 'را', 'ه', 'زن', 'دگی'],
+}
+WORDS_PER_LANG = 5000
+TAGS = 300
+REPEAT = 50
+PAGE_SIZE = 20
+BATCH_SIZE = 1000
+
+
+def pytest_generate_tests(metafunc):
+    if 'corpus_size' not in metafunc.fixturenames:
+        return
+
+    sizes = [
+        int(size) for size in
+        metafunc.config.getoption('--benchmark').split(',') if size]
+    metafunc.parametrize('corpus_size', sizes or [pytest.param(
+        0, marks=pytest.mark.skip(reason='no --benchmark corpus size'))])
+
+
+class Vocabulary(object):
+    """Random words of the languages, drawn with a Zipf distribution
+
+    Like in real texts, a few words are very common and most are rare.
+    """
+    def __init__(self, rng):
+        self.rng = rng
+        self.words = {}
+
+        for lang, syllables in SYLLABLES.items():
+            words = set()
+
+            while len(words) < WORDS_PER_LANG:
+                length = rng.randint(2, 4)
+                words.add(''.join(
+                    rng.choice(syllables) for _ in range(length)))
+
+            self.words[lang] = sorted(words)
+
+        self.cumulative_weights = []
+        total = 0
+
+        for rank in range(1, WORDS_PER_LANG + 1):
+            total += 1 / rank
+            self.cumulative_weights.append(total)
+
+    def word(self, lang):
+        value = self.rng.random() * self.cumulative_weights[-1]
+        index = bisect.bisect(self.cumulative_weights, value)
+        return self.words[lang][min(index, WORDS_PER_LANG - 1)]
+
+    def sentence(self, lang, length):
+        return ' '.join(self.word(lang) for _ in range(length))
+
+    def frequent(self, lang):
+        return self.words[lang][self.rng.randint(0, 9)]
+
+    def common(self, lang):
+        return self.words[lang][self.rng.randint(10, 200)]
+
+    def rare(self, lang):
+        return self.words[lang][self.rng.randint(1000, WORDS_PER_LANG - 1)]
+
+
+def load_corpus(size, vocabulary):
+    """Create size objects, 80% documents, 10% contents and 10% users
+
+    The objects are bulk created, so that they are not indexed yet.
+    """
+    rng = vocabulary.rng
+    langs = sorted(SYLLABLES)
+    kinds = [kind for kind, _ in Document.KIND_CHOICES]
+
+    Tag.objects.bulk_create(
+        Tag(name='tag {}'.format(i), slug='tag-{}'.format(i))
+        for i in range(TAGS))
+    tags = list(Tag.objects.order_by('pk'))
+
+    users = []
+
+    for i in range(size // 10):
+        lang = rng.choice(langs)
+        users.append(User(
+            serial='user-{}'.format(i),
+            short_name=vocabulary.word(lang),
+            full_name=vocabulary.sentence(lang, 2)))
+
+    for i in range(0, len(users), BATCH_SIZE):
+        User.objects.bulk_create(users[i:i + BATCH_SIZE])
+
+    author = User.objects.order_by('pk').first()
+    models_count = (
+        (Content, size // 10), (Document, size - 2 * (size // 10)))
+
+    for model, count in models_count:
+        content_type = ContentType.objects.get_for_model(model)
+
+        for start in range(0, count, BATCH_SIZE):
+            objects = []
+
+            for _ in range(min(BATCH_SIZE, count - start)):
+                lang = rng.choice(langs)
+                title = vocabulary.sentence(lang, rng.randint(2, 6))
+
+                if model is Content:
+                    objects.append(Content(
+                        title=title, author=author, lang=lang,
+                        text=vocabulary.sentence(lang, rng.randint(50, 300)),
+                        status=rng.choice([s for s, _ in Content.STATUSES])))
+
+                else:
+                    objects.append(Document(
+                        title=title, lang=lang, kind=rng.choice(kinds),
+                        summary=vocabulary.sentence(lang, rng.randint(5, 40)),
+                        original='mediacenter/document/benchmark.pdf',
+                        package_id=rng.choice(['', 'wikipedia', 'gutenberg']),
+                        hidden=rng.random() < 0.05))
+
+            model.objects.bulk_create(objects)
+
+        pks = list(model.objects.values_list('pk', flat=True))
+        tagged = []
+
+        for pk in pks:
+            for tag in rng.sample(tags, rng.randint(0, 3)):
+                tagged.append(TaggedItem(
+                    tag=tag, content_type=content_type, object_id=pk))
+
+        for i in range(0, len(tagged), BATCH_SIZE):
+            TaggedItem.objects.bulk_create(tagged[i:i + BATCH_SIZE])
+
+    return tags
+
+
+def get_index_size():
+    """The size of the transient database, which only holds the index"""
+    cursor = connections['transient'].cursor()
+    cursor.execute('PRAGMA page_count')
+    page_count = cursor.fetchone()[0]
+    cursor.execute('PRAGMA page_size')
+    return page_count * cursor.fetchone()[0]
+
+
+def percentile(timings, percent):
+    """The nearest-rank percentile of the timings"""
+    timings = sorted(timings)
+    rank = max(int(math.ceil(percent / 100 * len(timings))), 1)
+    return timings[rank - 1]
+
+
+class Report(object):
+    def __init__(self, size):
+        self.size = size
+        self.lines = []
+
+    def add(self, name, timings):
+        self.lines.append(
+            '  {:<28} {:>8} x   p50 {:>10.2f} ms   p95 {:>10.2f} ms   '
+            'total {:>9.2f} s'.format(
+                name, len(timings), percentile(timings, 50) * 1000,
+                percentile(timings, 95) * 1000, sum(timings)))
+
+    def add_value(self, name, value):
+        self.lines.append('  {:<28} {}'.format(name, value))
+
+    def __str__(self):
+        return '\n'.join(
+            ['', 'Search benchmark on {} objects'.format(self.size)]
+            + self.lines)
+
+
+def measure(func, params, cold=True):
+    """Time func with each of the params
+
+    When cold, the cached search results are invalidated before each call,
+    otherwise they are computed beforehand.
+    """
+    timings = []
+
+    for param in params:
+        if cold:
+            bump_index_generation()
+
+        else:
+            func(param)
+
+        start = time.perf_counter()
+        func(param)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def index_all():
+    timings = []
+
+    for model in (User, Content, Document):
+        pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+
+        for i in range(0, len(pks), BATCH_SIZE):
+            chunk = pks[i:i + BATCH_SIZE]
+
+            for obj in model.get_index_queryset().filter(pk__in=chunk):
+                start = time.perf_counter()
+                obj.index()
+                timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_benchmark(corpus_size, capsys):
+    vocabulary = Vocabulary(random.Random(corpus_size))
+    tags = load_corpus(corpus_size, vocabulary)
+    rng = vocabulary.rng
+    langs = sorted(SYLLABLES)
+    report = Report(corpus_size)
+
+    report.add('index (SearchMixin.index)', index_all())
+    assert Search.objects.count() == corpus_size
+
+    def search(params):
+        results = Search.search(count_ceiling=1000, **params)
+        results.count()
+        list(results[:PAGE_SIZE])
+
+    def params(make_query, **filters):
+        result = []
+
+        for _ in range(REPEAT):
+            lang = rng.choice(langs)
+            result.append(dict(filters, text__match=make_query(lang)))
+
+        return result
+
+    report.add('single frequent term', measure(
+        search, params(vocabulary.frequent)))
+    report.add('single common term', measure(
+        search, params(vocabulary.common)))
+    report.add('single rare term', measure(
+        search, params(vocabulary.rare)))
+    report.add('prefix term', measure(
+        search, params(lambda lang: vocabulary.common(lang)[:3] + '*')))
+    report.add('multi-term', measure(search, params(
+        lambda lang: ' '.join(vocabulary.common(lang) for _ in range(3)))))
+    report.add('public only', measure(
+        search, params(vocabulary.common, public=True)))
+
+    def search_documents(tag_names):
+        qs = Document.objects.search(tags=tag_names)
+        qs.count()
+        list(qs[:PAGE_SIZE])
+
+    report.add('tag filtered', measure(search_documents, [
+        [tag.slug for tag in rng.sample(tags, rng.randint(1, 2))]
+        for _ in range(REPEAT)]))
+
+    def facets(params):
+        Search.facets(tags_limit=20, **params)
+
+    facets_params = [{'model': 'Document'}] + params(
+        vocabulary.common, model='Document')
+    report.add('facets', measure(facets, facets_params))
+    report.add('facets (cached)', measure(facets, facets_params, cold=False))
+
+    def search_users(query):
+        list(User.objects.search(query)[:PAGE_SIZE])
+
+    report.add('spelling index rebuild', measure(
+        lambda _: build_trigram_index(), [None] * 5))
+    report.add('user search', measure(search_users, [
+        vocabulary.common(rng.choice(langs)) for _ in range(REPEAT)]))
+
+    report.add('full reindex_content', measure(
+        lambda _: reindex_content(), [None]))
+    assert Search.objects.count() == corpus_size
+
+    report.add_value(
+        'index size', '{:.1f} MiB'.format(get_index_size() / 1024 / 1024))
+
+    with capsys.disabled():
+        print(report)
@@ -0,0 +1,69 @@
+import time
+
+from ..kiwix import KiwixResult, get_books, merge_results, search_kiwix
+
+
+def test_get_books(kiwix):
+    assert get_books() == []
+
+    kiwix.write_library(('wikipedia.fr', 'Wikipédia'), ('vikidia.fr', ''))
+
+    assert get_books() == [
+        ('wikipedia.fr', 'Wikipédia'), ('vikidia.fr', 'vikidia.fr')]
+
+
+def test_search_kiwix(kiwix):
+    kiwix.write_library(('wikipedia', 'Wikipedia'), ('vikidia', 'Vikidia'))
+
+    results = search_kiwix('music')
+
+    assert results == [
+        [KiwixResult('Wikipedia', title, kiwix.url + '/wikipedia/A/' + title)
+         for title in ('music 0', 'music 1')],
+        [KiwixResult('Vikidia', title, kiwix.url + '/vikidia/A/' + title)
+         for title in ('music 0', 'music 1')],
+    ]
+    assert results[0][0].slug == 'Wikipedia'
+    assert results[0][0].snippet == 'About music'
+    assert sorted(kiwix.requests) == ['vikidia', 'wikipedia']
+
+
+def test_search_kiwix_does_not_wait_for_slow_zims(settings, kiwix):
+    settings.KIWIX_SEARCH_TIMEOUT = 0.2
+    kiwix.write_library(('slow', 'Slow'), ('wikipedia', 'Wikipedia'))
+
+    start = time.monotonic()
+    results = search_kiwix('music')
+
+    assert time.monotonic() - start < 0.8
+    assert results[0] == []
+    assert len(results[1]) == 2
+
+
+def test_search_kiwix_ignores_the_failing_zims(kiwix):
+    kiwix.write_library(('broken', 'Broken'), ('wikipedia', 'Wikipedia'))
+
+    results = search_kiwix('music')
+
+    assert results[0] == []
+    assert len(results[1]) == 2
+
+
+def test_search_kiwix_caches_the_results(kiwix):
+    kiwix.write_library(('wikipedia', 'Wikipedia'))
+
+    assert search_kiwix('music') == search_kiwix('music')
+    assert kiwix.requests == ['wikipedia']
+
+    search_kiwix('video')
+    assert kiwix.requests == ['wikipedia', 'wikipedia']
+
+
+def test_search_kiwix_without_zims(kiwix):
+    assert search_kiwix('music') == []
+    assert kiwix.requests == []
+
+
+def test_merge_results():
+    assert merge_results(['a1', 'a2', 'a3'], [], ['c1']) == [
+        'a1', 'c1', 'a2', 'a3']
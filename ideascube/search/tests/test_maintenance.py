@@ -0,0 +1,248 @@
+import pytest
+
+from django.core.management import call_command
+from django.db import connections
+from django.utils import timezone
+
+from ideascube.mediacenter.models import Document
+from ideascube.mediacenter.tests.factories import DocumentFactory
+
+from ..maintenance import (
+    check_consistency, check_index, get_index_health, get_index_segments,
+    heal_index, merge_index, reindex_incremental, verify_index)
+from ..models import Search
+from ..utils import reindex_content
+
+
+pytestmark = [pytest.mark.django_db, pytest.mark.usefixtures('cleansearch')]
+
+
+def get_tombstones():
+    cursor = connections['transient'].cursor()
+    cursor.execute('SELECT model, object_id FROM idx_tombstones')
+    return cursor.fetchall()
+
+
+def clear_index():
+    cursor = connections['transient'].cursor()
+    cursor.execute('DELETE FROM idx')
+    cursor.execute('DELETE FROM idx_meta')
+
+
+def test_incremental_reindex_does_nothing_without_changes():
+    DocumentFactory.create_batch(3)
+    reindex_content()
+
+    assert reindex_incremental()['Document'] == (0, 0)
+
+
+def test_incremental_reindex_updates_the_modified_objects():
+    document = DocumentFactory(title='music')
+    other = DocumentFactory(title='music')
+    reindex_content()
+
+    # Without going through the signals, so the index is outdated
+    Document.objects.filter(pk=document.pk).update(
+        title='video', modified_at=timezone.now())
+    assert list(Search.search(text__match='video')) == []
+
+    assert reindex_incremental(verify=False)['Document'] == (1, 0)
+    assert list(Search.search(text__match='video')) == [document]
+    assert list(Search.search(text__match='music')) == [other]
+
+
+def test_incremental_reindex_removes_the_deleted_objects():
+    document = DocumentFactory()
+    reindex_content()
+    pk = document.pk
+    document.delete()
+    assert get_tombstones() == [('Document', pk)]
+
+    # Also when the deletion was not deindexed
+    Search.objects.create(model='Document', object_id=pk)
+
+    assert reindex_incremental(verify=False)['Document'] == (1, 0)
+    assert Search.objects.filter(model='Document').count() == 0
+    assert get_tombstones() == []
+
+
+def test_incremental_reindex_repairs_the_index():
+    missing, outdated, deleted, fine = DocumentFactory.create_batch(4)
+    reindex_content()
+
+    cursor = connections['transient'].cursor()
+    cursor.execute(
+        "DELETE FROM idx_meta WHERE model = 'Document' AND object_id = %s",
+        [missing.pk])
+    cursor.execute(
+        "UPDATE idx_meta SET modified_at = '2000-01-01' "
+        "WHERE model = 'Document' AND object_id = %s", [outdated.pk])
+    connections['default'].cursor().execute(
+        'DELETE FROM mediacenter_document WHERE id = %s', [deleted.pk])
+
+    assert verify_index(Document) == {missing.pk, outdated.pk, deleted.pk}
+    assert reindex_incremental()['Document'] == (0, 3)
+    assert verify_index(Document) == set()
+    assert sorted(Search.objects.filter(model='Document').values_list(
+        'object_id', flat=True)) == sorted([missing.pk, outdated.pk, fine.pk])
+
+
+def test_incremental_reindex_command(capsys):
+    reindex_content()
+    DocumentFactory()
+    Document.objects.update(modified_at=timezone.now())
+
+    call_command('reindex', '--incremental')
+
+    out, err = capsys.readouterr()
+    assert 'Updated 1 Document content and repaired 0 in ' in out
+    assert 'Done reindexing 1 objects.' in out
+
+
+def test_incremental_reindex_of_some_models():
+    DocumentFactory()
+    clear_index()
+
+    assert list(reindex_incremental(model_names=['Document'])) == [
+        'Document']
+    assert Search.objects.filter(model='Document').count() == 1
+
+
+def test_check_consistency_compares_the_counts():
+    DocumentFactory.create_batch(2)
+    assert check_consistency() == []
+
+    clear_index()
+    assert check_consistency() == ['Document']
+
+
+def test_check_consistency_compares_the_last_modifications():
+    DocumentFactory.create_batch(2)
+
+    # As when restoring an older backup of the content
+    Document.objects.filter(pk=Document.objects.first().pk).update(
+        modified_at=timezone.now() - timezone.timedelta(days=1))
+    assert check_consistency() == ['Document']
+
+
+def test_heal_index_does_nothing_on_a_consistent_index():
+    DocumentFactory()
+
+    assert heal_index(background=False) == []
+    health = get_index_health()
+    assert health['state'] == 'consistent'
+    assert health['models'] == []
+    assert health['repaired_at'] is None
+
+
+def test_heal_index_repairs_the_index():
+    document = DocumentFactory(title='music')
+    clear_index()
+
+    assert heal_index(background=False) == ['Document']
+    assert list(Search.search(text__match='music')) == [document]
+    health = get_index_health()
+    assert health['state'] == 'repaired'
+    assert health['models'] == ['Document']
+    assert health['repaired_at'] >= health['checked_at']
+
+    # The last repair is remembered
+    assert heal_index(background=False) == []
+    assert get_index_health()['repaired_at'] == health['repaired_at']
+
+
+def test_heal_index_recreates_the_lost_index():
+    document = DocumentFactory(title='music')
+    connections['transient'].cursor().execute('DROP TABLE idx_meta')
+    assert get_index_health() is None
+
+    assert heal_index(background=False) == ['Document']
+    assert list(Search.search(text__match='music')) == [document]
+
+
+def test_heal_index_records_the_failures(mocker):
+    DocumentFactory()
+    clear_index()
+    mocker.patch(
+        'ideascube.search.maintenance.update_index',
+        side_effect=RuntimeError('Oops'))
+
+    assert heal_index(background=False) == ['Document']
+    assert get_index_health()['state'] == 'failed'
+
+    # It can be tried again
+    mocker.stopall()
+    assert heal_index(background=False) == ['Document']
+    assert get_index_health()['state'] == 'repaired'
+
+
+def test_search_check_command(capsys):
+    DocumentFactory()
+    call_command('search', 'check')
+    out, err = capsys.readouterr()
+    assert out == 'The index is consistent with the content.\n'
+
+    clear_index()
+    call_command('search', 'check')
+    out, err = capsys.readouterr()
+    assert out == 'Reindexed: Document.\n'
+    assert check_consistency() == []
+
+
+def test_merge_index_merges_the_segments():
+    # Each document is indexed in its own transaction, making a segment
+    documents = DocumentFactory.create_batch(20, title='music')
+    assert sum(get_index_segments().values()) > 1
+
+    assert merge_index(pages=10, optimize=True) > 0
+    assert sum(get_index_segments().values()) == 1
+    assert merge_index(pages=10, optimize=True) == 0
+
+    assert sorted(Search.search(text__match='music'), key=lambda d: d.pk) \
+        == documents
+    assert check_index() == []
+
+
+def test_merge_index_stops_when_the_time_budget_is_spent():
+    DocumentFactory.create_batch(20)
+
+    assert merge_index(optimize=True, time_budget=0) == 0
+    assert sum(get_index_segments().values()) > 1
+
+
+def test_check_index_finds_the_entries_without_text():
+    document = DocumentFactory()
+    assert check_index() == []
+
+    cursor = connections['transient'].cursor()
+    cursor.execute(
+        'DELETE FROM idx WHERE rowid = %s',
+        [Search.objects.get(object_id=document.pk).rowid])
+
+    assert check_index() == [
+        'The full-text index has 0 entries, but there are metadata for 1 '
+        'entries']
+
+
+def test_search_maintain_command(capsys):
+    DocumentFactory.create_batch(3)
+
+    call_command('search', 'maintain', '--optimize')
+
+    out, err = capsys.readouterr()
+    assert 'Rebuilt the spelling corrections of ' in out
+    assert 'Segments: 1 (' in out
+    assert 'Document: 3 entries' in out
+    assert 'The index is consistent.' in out
+    assert err == ''
+
+
+def test_search_maintain_command_fails_on_an_inconsistent_index(capsys):
+    DocumentFactory()
+    connections['transient'].cursor().execute('DELETE FROM idx')
+
+    with pytest.raises(SystemExit):
+        call_command('search', 'maintain')
+
+    out, err = capsys.readouterr()
+    assert 'The full-text index has 0 entries' in err
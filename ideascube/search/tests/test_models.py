@@ -3,12 +3,17 @@ import pytest
 
 from operator import attrgetter
 
+from django.core.signals import request_finished
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
 from ideascube.blog.tests.factories import ContentFactory
 from ideascube.blog.models import Content
 from ideascube.mediacenter.models import Document
 from ideascube.mediacenter.tests.factories import DocumentFactory
 from ideascube.utils import sanitize_tag_name
 from ..models import Search
+from ..utils import deferred_indexing, get_cache_key
 
 
 pytestmark = pytest.mark.django_db
@@ -128,6 +133,80 @@ def test_search_Document_is_case_insensitive():
     assert doc3 in Search.search(tags__match=["baR"])
 
 
+def get_index_tags(obj):
+    cursor = connections['transient'].cursor()
+    cursor.execute(
+        'SELECT tag FROM idx_tags JOIN idx_meta ON docid = idx_meta.rowid '
+        'WHERE idx_meta.model = %s AND idx_meta.object_id = %s',
+        [obj.__class__.__name__, obj.pk])
+    return sorted(tag for tag, in cursor.fetchall())
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_index_tags_are_maintained():
+    document = DocumentFactory(tags=["foo", "Bar"])
+    other = DocumentFactory(tags=["foo"])
+    assert get_index_tags(document) == ["bar", "foo"]
+
+    document.tags.remove("foo")
+    document.save()
+    assert get_index_tags(document) == ["bar"]
+    assert get_index_tags(other) == ["foo"]
+
+    document.delete()
+    cursor = connections['transient'].cursor()
+    cursor.execute('SELECT tag, docid FROM idx_tags')
+    assert cursor.fetchall() == [
+        ('foo', Search.objects.get(object_id=other.pk).rowid)]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_index_fetches_the_tags_once():
+    document = DocumentFactory(tags=["foo", "Bar"])
+
+    with CaptureQueriesContext(connections['default']) as queries:
+        document.index()
+
+    assert len(queries) == 1
+    assert get_index_tags(document) == ["bar", "foo"]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_index_sees_the_tags_changed_since_the_last_time():
+    document = DocumentFactory(tags=["foo"])
+    document.index()
+
+    document.tags.add("bar")
+    document.index()
+    assert get_index_tags(document) == ["bar", "foo"]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_deferred_indexing_fetches_the_tags_once_per_batch():
+    documents = DocumentFactory.create_batch(10, tags=["foo", "bar"])
+
+    with CaptureQueriesContext(connections['default']) as queries:
+        with deferred_indexing():
+            for document in documents:
+                document.save()
+
+    # The documents are updated, then fetched with their tags
+    assert len(queries) == 10 + 2
+    assert get_index_tags(documents[-1]) == ["bar", "foo"]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_tags_are_matched_with_the_index_tags():
+    document = DocumentFactory(tags=["foo", "bar"])
+    DocumentFactory(tags=["foobar"])
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        assert list(Search.search(tags__match=["foo", "bar"])) == [document]
+
+    assert 'idx_tags' in queries[0]['sql']
+    assert 'LIKE' not in queries[0]['sql']
+
+
 @pytest.mark.usefixtures('cleansearch')
 def test_more_relevant_should_come_first():
     second = ContentFactory(title="About music and music")
@@ -149,3 +228,345 @@ def test_ids_only_returns_ids():
 def test_we_can_search_on_non_fts_fields_only():
     content = ContentFactory(title="music")
     assert content in Search.search(public=False)
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_title_is_more_relevant_than_text():
+    in_text = ContentFactory(title="Something", text="About music")
+    in_title = ContentFactory(title="About music", text="Something")
+    assert list(Search.search(text__match="music")) == [in_title, in_text]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_does_not_match_metadata():
+    DocumentFactory(title="A title", kind="video", lang="fr", credits="")
+    ContentFactory(title="A title", lang="fr")
+    assert list(Search.search(text__match="video")) == []
+    assert list(Search.search(text__match="fr")) == []
+    assert list(Search.search(text__match="Content")) == []
+
+
+@pytest.mark.usefixtures('cleansearch')
+@pytest.mark.parametrize('query', [
+    'l\'eau', '"music', 'music-box', 'AND', 'music OR', '(music', '*', 'a:b'])
+def test_search_query_syntax_is_escaped(query):
+    ContentFactory(title="l'eau et la music-box")
+    # None of these can raise an OperationalError
+    list(Search.search(text__match=query))
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_on_prefix():
+    content = ContentFactory(title="musical")
+    assert content in Search.search(text__match="music*")
+    assert content not in Search.search(text__match="music")
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_queries_once_per_model():
+    ContentFactory.create_batch(3, title="music")
+    DocumentFactory.create_batch(3, title="music")
+
+    with CaptureQueriesContext(connections['default']) as queries:
+        results = list(Search.search(text__match="music"))
+
+    assert len(results) == 6
+    assert len(queries) == 2
+
+    ContentFactory.create_batch(3, title="music")
+
+    with CaptureQueriesContext(connections['default']) as queries:
+        results = list(Search.search(text__match="music"))
+
+    assert len(results) == 9
+    assert len(queries) == 2
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_ignores_stale_index_entries():
+    content = ContentFactory(title="music")
+    stale = ContentFactory(title="music music")
+
+    # Delete without going through the signals
+    Content.objects.filter(pk=stale.pk)._raw_delete(using='default')
+
+    assert list(Search.search(text__match="music")) == [content]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_preserves_relevancy_order_across_models():
+    second = ContentFactory(title="About music", text="music")
+    first = DocumentFactory(title="Music music music", summary="music")
+    third = ContentFactory(title="Something", text="About music")
+
+    assert list(Search.search(text__match="music")) == [first, second, third]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_results_are_sliced_in_the_index_query():
+    contents = [
+        ContentFactory(title=" ".join(["music"] * (10 - i))) for i in range(5)]
+    results = Search.search(text__match="music")
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        page = results[1:3]
+
+    assert page == contents[1:3]
+    assert len(queries) == 1
+    assert 'LIMIT 2 OFFSET 1' in queries[0]['sql']
+    assert results[0] == contents[0]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_results_count_is_capped():
+    ContentFactory.create_batch(5, title="music")
+
+    results = Search.search(text__match="music")
+    assert results.count() == 5
+    assert not results.is_capped
+
+    results = Search.search(count_ceiling=3, text__match="music")
+    assert results.count() == 3
+    assert len(results) == 3
+    assert results.is_capped
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_results_order_is_stable():
+    ContentFactory.create_batch(6, title="music")
+    results = Search.search(text__match="music")
+
+    pages = results[0:2] + results[2:4] + results[4:6]
+    assert pages == list(results)
+    assert len(set(pages)) == 6
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_results_have_snippets_of_their_text():
+    text = ' '.join(['filler'] * 50 + ['Rock', 'music', 'festival'])
+    ContentFactory(title="Something", text=text)
+
+    result = Search.search(text__match="music")[0]
+
+    assert '\x02music\x03 festival' in result.search_snippet
+    assert result.search_snippet.startswith('…')
+    assert len(result.search_snippet) < len(text)
+
+    # Only the snippet of the text is loaded
+    assert result.get_deferred_fields() == {'text'}
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_grouped_search_results_have_snippets_of_their_text():
+    ContentFactory(title="Something", text="Some music")
+    DocumentFactory(title="Other", summary="More music")
+
+    groups = Search.grouped_search(text__match="music")
+    assert groups['Content'][1][0].search_snippet.startswith(
+        'Some \x02music\x03')
+    assert groups['Document'][1][0].search_snippet.startswith(
+        'More \x02music\x03')
+
+    # Also from the cache
+    groups = Search.grouped_search(text__match="music")
+    assert groups['Content'][1][0].search_snippet.startswith(
+        'Some \x02music\x03')
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_facets_count_the_values_of_the_matches():
+    DocumentFactory(lang='fr', kind='video', tags=['foo', 'bar'])
+    DocumentFactory(lang='fr', kind='audio', tags=['foo'])
+    DocumentFactory(lang='en', kind='video', tags=['foo'])
+    ContentFactory(lang='en', tags=['foo'])
+
+    facets = Search.facets(model='Document')
+    assert facets['lang'] == [('fr', 2), ('en', 1)]
+    assert facets['kind'] == [('video', 2), ('audio', 1)]
+    assert facets['tags'] == [('foo', 3), ('bar', 1)]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_facets_ignore_the_filter_on_their_own_field():
+    DocumentFactory(lang='fr', kind='video', tags=['foo', 'bar'])
+    DocumentFactory(lang='fr', kind='audio', tags=['foo'])
+    DocumentFactory(lang='en', kind='video', tags=['foo'])
+
+    facets = Search.facets(model='Document', lang='fr')
+    assert facets['lang'] == [('fr', 2), ('en', 1)]
+    assert facets['kind'] == [('audio', 1), ('video', 1)]
+    assert facets['tags'] == [('foo', 2), ('bar', 1)]
+
+    facets = Search.facets(model='Document', lang='fr', kind='video')
+    assert facets['lang'] == [('en', 1), ('fr', 1)]
+    assert facets['kind'] == [('audio', 1), ('video', 1)]
+    assert facets['tags'] == [('bar', 1), ('foo', 1)]
+
+    facets = Search.facets(model='Document', tags__match=['bar'])
+    assert facets['lang'] == [('fr', 1)]
+    assert facets['tags'] == [('bar', 1), ('foo', 1)]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_facets_are_computed_in_one_query():
+    DocumentFactory(lang='fr', title='music', tags=['foo'])
+    DocumentFactory(lang='en', title='music', tags=['foo', 'bar'])
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        facets = Search.facets(
+            tags_limit=1, model='Document', text__match='music')
+
+    queries = [q for q in queries if 'idx_cache' not in q['sql']]
+    assert len(queries) == 1
+    assert facets['lang'] == [('en', 1), ('fr', 1)]
+    assert facets['tags'] == [('foo', 2)]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_facets_are_cached_until_the_index_changes():
+    DocumentFactory(lang='fr')
+    assert Search.facets(model='Document')['lang'] == [('fr', 1)]
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        assert Search.facets(model='Document')['lang'] == [('fr', 1)]
+
+    # Only the cache lookup
+    assert len(queries) == 1
+
+    DocumentFactory(lang='en')
+    assert Search.facets(model='Document')['lang'] == [('en', 1), ('fr', 1)]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_grouped_search_returns_the_best_matches_of_each_model():
+    contents = [
+        ContentFactory(title=" ".join(["music"] * (10 - i))) for i in range(4)]
+    document = DocumentFactory(title="music " * 20)
+    ContentFactory(title="Something")
+
+    groups = Search.grouped_search(limit=2, text__match="music")
+    assert list(groups) == ['Document', 'Content']
+    assert groups['Document'] == (1, [document])
+    assert groups['Content'] == (4, contents[:2])
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_grouped_search_is_one_query():
+    ContentFactory(title="music")
+    DocumentFactory(title="music")
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        Search.grouped_search(text__match="music")
+
+    queries = [q for q in queries if 'idx_cache' not in q['sql']]
+    assert len(queries) == 1
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_grouped_search_counts_are_capped():
+    ContentFactory.create_batch(5, title="music")
+    DocumentFactory(title="music")
+
+    groups = Search.grouped_search(
+        limit=1, count_ceiling=3, text__match="music")
+    assert groups['Content'][0] == 3
+    assert len(groups['Content'][1]) == 1
+    assert groups['Document'][0] == 1
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_grouped_search_without_text():
+    content = ContentFactory(title="music", status=Content.PUBLISHED)
+    ContentFactory(title="draft", status=Content.DRAFT)
+
+    groups = Search.grouped_search(public=True, model='Content')
+    assert groups == {'Content': (1, [content])}
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_grouped_search_is_cached_until_the_index_changes():
+    document = DocumentFactory(title="music")
+    assert Search.grouped_search(text__match="music") == {
+        'Document': (1, [document])}
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        Search.grouped_search(text__match="music")
+
+    # Only the cache lookup
+    assert len(queries) == 1
+
+    content = ContentFactory(title="music")
+    assert Search.grouped_search(text__match="music")['Content'] == (
+        1, [content])
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_ids_are_cached_until_the_index_changes():
+    document = DocumentFactory(title='music')
+    assert Search.ids(text__match='music') == [document.pk]
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        # The query is normalized
+        assert Search.ids(text__match=' Music ') == [document.pk]
+
+    assert len(queries) == 1
+
+    other = DocumentFactory(title='music')
+    assert sorted(Search.ids(text__match='music')) == [document.pk, other.pk]
+
+    other.delete()
+    assert Search.ids(text__match='music') == [document.pk]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_cached_results_of_an_outdated_generation_are_ignored():
+    document = DocumentFactory(title='music')
+    cursor = connections['transient'].cursor()
+    cursor.execute(
+        "INSERT INTO idx_cache (key, generation, value) VALUES (%s, %s, %s)",
+        [get_cache_key('ids', {'text__match': 'music'}), 0, '[]'])
+
+    assert Search.ids(text__match='music') == [document.pk]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_searchable_queryset_joins_the_hits():
+    DocumentFactory(title='music', summary='music music')
+    best = DocumentFactory(title='music music', summary='music')
+    other = DocumentFactory(title='music')
+    DocumentFactory(title='video')
+
+    with CaptureQueriesContext(connections['default']) as queries:
+        documents = list(Document.objects.search('music'))
+
+    assert len(documents) == 3
+    assert documents[0] == best
+
+    sql = queries[-1]['sql']
+    assert 'search_hits_' in sql
+    assert 'IN (' not in sql
+
+    # An explicit order wins over the relevancy
+    documents = list(Document.objects.order_by('-pk').search('music'))
+    assert documents[0] == other
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_hits_tables_are_dropped_when_the_request_is_finished():
+    document = DocumentFactory(title='music')
+    assert list(Document.objects.search('music')) == [document]
+
+    cursor = connections['default'].cursor()
+    cursor.execute(
+        "SELECT count(*) FROM sqlite_temp_master "
+        "WHERE type = 'table' AND name LIKE 'search_hits_%'")
+    assert cursor.fetchone() == (1,)
+
+    request_finished.send(sender=None)
+
+    cursor.execute(
+        "SELECT count(*) FROM sqlite_temp_master "
+        "WHERE type = 'table' AND name LIKE 'search_hits_%'")
+    assert cursor.fetchone() == (0,)
+    assert list(Document.objects.search('music')) == [document]
+
@@ -0,0 +1,70 @@
+import pytest
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from ideascube.mediacenter.models import Document
+from ideascube.mediacenter.tests.factories import DocumentFactory
+
+from ..models import Search
+from ..spelling import (
+    build_trigram_index, get_corrected_query, get_corrections, get_trigrams)
+
+
+pytestmark = [pytest.mark.django_db, pytest.mark.usefixtures('cleansearch')]
+
+
+def test_get_trigrams():
+    assert get_trigrams('cat') == {'  c', ' ca', 'cat', 'at '}
+
+
+def test_corrections_are_ranked_by_similarity_and_frequency():
+    DocumentFactory(title='music')
+    DocumentFactory(title='musical')
+    DocumentFactory(title='mosaic')
+    build_trigram_index()
+
+    assert get_corrections('musicall') == ['musical', 'music']
+    assert get_corrections('muzic') == ['music']
+    assert get_corrections('xyz') == []
+
+
+def test_corrections_only_read_the_trigram_index():
+    DocumentFactory(title='music')
+    build_trigram_index()
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        assert get_corrections('muzic') == ['music']
+
+    # The vocabulary is only read offline, when building the trigram index
+    assert len(queries) == 1
+    assert 'idx_trigrams' in queries[0]['sql']
+
+
+def test_new_terms_are_corrected_once_the_trigram_index_is_built():
+    DocumentFactory(title='music')
+    build_trigram_index()
+    DocumentFactory(title='classical')
+
+    assert get_corrections('clasical') == []
+
+    build_trigram_index()
+
+    assert get_corrections('clasical') == ['classical']
+
+
+def test_only_misspelled_words_are_corrected():
+    DocumentFactory(title='classical music')
+    build_trigram_index()
+
+    assert get_corrected_query('classical muzic') == 'classical music'
+    assert get_corrected_query('classical music') is None
+    assert get_corrected_query('xyz') is None
+
+
+def test_misspelled_search_falls_back_to_the_corrected_query():
+    document = DocumentFactory(title='music')
+    build_trigram_index()
+
+    assert list(Document.objects.search('muzic')) == [document]
+    assert list(Search.search(text__match='muzic')) == []
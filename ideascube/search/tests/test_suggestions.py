@@ -0,0 +1,87 @@
+import pytest
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from ideascube.blog.tests.factories import ContentFactory
+from ideascube.mediacenter.models import Document
+from ideascube.mediacenter.tests.factories import DocumentFactory
+
+from ..suggestions import get_suggestions
+from ..utils import create_index_table, has_fts5
+
+
+pytestmark = [pytest.mark.django_db, pytest.mark.usefixtures('cleansearch')]
+
+
+def test_suggestions_are_ranked_by_frequency():
+    DocumentFactory(title='music', summary='museum')
+    DocumentFactory(title='music')
+    DocumentFactory(title='Musical')
+
+    assert get_suggestions('mus') == ['music', 'museum', 'musical']
+    assert get_suggestions('MUSIC') == ['music', 'musical']
+    assert get_suggestions('mus', limit=1) == ['music']
+    assert get_suggestions('nothing') == []
+    assert get_suggestions('') == []
+
+
+def test_suggestions_are_filtered():
+    DocumentFactory(title='music', lang='fr')
+    DocumentFactory(title='museum', lang='en')
+    ContentFactory(title='musical')
+
+    assert get_suggestions('mus', model='Document') == ['museum', 'music']
+    assert get_suggestions('mus', lang='fr') == ['music']
+    assert get_suggestions('mus', public=True) == ['museum', 'music']
+    assert get_suggestions('mus', public=False) == ['musical']
+
+
+def test_suggestions_only_read_the_words_with_the_prefix():
+    DocumentFactory(title='music')
+
+    with CaptureQueriesContext(connections['transient']) as queries:
+        assert get_suggestions('mus') == ['music']
+
+    assert len(queries) == 1
+    assert 'idx_words' in queries[0]['sql']
+
+
+def test_suggestions_follow_the_changes_of_the_index():
+    document = DocumentFactory(title='music')
+    DocumentFactory(title='music')
+    assert get_suggestions('mus') == ['music']
+
+    document.title = 'museum'
+    document.save()
+    assert get_suggestions('mus') == ['museum', 'music']
+
+    document.delete()
+    assert get_suggestions('mus') == ['music']
+
+    cursor = connections['transient'].cursor()
+    cursor.execute("SELECT count(*) FROM idx_words WHERE word = 'museum'")
+    assert cursor.fetchone() == (0,)
+
+
+def test_suggestions_remove_the_diacritics_with_fts5():
+    if not has_fts5():
+        pytest.skip('SQLite was built without FTS5')
+
+    document = DocumentFactory(title="L'École de l'école")
+
+    assert get_suggestions('ÉC') == ['ecole']
+    assert get_suggestions('ec') == ['ecole']
+    assert list(Document.objects.search('ecole')) == [document]
+
+
+def test_suggestions_keep_the_diacritics_with_fts4(monkeypatch):
+    monkeypatch.setattr('ideascube.search.utils.has_fts5', lambda: False)
+    create_index_table(force=True)
+    document = DocumentFactory(title="L'École de l'école")
+
+    # Like the index, which only lowercases the ASCII letters
+    assert get_suggestions('éc') == ['école']
+    assert get_suggestions('Éc') == ['École']
+    assert get_suggestions('ec') == []
+    assert list(Document.objects.search('école')) == [document]
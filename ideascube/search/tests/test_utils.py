@@ -4,8 +4,18 @@ import pytest
 
 pytestmark = pytest.mark.django_db
 
-from ideascube.search.utils import create_index_table
-from django.db import connections
+from django.core.management import call_command
+from django.db import OperationalError, connections
+from django.db.backends.utils import CursorWrapper
+from django.test.utils import CaptureQueriesContext
+
+from ideascube.blog.tests.factories import ContentFactory
+from ideascube.mediacenter.tests.factories import DocumentFactory
+from ideascube.search.models import Search
+from ideascube.search.utils import (
+    bump_index_generation, create_index_table, deferred_indexing,
+    flush_indexing, get_index_table_sql, get_or_compute, html_to_text,
+    reindex_content, to_fts_query)
 
 
 def test_index_table_is_not_in_default_db():
@@ -22,3 +32,253 @@ def test_index_table_is_not_in_default_db():
                    "WHERE type='table' AND name='idx';")
     count = cursor.fetchone()[0]
     assert count == 1
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_reindex_content_indexes_everything():
+
+    ContentFactory.create_batch(3)
+    DocumentFactory.create_batch(5, tags=['foo', 'bar'])
+    create_index_table(force=True)
+    assert Search.objects.count() == 0
+
+    indexed = reindex_content(chunk_size=2)
+
+    assert indexed['Content'] == 3
+    assert indexed['Document'] == 5
+    assert Search.objects.filter(model='Document').count() == 5
+    assert Search.objects.filter(tags__match=['foo', 'bar']).count() == 5
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_reindex_content_without_force_does_not_duplicate():
+
+    DocumentFactory.create_batch(3)
+    assert Search.objects.count() == 3
+
+    reindex_content(force=False)
+    assert Search.objects.count() == 3
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_reindex_content_prefetches_tags():
+
+    DocumentFactory.create_batch(10, tags=['foo', 'bar'])
+
+    with CaptureQueriesContext(connections['default']) as few:
+        reindex_content(chunk_size=100)
+
+    DocumentFactory.create_batch(10, tags=['foo', 'bar'])
+
+    with CaptureQueriesContext(connections['default']) as more:
+        reindex_content(chunk_size=100)
+
+    # Twice the documents, but not a single query more
+    assert len(more) == len(few)
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_reindex_content_reports_progress():
+
+    DocumentFactory.create_batch(2)
+    reports = []
+
+    reindex_content(reporthook=lambda *args: reports.append(args))
+
+    assert ('Document', 2) in [report[:2] for report in reports]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_reindex_command_reports_throughput(capsys):
+
+    DocumentFactory.create_batch(2)
+
+    call_command('reindex', '--chunk-size=1')
+
+    out, err = capsys.readouterr()
+    assert 'Indexed 2 Document content in ' in out
+    assert 'per second' in out
+    assert 'Done reindexing 2 objects.' in out
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_reindex_fills_the_index_tags():
+    doc1 = DocumentFactory(tags=["foo", "bar"])
+    doc2 = DocumentFactory(tags=["bar"])
+
+    reindex_content(chunk_size=1)
+
+    assert sorted(Search.search(tags__match=["bar"]), key=lambda d: d.pk) \
+        == [doc1, doc2]
+    assert list(Search.search(tags__match=["foo", "bar"])) == [doc1]
+
+    # Reindexing without dropping the tables must not leave stale tags
+    doc1.tags.remove("foo")
+    reindex_content(force=False)
+
+    assert list(Search.search(tags__match=["foo"])) == []
+    cursor = connections['transient'].cursor()
+    cursor.execute('SELECT count(*) FROM idx_tags')
+    assert cursor.fetchone()[0] == 2
+
+
+def test_legacy_index_table_is_recreated():
+    cursor = connections['transient'].cursor()
+    cursor.execute("DROP TABLE IF EXISTS idx")
+    cursor.execute("CREATE VIRTUAL TABLE idx using "
+                   "FTS4(id, model, object_id, public, text, "
+                   "lang, kind, tags, source)")
+
+    create_index_table(force=False)
+
+    cursor.execute("SELECT sql FROM sqlite_master "
+                   "WHERE type='table' AND name='idx';")
+    assert cursor.fetchone()[0] == get_index_table_sql()
+
+
+@pytest.mark.parametrize('query, fts5, expected', [
+    ('music', True, '"music"'),
+    ('music box', True, '"music" "box"'),
+    ('music*', True, '"music"*'),
+    ('music*', False, '"music*"'),
+    ('"music', True, '"""music"'),
+    ('*', True, '""'),
+])
+def test_to_fts_query(monkeypatch, query, fts5, expected):
+    monkeypatch.setattr('ideascube.search.utils.has_fts5', lambda: fts5)
+    assert to_fts_query(query) == expected
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_deferred_indexing_coalesces_the_saves():
+    with CaptureQueriesContext(connections['transient']) as queries:
+        with deferred_indexing():
+            document = DocumentFactory(title='music')
+            document.tags.add('foo')
+            document.save()
+            document.save()
+
+            assert list(Search.search(text__match='music')) == []
+
+    # The document was saved 3 times, but only indexed once
+    assert len([q for q in queries if 'INSERT INTO idx ' in q['sql']]) == 1
+    assert list(Search.search(text__match='music')) == [document]
+    assert list(Search.search(tags__match=['foo'])) == [document]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_deferred_indexing_deindexes_deleted_objects():
+    document = DocumentFactory(title='music')
+    other = DocumentFactory(title='music')
+
+    with deferred_indexing():
+        other.title = 'video'
+        other.save()
+        document.delete()
+
+        with deferred_indexing():
+            ContentFactory(title='music')
+
+        # Nested blocks are flushed by the outermost one
+        assert len(Search.search(text__match='music')) == 2
+
+    indexed = Search.objects.exclude(model='User').order_by(
+        'fulltext__title').values_list('model', 'fulltext__title')
+    assert list(indexed) == [
+        ('Content', 'music'), ('Document', 'video')]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_indexing_waits_for_the_transaction_commit(settings):
+    settings.SEARCH_DEFERRED_INDEXING = True
+
+    # The test already runs in a transaction, which never gets committed
+    document = DocumentFactory(title='music')
+    assert list(Search.search(text__match='music')) == []
+
+    flush_indexing()
+    assert list(Search.search(text__match='music')) == [document]
+
+
+def test_full_text_table_only_has_the_text_columns():
+    create_index_table(force=True)
+
+    cursor = connections['transient'].cursor()
+    cursor.execute('SELECT * FROM idx LIMIT 0')
+    assert [c[0] for c in cursor.description] == ['title', 'text']
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_metadata_filters_do_not_touch_the_full_text_table():
+    document = DocumentFactory(title='music', lang='fr')
+
+    qs = Search.objects.filter(model='Document', lang='fr')
+    assert 'idx"' not in str(qs.query).replace('idx_meta"', '')
+
+    sql, params = qs.query.sql_with_params()
+    cursor = connections['transient'].cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    plan = ' '.join(row[-1] for row in cursor.fetchall())
+    assert 'idx_meta_model_lang' in plan
+    assert [s.object_id for s in qs] == [document.pk]
+
+
+def get_cached_keys():
+    cursor = connections['transient'].cursor()
+    cursor.execute('SELECT key FROM idx_cache')
+    return [key for key, in cursor.fetchall()]
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_get_or_compute_caches_the_result():
+    assert get_or_compute('key', lambda: [1, 2]) == [1, 2]
+    assert get_or_compute('key', lambda: [3]) == [1, 2]
+    assert get_cached_keys() == ['key']
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_get_or_compute_does_not_cache_big_results(mocker):
+    mocker.patch('ideascube.search.utils.CACHE_MAX_SIZE', 5)
+
+    assert get_or_compute('small', lambda: [1]) == [1]
+    assert get_or_compute('big', lambda: list(range(10))) == list(range(10))
+    assert get_cached_keys() == ['small']
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_get_or_compute_does_not_cache_outdated_results():
+    def compute():
+        # Another process changed the index meanwhile
+        bump_index_generation()
+        return [1]
+
+    assert get_or_compute('key', compute) == [1]
+    assert get_cached_keys() == []
+
+
+def test_html_to_text():
+    assert html_to_text(
+        '<p>Rock <em>and</em>&nbsp;roll</p><p>&lt;3</p>') == (
+        'Rock and roll <3')
+    assert html_to_text('') == ''
+    assert html_to_text(None) is None
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_get_or_compute_when_the_cache_is_locked(mocker):
+    execute = CursorWrapper.execute
+
+    def locked(cursor, sql, params=None):
+        if 'INTO idx_cache' in sql:
+            raise OperationalError('database is locked')
+        return execute(cursor, sql, params)
+
+    mocker.patch.object(CursorWrapper, 'execute', locked)
+
+    assert get_or_compute('key', lambda: [1]) == [1]
+    assert get_cached_keys() == []
+
+    # The search still works, and is cached again once the lock is gone
+    mocker.stopall()
+    assert get_or_compute('key', lambda: [1]) == [1]
+    assert get_cached_keys() == ['key']
@@ -6,6 +6,8 @@ from ideascube.blog.tests.factories import ContentFactory
 from ideascube.blog.models import Content
 from ideascube.library.tests.factories import BookFactory
 
+from ..spelling import build_trigram_index
+
 pytestmark = pytest.mark.django_db
 
 
@@ -81,3 +83,128 @@ def test_search_view_should_return_mixed_content(app):
     page = form.submit()
     assert content.title in page.content.decode()
     assert book.name in page.content.decode()
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_view_should_paginate_results(app, monkeypatch):
+    monkeypatch.setattr(
+        'ideascube.search.views.SearchView.paginate_by', 2)
+    ContentFactory.create_batch(
+        5, title='test content', status=Content.PUBLISHED)
+    page = app.get(
+        reverse('search:search'), params={'q': 'test', 'model': 'Content'})
+    assert '5 results.' in page.content.decode()
+    assert page.content.decode().count('test content') == 2
+    assert 'Page 1 of 3.' in page.content.decode()
+
+    page = app.get(
+        reverse('search:search'),
+        params={'q': 'test', 'model': 'Content', 'page': 3})
+    assert page.content.decode().count('test content') == 1
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_view_should_group_results_by_model(app, monkeypatch):
+    monkeypatch.setattr('ideascube.search.views.SearchView.group_size', 2)
+    ContentFactory.create_batch(
+        5, title='test content', status=Content.PUBLISHED)
+    book = BookFactory(name='test book')
+    page = app.get(reverse('search:search'), params={'q': 'test'})
+    assert page.content.decode().count('test content') == 2
+    assert book.name in page.content.decode()
+    assert '5 results.' in page.content.decode()
+    assert '1 result.' in page.content.decode()
+
+    page = page.click('See all the results')
+    assert page.content.decode().count('test content') == 5
+    assert book.name not in page.content.decode()
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_view_should_cap_results_count(app, monkeypatch):
+    monkeypatch.setattr(
+        'ideascube.search.views.SearchView.count_ceiling', 3)
+    ContentFactory.create_batch(
+        5, title='test content', status=Content.PUBLISHED)
+    page = app.get(reverse('search:search'), params={'q': 'test'})
+    assert 'More than 3 results.' in page.content.decode()
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_suggest_view_completes_the_last_word(app):
+    ContentFactory(title='music festival', status=Content.PUBLISHED)
+    ContentFactory(title='museum', status=Content.PUBLISHED)
+    ContentFactory(title='secret museum', status=Content.DRAFT)
+
+    response = app.get(reverse('search:suggest'), params={'q': 'rock mus'})
+    assert response.json == {'suggestions': ['museum', 'music']}
+
+
+@pytest.mark.usefixtures('cleansearch')
+@pytest.mark.parametrize('limit, expected', [
+    ('-1', ['museum']),
+    ('0', ['museum']),
+    ('2', ['museum', 'music']),
+    ('nope', ['museum', 'music']),
+])
+def test_suggest_view_bounds_the_limit(app, limit, expected):
+    ContentFactory(title='museum museum', status=Content.PUBLISHED)
+    ContentFactory(title='museum music', status=Content.PUBLISHED)
+
+    response = app.get(
+        reverse('search:suggest'), params={'q': 'mus', 'limit': limit})
+    assert response.json == {'suggestions': expected}
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_suggest_view_shows_private_terms_to_staff(staffapp):
+    ContentFactory(title='secret', status=Content.DRAFT)
+
+    response = staffapp.get(reverse('search:suggest'), params={'q': 'sec'})
+    assert response.json == {'suggestions': ['secret']}
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_view_should_correct_misspelled_queries(app):
+    content = ContentFactory(title='music', status=Content.PUBLISHED)
+    build_trigram_index()
+    page = app.get(reverse('search:search'), params={'q': 'muzic'})
+    assert content.title in page.content.decode()
+    assert 'Showing results for "music".' in page.content.decode()
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_view_should_merge_the_kiwix_results(app, kiwix):
+    kiwix.write_library(('wikipedia', 'Wikipedia'))
+    content = ContentFactory(title='music', status=Content.PUBLISHED)
+
+    page = app.get(reverse('search:search'), params={'q': 'music'})
+    content_position = page.content.decode().index(content.title)
+    zim_position = page.content.decode().index('music 0')
+    assert content_position < zim_position
+    assert kiwix.url + '/wikipedia/A/music 0' in page.content.decode()
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_view_should_highlight_the_snippets(app):
+    ContentFactory(
+        title='festival', text='Some &lt;rock&gt; music',
+        status=Content.PUBLISHED)
+
+    page = app.get(reverse('search:search'), params={'q': 'music'})
+    assert 'Some &lt;rock&gt; <mark>music</mark>' in page.content.decode()
+
+    page = app.get(
+        reverse('search:search'), params={'q': 'music', 'model': 'Content'})
+    assert 'Some &lt;rock&gt; <mark>music</mark>' in page.content.decode()
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_search_view_snippets_show_the_text_of_rich_text(app):
+    ContentFactory(
+        title='music', status=Content.PUBLISHED,
+        text='<p>Rock <strong>and</strong> roll&nbsp;music</p><p>Blues</p>')
+    page = app.get(reverse('search:search'), params={'q': 'roll'})
+    content = page.content.decode()
+    assert 'Rock and <mark>roll</mark> music Blues' in content
+    assert '&lt;' not in content
@@ -6,4 +6,5 @@ from . import views
 app_name = 'search'
 urlpatterns = [
     url(r'^$', views.search, name='search'),
+    url(r'^suggest/$', views.suggest, name='suggest'),
 ]
@@ -1,34 +1,829 @@
+from collections import Counter, OrderedDict
+import contextlib
+import functools
+import hashlib
+import html
+import json
+import multiprocessing
+import re
+import sqlite3
 import struct
+import threading
+import time
+import unicodedata
 
-from django.db import connections
+from django.conf import settings
+from django.db import (
+    OperationalError, connections, models, router, transaction)
+from django.utils.html import strip_tags
+
+
+# The columns of the regular table of the index, for filtering
+META_COLUMNS = (
+    'model', 'object_id', 'public', 'lang', 'kind', 'tags', 'source',
+    'modified_at')
+
+# The columns of the full-text table of the index
+FULLTEXT_COLUMNS = ('title', 'text')
+
+# The columns of the index rows, in order
+INDEX_COLUMNS = META_COLUMNS + FULLTEXT_COLUMNS
+
+# The weight of the full-text columns in the ranking
+RANK_WEIGHTS = {
+    'title': 5.0,
+    'text': 1.0,
+}
+
+# The filters on the index which are B-tree lookups
+META_INDEXES = (
+    ('model', 'lang'),
+    ('model', 'kind'),
+    ('model', 'source'),
+    ('model', 'public'),
+)
+
+# Stay well below the maximum number of SQL variables of old SQLite versions
+INDEX_BATCH_SIZE = 500
+
+# Around the matching terms in the snippets of the text, see the highlight
+# template filter
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+# The number of words of the snippets
+SNIPPET_TOKENS = 15
+
+# The words of the simple tokenizer of FTS4: all the characters but the
+# ASCII spaces and punctuation
+FTS4_WORD = re.compile('[0-9A-Za-z\x80-\U0010ffff]+')
+
+# The largest result which is cached, in bytes of JSON: the bigger ones,
+# like the ids of the broadest searches, are computed again each time
+CACHE_MAX_SIZE = 64 * 1024
+
+
+@functools.lru_cache()
+def has_fts5():
+    """Whether the SQLite library we run with was built with FTS5.
+
+    FTS5 is only available from SQLite 3.9, we fall back to FTS4 before that.
+    """
+    connection = sqlite3.connect(':memory:')
+
+    try:
+        connection.execute('CREATE VIRTUAL TABLE probe USING fts5(content)')
+
+    except sqlite3.OperationalError:
+        return False
+
+    finally:
+        connection.close()
+
+    return True
+
+
+def get_index_table_sql():
+    """Return the statement creating the full-text table of the index
+
+    Only the text is in there, the metadata are in the idx_meta table, with
+    the same rowids.
+    """
+    module = 'fts5' if has_fts5() else 'fts4'
+    return 'CREATE VIRTUAL TABLE idx USING {}({})'.format(
+        module, ', '.join(FULLTEXT_COLUMNS))
+
+
+def get_meta_table_sql():
+    types = {'object_id': 'INTEGER NOT NULL', 'public': 'INTEGER'}
+    columns = ', '.join(
+        '{} {}'.format(c, types.get(c, 'TEXT')) for c in META_COLUMNS)
+    return (
+        'CREATE TABLE idx_meta (rowid INTEGER PRIMARY KEY, {}, '
+        'UNIQUE (model, object_id))'.format(columns))
+
+
+def get_rank_sql():
+    """Return the SQL expression computing the relevancy of a match
+
+    The higher, the more relevant.
+    """
+    weights = ', '.join(str(RANK_WEIGHTS[c]) for c in FULLTEXT_COLUMNS)
+
+    if has_fts5():
+        # bm25 returns negative scores, the lower the better
+        return '-bm25(idx, {})'.format(weights)
+
+    return 'rank(matchinfo(idx), {})'.format(weights)
+
+
+def get_snippet_sql():
+    """Return the SQL expression extracting the part of the text of a match
+    with the most matching terms, the terms between highlight markers
+    """
+    column = FULLTEXT_COLUMNS.index('text')
+    markers = "char({}), char({}), '…'".format(
+        ord(HIGHLIGHT_START), ord(HIGHLIGHT_END))
+
+    if has_fts5():
+        return 'snippet(idx, {}, {}, {})'.format(
+            column, markers, SNIPPET_TOKENS)
+
+    return 'snippet(idx, {}, {}, {})'.format(markers, column, SNIPPET_TOKENS)
+
+
+def to_fts_query(query):
+    """Turn a user query into a valid full-text query
+
+    Each word is quoted so that punctuation can't be mistaken for the query
+    syntax (which is much stricter with FTS5). A trailing '*' still makes a
+    prefix query.
+    """
+    terms = []
+
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+
+        if not word:
+            continue
+
+        word = word.replace('"', '""')
+
+        if not prefix:
+            terms.append('"{}"'.format(word))
+
+        elif has_fts5():
+            terms.append('"{}"*'.format(word))
+
+        else:
+            terms.append('"{}*"'.format(word))
+
+    if not terms:
+        # An empty phrase matches nothing, an empty query is an error
+        return '""'
+
+    return ' '.join(terms)
+
+
+def get_index_schema():
+    """Return the statements creating the tables of the search index
+
+    As a list of (table name, CREATE TABLE statement, extra statements).
+    """
+    schema = [
+        ('idx', get_index_table_sql(), []),
+        ('idx_meta', get_meta_table_sql(), [
+            'CREATE INDEX idx_meta_{0} ON idx_meta ({1})'.format(
+                '_'.join(columns), ', '.join(columns))
+            for columns in META_INDEXES]),
+        # The inverted index of tags: the idx rowids (docids) for each tag
+        ('idx_tags',
+         'CREATE TABLE idx_tags (tag TEXT NOT NULL, docid INTEGER NOT NULL, '
+         'PRIMARY KEY (tag, docid)) WITHOUT ROWID',
+         ['CREATE INDEX idx_tags_docid ON idx_tags (docid)']),
+        # Incremented on every change to the index
+        ('idx_generation',
+         'CREATE TABLE idx_generation (generation INTEGER NOT NULL)',
+         ['INSERT INTO idx_generation (generation) VALUES (0)']),
+        # The results of searches, valid for one generation of the index
+        ('idx_cache',
+         'CREATE TABLE idx_cache (key TEXT PRIMARY KEY, '
+         'generation INTEGER NOT NULL, value TEXT NOT NULL)',
+         []),
+        # The terms of the index, and the inverted index of their trigrams,
+        # to correct misspelled queries
+        ('idx_terms',
+         'CREATE TABLE idx_terms (term TEXT PRIMARY KEY, '
+         'documents INTEGER NOT NULL, trigrams INTEGER NOT NULL)',
+         []),
+        ('idx_trigrams',
+         'CREATE TABLE idx_trigrams (trigram TEXT NOT NULL, '
+         'term TEXT NOT NULL, PRIMARY KEY (trigram, term)) WITHOUT ROWID',
+         []),
+        # The most recent modification indexed for each model, and the
+        # objects deleted since, for the incremental reindexing
+        ('idx_watermarks',
+         'CREATE TABLE idx_watermarks (model TEXT PRIMARY KEY, '
+         'modified_at TEXT NOT NULL)',
+         []),
+        ('idx_tombstones',
+         'CREATE TABLE idx_tombstones (model TEXT NOT NULL, '
+         'object_id INTEGER NOT NULL, PRIMARY KEY (model, object_id)) '
+         'WITHOUT ROWID',
+         []),
+        # The number of documents of each word, by the groups of documents
+        # which the suggestions can be restricted to
+        ('idx_words',
+         'CREATE TABLE idx_words (word TEXT NOT NULL, model TEXT NOT NULL, '
+         'lang TEXT NOT NULL, public INTEGER NOT NULL, '
+         'documents INTEGER NOT NULL, '
+         'PRIMARY KEY (word, model, lang, public)) WITHOUT ROWID',
+         []),
+        # The last consistency check of the index, see heal_index()
+        ('idx_health',
+         'CREATE TABLE idx_health (id INTEGER PRIMARY KEY CHECK (id = 1), '
+         'state TEXT NOT NULL, models TEXT NOT NULL, '
+         'checked_at TEXT NOT NULL, repaired_at TEXT)',
+         []),
+    ]
+
+    if has_fts5():
+        # The terms of the index, with the number of documents they are in
+        schema.append((
+            'idx_vocab_rows',
+            'CREATE VIRTUAL TABLE idx_vocab_rows USING fts5vocab(idx, row)',
+            []))
+
+    else:
+        schema.append((
+            'idx_vocab_rows', 'CREATE VIRTUAL TABLE idx_vocab_rows USING '
+            'fts4aux(idx)', []))
+
+    return schema
 
 
 def create_index_table(force=True):
     cursor_transient = connections['transient'].cursor()
-    cursor_transient.execute("SELECT count(*) FROM sqlite_master "
-                             "WHERE type='table' AND name='idx';")
-    count = cursor_transient.fetchone()[0]
-    if not count or force:
-        cursor_transient.execute("DROP TABLE IF EXISTS idx")
-        cursor_transient.execute("CREATE VIRTUAL TABLE idx using "
-                                 "FTS4(id, model, object_id, public, text, "
-                                 "lang, kind, tags, source)")
+    cursor_transient.execute("SELECT name, sql FROM sqlite_master "
+                             "WHERE type='table';")
+    existing = dict(cursor_transient.fetchall())
+    schema = get_index_schema()
+
+    # Tables from an older version (e.g FTS4 without the title column) get
+    # recreated, the content must then be reindexed.
+    outdated = any(existing.get(name) != sql for name, sql, _ in schema)
+
+    if outdated or force:
+        for name, sql, extra in schema:
+            cursor_transient.execute("DROP TABLE IF EXISTS {}".format(name))
+            cursor_transient.execute(sql)
+
+            for statement in extra:
+                cursor_transient.execute(statement)
+
+
+def bump_index_generation():
+    """Mark a change of the index, which invalidates the cached results"""
+    with connections['transient'].cursor() as cursor:
+        cursor.execute(
+            'UPDATE idx_generation SET generation = generation + 1')
+        cursor.execute(
+            'DELETE FROM idx_cache WHERE generation < '
+            '(SELECT generation FROM idx_generation)')
+
+
+def get_index_generation():
+    with connections['transient'].cursor() as cursor:
+        cursor.execute('SELECT generation FROM idx_generation')
+        return cursor.fetchone()[0]
+
+
+def get_cache_key(name, params):
+    """Return the key of the cached result of a search
+
+    The full-text query is normalized, and the order of the filters and tags
+    does not matter.
+    """
+    params = dict(params)
+
+    if 'text__match' in params:
+        params['text__match'] = ' '.join(params['text__match'].lower().split())
+
+    if 'tags__match' in params:
+        params['tags__match'] = sorted(t.lower() for t in params['tags__match'])
+
+    signature = json.dumps(params, sort_keys=True).encode('utf-8')
+    return '{}:{}'.format(name, hashlib.md5(signature).hexdigest())
+
+
+def get_or_compute(key, compute):
+    """Return the cached result for this key, or compute and cache it
+
+    The cache is in the transient database, so that all processes share it.
+    The results are only valid for the generation of the index which they
+    were computed with, so they never need to expire.
+
+    The results must be serializable to JSON. Those bigger than
+    CACHE_MAX_SIZE are not cached, and neither are those which can't be
+    written right away.
+    """
+    with connections['transient'].cursor() as cursor:
+        cursor.execute(
+            'SELECT g.generation, c.value FROM idx_generation AS g '
+            'LEFT JOIN idx_cache AS c '
+            'ON c.key = %s AND c.generation = g.generation', [key])
+        generation, value = cursor.fetchone()
+
+        if value is not None:
+            return json.loads(value)
+
+        result = compute()
+        value = json.dumps(result)
+
+        if len(value) <= CACHE_MAX_SIZE:
+            try:
+                # Not if the index changed meanwhile, the result would never
+                # be used
+                cursor.execute(
+                    'INSERT OR REPLACE INTO idx_cache (key, generation, value) '
+                    'SELECT %s, generation, %s FROM idx_generation '
+                    'WHERE generation = %s', [key, value, generation])
+
+            except OperationalError:
+                # The database is locked by another process, the searches
+                # must not fail for a cache
+                pass
+
+    return result
+
+
+def format_modified_at(modified_at):
+    """Return the modification date of an object, as stored in the index"""
+    if modified_at is None:
+        return None
+
+    return modified_at.isoformat()
+
+
+def get_last_modified_at(model):
+    """Return the most recent modification date of the objects of a model"""
+    if not any(f.name == 'modified_at' for f in model._meta.get_fields()):
+        return None
+
+    modified_at = model._default_manager.aggregate(
+        last=models.Max('modified_at'))['last']
+    return format_modified_at(modified_at)
+
+
+def set_watermark(cursor, model_name, modified_at):
+    if modified_at is None:
+        cursor.execute(
+            'DELETE FROM idx_watermarks WHERE model = %s', [model_name])
+
+    else:
+        cursor.execute(
+            'INSERT OR REPLACE INTO idx_watermarks (model, modified_at) '
+            'VALUES (%s, %s)', [model_name, modified_at])
+
+
+def add_tombstone(model_name, object_id):
+    """Remember that an object was deleted, for the incremental reindexing"""
+    with connections['transient'].cursor() as cursor:
+        cursor.execute(
+            'INSERT OR IGNORE INTO idx_tombstones (model, object_id) '
+            'VALUES (%s, %s)', [model_name, object_id])
+
+
+class HitsTables(threading.local):
+    def __init__(self):
+        # The names of the tables, by database alias
+        self.tables = {}
+
+
+_hits_tables = HitsTables()
+
+
+def create_hits_table(connection, ids):
+    """Write search hits to a temporary table of that connection
+
+    The table has the (position, object_id) of the hits, it is named after
+    them so that the same hits are written only once, and is dropped by
+    drop_hits_tables(), or with the connection.
+    """
+    signature = json.dumps(list(ids)).encode('utf-8')
+    table = 'search_hits_{}'.format(hashlib.md5(signature).hexdigest())
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_temp_master "
+            "WHERE type = 'table' AND name = %s", [table])
+
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                'CREATE TEMP TABLE {} (object_id INTEGER PRIMARY KEY, '
+                'position INTEGER NOT NULL)'.format(table))
+            cursor.executemany(
+                'INSERT OR IGNORE INTO {} (object_id, position) '
+                'VALUES (%s, %s)'.format(table),
+                [(pk, position) for position, pk in enumerate(ids)])
+
+    _hits_tables.tables.setdefault(connection.alias, set()).add(table)
+    return table
+
+
+def drop_hits_tables():
+    """Drop the hits tables created in this thread
+
+    The querysets joining them can't be evaluated any more, this is done
+    once the response of the request was sent.
+    """
+    try:
+        for alias, tables in _hits_tables.tables.items():
+            connection = connections[alias]
+
+            if connection.connection is None:
+                # Closed, and its temporary tables with it
+                continue
+
+            with connection.cursor() as cursor:
+                for table in sorted(tables):
+                    cursor.execute(
+                        'DROP TABLE IF EXISTS temp.{}'.format(table))
+
+    finally:
+        _hits_tables.tables = {}
+
+
+def split_tags(tags):
+    """Return the normalized tags from the tags column of the index"""
+    return {tag.lower() for tag in tags.strip('|').split('|') if tag}
+
+
+def delete_index_tags(cursor, docids):
+    cursor.executemany(
+        'DELETE FROM idx_tags WHERE docid = %s',
+        [(docid,) for docid in docids])
+
+
+def insert_index_tags(cursor, docids_tags):
+    """Fill the inverted index of tags
+
+    docids_tags is an iterable of (docid, tags column) tuples.
+    """
+    cursor.executemany(
+        'INSERT INTO idx_tags (tag, docid) VALUES (%s, %s)',
+        [(tag, docid)
+         for docid, tags in docids_tags for tag in split_tags(tags)])
 
 
-def reindex_content(force=True):
+def html_to_text(value):
+    """Return the text of rich text HTML, as it is indexed
+
+    The snippets of the search results are extracted from the indexed text,
+    they must not show the markup.
+    """
+    if not value:
+        return value
+
+    # The tags separate words, like the paragraphs do
+    text = html.unescape(strip_tags(value.replace('>', '> ')))
+    return ' '.join(text.split())
+
+
+def normalize_term(term):
+    """Lowercase the term and remove its diacritics, like the index does"""
+    term = unicodedata.normalize('NFKD', term.lower())
+    return ''.join(c for c in term if not unicodedata.combining(c))
+
+
+def normalize_word(word):
+    """Normalize a word like the tokenizer of the index does"""
+    if has_fts5():
+        return normalize_term(word)
+
+    # The simple tokenizer of FTS4 only lowercases the ASCII letters, and
+    # keeps the diacritics
+    return ''.join(c.lower() if c < '\x80' else c for c in word)
+
+
+def split_words(*texts):
+    """Return the normalized words of texts, much like the index splits them"""
+    text = ' '.join(t for t in texts if t)
+
+    if has_fts5():
+        return set(re.findall(r'\w+', normalize_term(text)))
+
+    return {normalize_word(word) for word in FTS4_WORD.findall(text)}
+
+
+def _count_index_words(cursor, rows, delta):
+    """Add delta documents to the words of these rows
+
+    rows is an iterable of (model, lang, public, title, text) tuples.
+    """
+    counts = Counter()
+
+    for model, lang, public, title, text in rows:
+        group = (model, lang or '', int(bool(public)))
+        counts.update((word,) + group for word in split_words(title, text))
+
+    where = 'word = %s AND model = %s AND lang = %s AND public = %s'
+
+    if delta > 0:
+        cursor.executemany(
+            'INSERT OR IGNORE INTO idx_words '
+            '(word, model, lang, public, documents) '
+            'VALUES (%s, %s, %s, %s, 0)', list(counts))
+
+    cursor.executemany(
+        'UPDATE idx_words SET documents = documents + %s WHERE {}'.format(
+            where),
+        [(delta * count,) + key for key, count in counts.items()])
+
+    if delta < 0:
+        cursor.executemany(
+            'DELETE FROM idx_words WHERE {} AND documents <= 0'.format(where),
+            list(counts))
+
+
+def insert_index_words(cursor, rows):
+    """Count the documents of each word, for the suggestions
+
+    rows are in the INDEX_COLUMNS order.
+    """
+    columns = [
+        INDEX_COLUMNS.index(c)
+        for c in ('model', 'lang', 'public', 'title', 'text')]
+    _count_index_words(
+        cursor, ([row[i] for i in columns] for row in rows), 1)
+
+
+def delete_index_words(cursor, rowids, params):
+    """Uncount the documents of the rowids query from their words"""
+    cursor.execute(
+        'SELECT m.model, m.lang, m.public, i.title, i.text '
+        'FROM idx_meta AS m JOIN idx AS i ON i.rowid = m.rowid '
+        'WHERE m.rowid IN ({})'.format(rowids), params)
+    _count_index_words(cursor, cursor.fetchall(), -1)
+
+
+def _chunked_pks(model, chunk_size):
+    """Yield the primary keys of a model, chunk by chunk, in pk order."""
+    last_pk = None
+
+    while True:
+        qs = model._default_manager.order_by('pk')
+
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+
+        pks = list(qs.values_list('pk', flat=True)[:chunk_size])
+
+        if not pks:
+            return
+
+        yield pks
+        last_pk = pks[-1]
+
+
+def get_index_rows(model_name, pks):
+    """Return the rows to insert in the index for these objects.
+
+    This is the costly part of reindexing (it runs all the index_* properties)
+    so it must be usable from worker processes: it only takes and returns
+    picklable values.
+    """
+    from ideascube.search.models import SearchMixin
+    model = SearchMixin.registered_types[model_name]
+    rows = []
+
+    for inst in model.get_index_queryset().filter(pk__in=pks):
+        if not inst.is_indexable():
+            continue
+
+        rows.append(inst.get_index_row())
+
+    return rows
+
+
+def _get_index_rows(args):
+    return get_index_rows(*args)
+
+
+def reindex_content(force=True, chunk_size=500, jobs=1, reporthook=None):
+    """Rebuild the whole search index.
+
+    Objects are read chunk by chunk, and all the index rows of a model are
+    written in a single transaction on the transient database.
+
+    When jobs is more than 1, the index rows are computed by that many worker
+    processes, which only works with on-disk databases.
+
+    The optional reporthook is called after each model with its name, the
+    number of indexed objects and the time it took, in seconds.
+    """
     from ideascube.search.models import SearchMixin
+    from ideascube.search.spelling import build_trigram_index
     create_index_table(force=force)
     indexed = {}
-    for model in SearchMixin.registered_types.values():
-        count = 0
-        for inst in model.objects.all():
-            inst.index()
-            count += 1
-        indexed[model.__name__] = count
+
+    connection = connections['transient']
+    pool = None
+
+    if jobs > 1:
+        # Children must not reuse the connections of their parent
+        connections.close_all()
+        pool = multiprocessing.get_context('fork').Pool(jobs)
+
+    try:
+        for model in SearchMixin.registered_types.values():
+            start = time.monotonic()
+            name = model.__name__
+            count = 0
+            # Changes from now on are left for the incremental reindexing
+            watermark = get_last_modified_at(model)
+            chunks = ((name, pks) for pks in _chunked_pks(model, chunk_size))
+
+            if pool is None:
+                chunks_rows = map(_get_index_rows, chunks)
+
+            else:
+                chunks_rows = pool.imap(_get_index_rows, chunks)
+
+            with transaction.atomic(using='transient'):
+                with connection.cursor() as cursor:
+                    if not force:
+                        # All the words of the model go, they need not be
+                        # read
+                        cursor.execute(
+                            'DELETE FROM idx_words WHERE model = %s', [name])
+                        delete_index_entries(
+                            cursor, 'model = %s', [name], words=False)
+
+                    # Nobody else writes in the transaction, we can pick
+                    # the rowids ourselves and insert all rows at once
+                    cursor.execute(
+                        'SELECT coalesce(max(rowid), 0) FROM idx_meta')
+                    rowid = cursor.fetchone()[0]
+
+                    for rows in chunks_rows:
+                        insert_index_rows(cursor, rows, first_rowid=rowid + 1)
+                        rowid += len(rows)
+                        count += len(rows)
+
+                    set_watermark(cursor, name, watermark)
+                    cursor.execute(
+                        'DELETE FROM idx_tombstones WHERE model = %s', [name])
+
+            indexed[name] = count
+            bump_index_generation()
+
+            if reporthook is not None:
+                reporthook(name, count, time.monotonic() - start)
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    build_trigram_index()
+
     return indexed
 
 
-def rank(match_info):
+def _get_insert_sql(table, columns):
+    return 'INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+
+
+def insert_index_rows(cursor, rows, first_rowid=None):
+    """Insert rows (in the INDEX_COLUMNS order) in the index tables
+
+    The rowids are picked by SQLite, unless the first one is given.
+    """
+    split = len(META_COLUMNS)
+    insert_meta = _get_insert_sql('idx_meta', META_COLUMNS)
+    tags_column = META_COLUMNS.index('tags')
+
+    if first_rowid is None:
+        rowids = []
+
+        for row in rows:
+            cursor.execute(insert_meta, (None,) + row[:split])
+            rowids.append(cursor.lastrowid)
+
+    else:
+        rowids = range(first_rowid, first_rowid + len(rows))
+        cursor.executemany(
+            insert_meta,
+            [(rowid,) + row[:split] for rowid, row in zip(rowids, rows)])
+
+    cursor.executemany(
+        _get_insert_sql('idx', FULLTEXT_COLUMNS),
+        [(rowid,) + row[split:] for rowid, row in zip(rowids, rows)])
+    insert_index_tags(
+        cursor, [(rowid, row[tags_column]) for rowid, row in zip(rowids, rows)])
+    insert_index_words(cursor, rows)
+
+
+def delete_index_entries(cursor, where, params, words=True):
+    """Delete the index entries matching a condition on idx_meta
+
+    Unless words is False, their words are uncounted from idx_words.
+    """
+    rowids = 'SELECT rowid FROM idx_meta WHERE {}'.format(where)
+
+    if words:
+        delete_index_words(cursor, rowids, params)
+
+    cursor.execute(
+        'DELETE FROM idx_tags WHERE docid IN ({})'.format(rowids), params)
+    cursor.execute(
+        'DELETE FROM idx WHERE rowid IN ({})'.format(rowids), params)
+    cursor.execute('DELETE FROM idx_meta WHERE {}'.format(where), params)
+
+
+def replace_index_entries(model_name, pks, rows):
+    """Replace the index entries of these objects by these rows"""
+    where = 'model = %s AND object_id IN ({})'.format(
+        ', '.join(['%s'] * len(pks)))
+
+    with transaction.atomic(using='transient'):
+        with connections['transient'].cursor() as cursor:
+            delete_index_entries(cursor, where, [model_name] + list(pks))
+            insert_index_rows(cursor, rows)
+
+    bump_index_generation()
+
+
+def update_index(model_name, pks):
+    """Update the index entries of these objects, in a single transaction
+
+    Objects which do not exist any more or are not indexable are removed
+    from the index.
+    """
+    replace_index_entries(model_name, pks, get_index_rows(model_name, pks))
+
+
+class IndexingQueue(threading.local):
+    def __init__(self):
+        self.depth = 0
+        self.dirty = OrderedDict()
+
+
+_queue = IndexingQueue()
+
+
+def _must_wait_for_commit(instance):
+    if not settings.SEARCH_DEFERRED_INDEXING:
+        return False
+
+    using = router.db_for_write(instance.__class__, instance=instance)
+    return transaction.get_connection(using).in_atomic_block
+
+
+def schedule_indexing(instance, deleted=False):
+    """Update the index entry of an object which was saved or deleted
+
+    In a deferred_indexing() block, or in a transaction when the
+    SEARCH_DEFERRED_INDEXING setting is enabled, the object is only marked
+    as dirty. All the dirty objects then get indexed at once, however many
+    times they were saved, at the end of the block or when the transaction
+    is committed.
+
+    Otherwise the index is updated right away.
+    """
+    key = (instance.__class__.__name__, instance.pk)
+
+    if _queue.depth:
+        _queue.dirty[key] = None
+
+    elif _must_wait_for_commit(instance):
+        _queue.dirty[key] = None
+        using = router.db_for_write(instance.__class__, instance=instance)
+        transaction.on_commit(flush_indexing, using=using)
+
+    elif deleted:
+        instance.deindex()
+
+    else:
+        instance.index()
+
+
+def flush_indexing():
+    """Index all the dirty objects, one batch of objects at a time"""
+    dirty, _queue.dirty = _queue.dirty, OrderedDict()
+    pks_by_model = OrderedDict()
+
+    for model_name, pk in dirty:
+        pks_by_model.setdefault(model_name, []).append(pk)
+
+    for model_name, pks in pks_by_model.items():
+        for i in range(0, len(pks), INDEX_BATCH_SIZE):
+            update_index(model_name, pks[i:i + INDEX_BATCH_SIZE])
+
+
+@contextlib.contextmanager
+def deferred_indexing():
+    """Index the objects saved or deleted in the block only once, at its end
+
+    Blocks can be nested, the dirty objects are indexed at the end of the
+    outermost one.
+    """
+    _queue.depth += 1
+
+    try:
+        yield
+
+    finally:
+        _queue.depth -= 1
+
+        if not _queue.depth:
+            flush_indexing()
+
+
+def rank(match_info, *weights):
     # Handle match_info called w/default args 'pcx' - based on the example
     # rank function http://sqlite.org/fts3.html#appendix_a
     # From github.com/coleifer/peewee/master/playhouse/sqlite_ext.py
@@ -47,6 +842,8 @@ def rank(match_info):
     # - y is for the number of occurrences of the given word in all columns of
     #   all rows
     # - z is for the number of rows where the given word has been found
+    # The optional weights are multiplied with the score of each column.
+    # This is only used when FTS5 is not available, which has its own bm25.
     score = 0.0
     if not match_info:
         return score
@@ -59,8 +856,9 @@ def rank(match_info):
         for col_num in range(c):  # For each searchable column.
             col_idx = phrase_info_idx + (col_num * 3)
             x1, x2 = match_info[col_idx:col_idx + 2]
+            weight = weights[col_num] if col_num < len(weights) else 1.0
             if x1 > 0:
                 # The more hits in the column, the higher score (x1); the more
                 # rows containing the word in the index, the lower score (x2).
-                score += float(x1) / x2
+                score += weight * float(x1) / x2
     return score
@@ -1,18 +1,136 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.utils.translation import ugettext_lazy as _
+from django.views.generic import ListView
 
-from .models import Search
+from .kiwix import merge_results, search_kiwix
+from .models import Search, SearchMixin
+from .spelling import get_corrected_query
+from .suggestions import get_suggestions
 
 
-def search(request):
-    query = request.GET.get('q', '')
-    results = []
-    if query:
+# The titles of the sections of results, by model
+SECTION_TITLES = {
+    'Book': _('Library'),
+    'Content': _('Blog'),
+    'Document': _('Medias Center'),
+    'StaticPage': _('Web sites'),
+    'User': _('Users'),
+}
+
+class SearchView(ListView):
+    """Search the index
+
+    Without a model, the best matches of each model are shown in their own
+    section, with a link to all the matches of that model, which are
+    paginated.
+    """
+    template_name = 'search/search.html'
+    paginate_by = 20
+
+    # How many matches each section shows
+    group_size = 5
+
+    # Stop counting the matches after that, broad queries would otherwise
+    # need to look at the whole index
+    count_ceiling = 1000
+
+    corrected_query = None
+    groups = None
+
+    def search(self, search_kwargs):
+        """Return the results and whether there are any"""
+        model_name = self.request.GET.get('model')
+
+        if model_name:
+            results = Search.search(
+                count_ceiling=self.count_ceiling, model=model_name,
+                **search_kwargs)
+            return results, bool(results.count())
+
+        self.groups = Search.grouped_search(
+            limit=self.group_size, count_ceiling=self.count_ceiling,
+            **search_kwargs)
+        return [], bool(self.groups)
+
+    def get_queryset(self):
+        query = self.request.GET.get('q', '')
+
+        if not query:
+            return []
+
         search_kwargs = {'text__match': query}
-        if not request.user.is_staff:
+        if not self.request.user.is_staff:
             search_kwargs['public'] = True
-        results = Search.search(**search_kwargs)
-    context = {
-        'results': results,
-        'q': query
+
+        results, found = self.search(search_kwargs)
+
+        if not found:
+            # Maybe the query was misspelled
+            self.corrected_query = get_corrected_query(query)
+
+            if self.corrected_query:
+                search_kwargs['text__match'] = self.corrected_query
+                results, found = self.search(search_kwargs)
+
+        return results
+
+    def get_groups(self, query):
+        groups = []
+
+        for model_name, (count, objects) in self.groups.items():
+            model = SearchMixin.registered_types[model_name]
+            groups.append({
+                'model': model_name,
+                'title': SECTION_TITLES.get(
+                    model_name, model._meta.verbose_name_plural),
+                'count': count,
+                'is_capped': count >= self.count_ceiling,
+                'results': objects,
+            })
+
+        # The best results of the ZIM files are a section of their own
+        kiwix_results = merge_results(*search_kiwix(query))
+
+        if kiwix_results:
+            groups.append({
+                'title': _('Kiwix'), 'count': len(kiwix_results),
+                'results': kiwix_results})
+
+        return groups
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['q'] = self.request.GET.get('q', '')
+        context['model'] = self.request.GET.get('model', '')
+        context['corrected_q'] = self.corrected_query
+        context['results'] = context['object_list']
+
+        if context['q'] and self.groups is not None:
+            context['groups'] = self.get_groups(context['q'])
+
+        context['is_capped'] = getattr(
+            self.object_list, 'is_capped', False)
+        return context
+search = SearchView.as_view()
+
+
+def suggest(request):
+    """Return the indexed terms completing the last word of the query"""
+    words = request.GET.get('q', '').split()
+    filters = {
+        'model': request.GET.get('model') or None,
+        'lang': request.GET.get('lang') or None,
     }
-    return render(request, 'search/search.html', context)
+
+    if not request.user.is_staff:
+        filters['public'] = True
+
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+
+    except ValueError:
+        limit = 10
+
+    suggestions = get_suggestions(words[-1], limit=limit, **filters) \
+        if words else []
+    return JsonResponse({'suggestions': suggestions})
@@ -8,6 +8,7 @@ from django.conf import settings
 from django.utils.translation import ugettext as _
 
 from ideascube import __version__
+from ideascube.thumbnails import THUMBNAILS_DIR
 
 
 def make_name(format):
@@ -86,11 +87,23 @@ class Backup(object):
                 mode = 'w:gz'
             elif self.format == 'bztar':
                 mode = 'w:bz2'
+            # The thumbnails can be generated again from the images
+            thumbnails = os.path.normpath(os.path.join(
+                './', os.path.relpath(
+                    os.path.join(settings.MEDIA_ROOT, THUMBNAILS_DIR),
+                    settings.BACKUPED_ROOT)))
+
+            def filter(ti):
+                if ti.issym() or os.path.normpath(ti.name) == thumbnails:
+                    return None
+
+                return ti
+
             archive = tarfile.open(base_name, mode=mode)
             archive.add(settings.BACKUPED_ROOT,
                         arcname='./',
                         recursive=True,
-                        filter=lambda ti: ti if not ti.issym() else None)
+                        filter=filter)
         except:
             raise
         finally:
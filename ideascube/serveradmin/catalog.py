@@ -31,6 +31,7 @@ from ideascube.utils import (
     MetaRegistry, classproperty, get_file_sha256, printerr, rm, urlretrieve,
 )
 
+from .staticsites import update_static_pages
 from .systemd import Manager as SystemManager, NoSuchUnit
 
 
@@ -240,7 +241,11 @@ class Kiwix(Handler):
 
 
 class Nginx(Handler):
-    pass
+    @classmethod
+    def commit(cls):
+        # Make the pages of the static sites searchable
+        update_static_pages()
+        super().commit()
 
 
 class MediaCenter(Handler):
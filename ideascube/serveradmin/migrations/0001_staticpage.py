@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.5 on 2026-10-19 04:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaticPage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='creation date')),
+                ('modified_at', models.DateTimeField(auto_now=True, verbose_name='modification date')),
+                ('package_id', models.CharField(max_length=100, verbose_name='package')),
+                ('path', models.CharField(max_length=1024, verbose_name='path')),
+                ('title', models.CharField(max_length=300, verbose_name='title')),
+                ('lang', models.CharField(blank=True, max_length=10, verbose_name='Language')),
+                ('text', models.TextField(blank=True, verbose_name='text')),
+                ('mtime', models.FloatField(verbose_name='file modification time')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='staticpage',
+            unique_together=set([('package_id', 'path')]),
+        ),
+    ]
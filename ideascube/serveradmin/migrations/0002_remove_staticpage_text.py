@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.5 on 2026-10-19 11:02
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serveradmin', '0001_staticpage'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='staticpage',
+            name='text',
+        ),
+    ]
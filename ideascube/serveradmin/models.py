@@ -0,0 +1,60 @@
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from ideascube.models import TimeStampedModel
+from ideascube.search.models import SearchMixin
+
+
+class StaticPage(SearchMixin, TimeStampedModel):
+    """An HTML page of an installed static site package
+
+    The pages are kept in sync with the files by the Nginx catalog handler,
+    so that their text can be searched. The text is only read from the file
+    when the page is indexed: it is in the search index, not in this
+    database which is backed up.
+    """
+    package_id = models.CharField(verbose_name=_('package'), max_length=100)
+    path = models.CharField(verbose_name=_('path'), max_length=1024)
+    title = models.CharField(verbose_name=_('title'), max_length=300)
+    lang = models.CharField(verbose_name=_('Language'), max_length=10,
+                            blank=True)
+    mtime = models.FloatField(verbose_name=_('file modification time'))
+
+    class Meta:
+        unique_together = (('package_id', 'path'),)
+
+    def __str__(self):
+        return self.title or self.path
+
+    def get_absolute_url(self):
+        return 'http://sites.{}/{}/{}'.format(
+            settings.DOMAIN, self.package_id, quote(self.path))
+
+    def get_file_path(self):
+        from .staticsites import get_sites_root
+        return os.path.join(get_sites_root(), self.package_id, self.path)
+
+    @property
+    def slug(self):
+        return self.package_id
+
+    @property
+    def index_title(self):
+        return self.title
+
+    @property
+    def index_strings(self):
+        from .staticsites import extract_text
+        return (extract_text(self.get_file_path()),)
+
+    @property
+    def index_lang(self):
+        return self.lang
+
+    @property
+    def index_source(self):
+        return self.package_id
@@ -0,0 +1,178 @@
+"""Keep the pages of the installed static sites in the search index"""
+import os
+import re
+
+from django.conf import settings
+from django.db import transaction
+from lxml import etree, html
+
+from ideascube.search.utils import deferred_indexing
+
+from .models import StaticPage
+
+
+HTML_EXTENSIONS = ('.html', '.htm')
+
+# Bigger pages are not indexed, they are rather data than text
+MAX_PAGE_SIZE = 5 * 1024 * 1024
+
+# Only the beginning of the longest pages is indexed
+MAX_TEXT_LENGTH = 100000
+
+# The elements which don't contain any text to read
+SKIPPED_TAGS = ('script', 'style', 'noscript', 'template')
+
+# Where the title and the lang of a page end
+HEAD_END = re.compile(rb'</head\s*>', re.IGNORECASE)
+
+
+def get_sites_root():
+    # Where the Nginx catalog handler installs the static sites
+    return getattr(
+        settings, 'CATALOG_NGINX_INSTALL_DIR',
+        os.path.join(settings.STORAGE_ROOT, 'nginx'))
+
+
+def _parse_page(path, head_only=False):
+    """Return the root element of an HTML page, None if it can't be read"""
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        if head_only:
+            end = HEAD_END.search(content)
+
+            if end is not None:
+                content = content[:end.end()]
+
+        try:
+            # Most pages are in UTF-8, even without saying so
+            content = content.decode('utf-8')
+
+        except UnicodeDecodeError:
+            # Let lxml find the encoding in the page
+            pass
+
+        root = html.document_fromstring(content)
+
+    except (OSError, ValueError, etree.LxmlError):
+        return None
+
+    etree.strip_elements(root, *SKIPPED_TAGS, with_tail=False)
+    return root
+
+
+def extract_head(path):
+    """Return the title and language of an HTML page
+
+    Only the head of the page is parsed.
+    """
+    root = _parse_page(path, head_only=True)
+
+    if root is None:
+        return '', ''
+
+    title = ' '.join((root.findtext('.//title') or '').split())
+    lang = (root.get('lang') or '').split('-')[0].lower()
+    return title, lang
+
+
+def extract_text(path):
+    """Return the text of the body of an HTML page"""
+    root = _parse_page(path)
+
+    if root is None:
+        return ''
+
+    body = root.find('body')
+
+    if body is None:
+        body = root
+
+    text = ' '.join(body.text_content().split())
+    return text[:MAX_TEXT_LENGTH]
+
+
+def _iter_html_files(site_root):
+    """Yield the path relative to site_root and the stats of each page"""
+    for dirpath, dirnames, filenames in os.walk(site_root):
+        dirnames.sort()
+
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(HTML_EXTENSIONS):
+                continue
+
+            path = os.path.join(dirpath, filename)
+
+            try:
+                stat = os.stat(path)
+
+            except OSError:
+                # A broken link, for example
+                continue
+
+            if stat.st_size <= MAX_PAGE_SIZE:
+                yield os.path.relpath(path, site_root), stat
+
+
+def _update_site(package_id, site_root):
+    pages = {
+        page.path: page
+        for page in StaticPage.objects.filter(package_id=package_id)}
+    updated = 0
+
+    for path, stat in _iter_html_files(site_root):
+        page = pages.pop(path, None)
+
+        if page is not None and page.mtime == stat.st_mtime:
+            continue
+
+        if page is None:
+            page = StaticPage(package_id=package_id, path=path)
+
+        # The text is only read from the file when the page is indexed
+        title, lang = extract_head(os.path.join(site_root, path))
+        page.title = title[:300]
+        page.lang = lang[:10]
+        page.mtime = stat.st_mtime
+        page.save()
+        updated += 1
+
+    # The pages which are gone
+    StaticPage.objects.filter(pk__in=[p.pk for p in pages.values()]).delete()
+    return updated, len(pages)
+
+
+def update_static_pages():
+    """Update the pages of the installed static sites which changed
+
+    The pages are compared with their files by modification time, only the
+    new and modified ones are parsed again. The pages of the files and
+    sites which were removed are deleted.
+
+    Return the number of updated and deleted pages.
+    """
+    sites_root = get_sites_root()
+
+    try:
+        package_ids = sorted(
+            name for name in os.listdir(sites_root)
+            if os.path.isdir(os.path.join(sites_root, name)))
+
+    except FileNotFoundError:
+        package_ids = []
+
+    with deferred_indexing():
+        removed = StaticPage.objects.exclude(package_id__in=package_ids)
+        updated, deleted = 0, removed.count()
+        removed.delete()
+
+        for package_id in package_ids:
+            with transaction.atomic():
+                site_updated, site_deleted = _update_site(
+                    package_id, os.path.join(sites_root, package_id))
+
+            updated += site_updated
+            deleted += site_deleted
+
+    return updated, deleted
@@ -786,6 +786,27 @@ def test_nginx_removes_staticsite(settings, staticsite_path):
     assert root.check(exists=False)
 
 
+@pytest.mark.usefixtures('db', 'cleansearch')
+def test_nginx_indexes_staticsite_on_commit(settings, staticsite_path):
+    from ideascube.search.models import Search
+    from ideascube.serveradmin.catalog import Nginx, StaticSite
+    from ideascube.serveradmin.models import StaticPage
+
+    p = StaticSite('w2eu', {})
+    h = Nginx()
+    h.install(p, staticsite_path.strpath)
+    h.commit()
+
+    page = StaticPage.objects.get(package_id='w2eu', path='index.html')
+    assert page.title == 'static content'
+    assert list(Search.search(text__match='static content')) == [page]
+
+    h.remove(p)
+    h.commit()
+
+    assert StaticPage.objects.count() == 0
+
+
 @pytest.mark.usefixtures('db')
 def test_mediacenter_installs_zippedmedia(settings, zippedmedia_path):
     from ideascube.serveradmin.catalog import MediaCenter, ZippedMedias
@@ -0,0 +1,134 @@
+import os
+
+import pytest
+from lxml import html
+
+from ideascube.search.models import Search
+from ideascube.search.utils import reindex_content
+
+from ..models import StaticPage
+from ..staticsites import extract_head, extract_text, update_static_pages
+
+
+pytestmark = [pytest.mark.django_db, pytest.mark.usefixtures('cleansearch')]
+
+
+PAGE = '''<!DOCTYPE html>
+<html lang="{lang}">
+  <head>
+    <title>{title}</title>
+    <style>body {{ color: red; }}</style>
+  </head>
+  <body>
+    <h1>{title}</h1>
+    <script>var hidden = "script";</script>
+    <p>{text}<!-- a comment --> <b>and</b> more</p>
+  </body>
+</html>
+'''
+
+
+def write_page(root, path, title='A page', text='Some text', lang='fr-FR'):
+    path = root.join(*path.split('/'))
+    path.dirpath().ensure(dir=True)
+    path.write_text(
+        PAGE.format(title=title, text=text, lang=lang), 'utf-8')
+    return path
+
+
+@pytest.fixture
+def sites_root(settings, tmpdir):
+    root = tmpdir.mkdir('nginx')
+    settings.CATALOG_NGINX_INSTALL_DIR = root.strpath
+    return root
+
+
+def test_extract_page(tmpdir):
+    path = write_page(tmpdir, 'page.html', title='Musée', text='Des œuvres')
+
+    assert extract_head(path.strpath) == ('Musée', 'fr')
+    assert extract_text(path.strpath) == 'Musée Des œuvres and more'
+
+
+def test_extract_page_without_content(tmpdir):
+    path = tmpdir.join('page.html')
+    path.write('')
+
+    assert extract_head(path.strpath) == ('', '')
+    assert extract_text(path.strpath) == ''
+
+
+def test_extract_head_does_not_parse_the_body(tmpdir, mocker):
+    path = write_page(tmpdir, 'page.html', title='Musée', text='Des œuvres')
+    parse = mocker.spy(html, 'document_fromstring')
+
+    assert extract_head(path.strpath) == ('Musée', 'fr')
+    assert 'œuvres' not in parse.call_args[0][0]
+
+
+def test_update_static_pages_indexes_the_pages(sites_root):
+    site = sites_root.mkdir('maps.fr')
+    write_page(site, 'index.html', title='Maps', text='The world map')
+    write_page(site, 'countries/kenya.htm', title='Kenya', text='Nairobi')
+    site.join('tiles.png').write('')
+
+    assert update_static_pages() == (2, 0)
+
+    page = StaticPage.objects.get(path=os.path.join('countries', 'kenya.htm'))
+    assert page.title == 'Kenya'
+    assert page.lang == 'fr'
+    assert page.package_id == 'maps.fr'
+    assert page.get_absolute_url() == (
+        'http://sites.ideascube.lan/maps.fr/countries/kenya.htm')
+
+    assert list(Search.search(text__match='nairobi')) == [page]
+    assert Search.objects.get(object_id=page.pk).source == 'maps.fr'
+
+
+def test_update_static_pages_only_parses_the_modified_pages(sites_root, mocker):
+    site = sites_root.mkdir('maps.fr')
+    write_page(site, 'index.html', text='The world map')
+    modified = write_page(site, 'kenya.html', text='Nairobi')
+    update_static_pages()
+
+    write_page(site, 'kenya.html', text='Mombasa')
+    os.utime(modified.strpath, (1000, 1000))
+    save = mocker.spy(StaticPage, 'save')
+
+    assert update_static_pages() == (1, 0)
+    assert save.call_count == 1
+    assert Search.search(text__match='nairobi').count() == 0
+    assert Search.search(text__match='mombasa').count() == 1
+
+
+def test_update_static_pages_removes_the_deleted_pages(sites_root):
+    site = sites_root.mkdir('maps.fr')
+    write_page(site, 'index.html', text='The world map')
+    write_page(site, 'kenya.html', text='Nairobi')
+    other = sites_root.mkdir('cinescuela.es')
+    write_page(other, 'index.html', text='Cine')
+    update_static_pages()
+
+    site.join('kenya.html').remove()
+    other.remove()
+
+    assert update_static_pages() == (0, 2)
+    assert list(StaticPage.objects.values_list('path', flat=True)) == [
+        'index.html']
+    assert Search.search(text__match='nairobi').count() == 0
+    assert Search.search(text__match='cine').count() == 0
+
+
+def test_update_static_pages_without_sites(sites_root):
+    assert update_static_pages() == (0, 0)
+
+
+def test_reindexing_reads_the_text_of_the_pages(sites_root):
+    site = sites_root.mkdir('maps.fr')
+    write_page(site, 'kenya.html', title='Kenya', text='Nairobi')
+    update_static_pages()
+
+    reindex_content()
+
+    page = StaticPage.objects.get()
+    assert list(Search.search(text__match='nairobi')) == [page]
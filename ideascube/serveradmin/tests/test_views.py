@@ -10,6 +10,7 @@ from django.core.files.base import ContentFile
 
 from ..backup import Backup
 from ideascube.configuration import get_config, set_config
+from ideascube.search.maintenance import heal_index
 from .test_backup import BACKUPS_ROOT, DATA_ROOT
 from . import FakePopen, NMActiveConnection, NMConnection, NMDevice
 
@@ -73,6 +74,16 @@ def test_staff_is_presented_with_default_server_name(staffapp, settings):
     assert form['server_name'].value == 'Ideas Cube'
 
 
+@pytest.mark.usefixtures('cleansearch')
+def test_staff_can_see_the_state_of_the_search_index(staffapp):
+    res = staffapp.get(reverse('server:settings'), status=200)
+    assert 'The search index was never checked.' in res.unicode_body
+
+    heal_index(background=False)
+    res = staffapp.get(reverse('server:settings'), status=200)
+    assert 'the search index was up to date.' in res.unicode_body
+
+
 def test_staff_user_should_access_power_admin(staffapp):
     assert staffapp.get(reverse("server:power"), status=200)
 
@@ -7,6 +7,7 @@ from django.utils.translation import ugettext as _
 
 from ideascube.configuration import get_config, set_config
 from ideascube.decorators import staff_member_required
+from ideascube.search.maintenance import get_index_health
 from ideascube.utils import get_all_languages
 
 from .backup import Backup
@@ -197,4 +198,5 @@ def server_info(request):
         else:
             messages.error(request, _('Server name cannot be empty'))
 
-    return render(request, 'serveradmin/settings.html')
+    return render(request, 'serveradmin/settings.html', {
+        'index_health': get_index_health()})
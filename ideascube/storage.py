@@ -0,0 +1,133 @@
+"""A media storage which stores identical files only once
+
+When the MEDIA_DEDUPLICATION setting is enabled, the files saved in this
+storage are hashed while they are written to the blobs directory, where
+each content is stored once, named after its hash. The files of the media
+storage are then hard links to their blob, so nothing else needs to know
+about it.
+
+The number of links of a blob counts its references: a blob which only has
+one is not used any more, and prune() removes it.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+# In the media storage
+BLOBS_DIR = 'blobs'
+
+
+@deconstructible
+class DeduplicatedStorage(FileSystemStorage):
+    def _save(self, name, content):
+        if not settings.MEDIA_DEDUPLICATION:
+            return super()._save(name, content)
+
+        tmp_path, digest = self._save_tmp(content)
+
+        try:
+            try:
+                blob = self._link_blob(tmp_path, digest)
+
+            except OSError:
+                # Not all file systems have hard links
+                return super()._save(name, content)
+
+            directory = os.path.dirname(self.path(name))
+            if not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+
+            while True:
+                try:
+                    os.link(blob, self.path(name))
+
+                except FileExistsError:
+                    # A file was saved with that name in the meantime
+                    name = self.get_available_name(name)
+
+                except FileNotFoundError:
+                    # The blob was not used by any file, and prune() removed
+                    # it in the meantime, or an empty directory was removed
+                    blob = self._link_blob(tmp_path, digest)
+                    os.makedirs(directory, exist_ok=True)
+
+                else:
+                    return name
+
+        finally:
+            # Only once the file is linked to the blob, until then the
+            # temporary file is what keeps prune() from removing the blob
+            os.unlink(tmp_path)
+
+    def _save_tmp(self, content):
+        """Write the content to a temporary file of the blobs directory
+
+        Return its path, and the hash of the content.
+        """
+        blobs = self.path(BLOBS_DIR)
+        os.makedirs(blobs, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=blobs, prefix='.tmp-')
+
+        try:
+            digest = hashlib.sha256()
+
+            with open(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        return tmp_path, digest.hexdigest()
+
+    def _link_blob(self, tmp_path, digest):
+        """Link the temporary file to its blob, unless it is already there
+
+        Return the path to the blob.
+        """
+        blob = os.path.join(self.path(BLOBS_DIR), digest[:2], digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+
+        try:
+            # Unlike a rename, this never replaces a blob which other files
+            # are already linked to
+            os.link(tmp_path, blob)
+
+        except FileExistsError:
+            pass
+
+        return blob
+
+    def prune(self):
+        """Remove the blobs which no file uses any more
+
+        Return the number of removed blobs.
+        """
+        removed = 0
+
+        for dirpath, _, filenames in os.walk(self.path(BLOBS_DIR)):
+            for filename in filenames:
+                if filename.startswith('.tmp-'):
+                    # Being saved
+                    continue
+
+                path = os.path.join(dirpath, filename)
+
+                if os.stat(path).st_nlink == 1:
+                    os.unlink(path)
+                    removed += 1
+
+        return removed
+
+
+deduplicated_storage = DeduplicatedStorage()
@@ -1,8 +1,11 @@
 import re
 
 from django import template
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db.models.fields import FieldDoesNotExist
 from django.template.defaultfilters import truncatechars_html
+from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
 from django.utils.translation.trans_real import language_code_prefix_re
 from django.utils.datastructures import MultiValueDict
@@ -10,6 +13,8 @@ from django.http import QueryDict
 
 from taggit.models import Tag
 
+from ideascube.search.utils import HIGHLIGHT_END, HIGHLIGHT_START
+from ideascube.thumbnails import get_thumbnail
 from ideascube.utils import clean_html
 
 
@@ -22,7 +27,9 @@ SLUGS = {
 THEMES = {
     'Book': 'read',
     'Content': 'create',
-    'Document': 'discover'
+    'Document': 'discover',
+    'KiwixResult': 'discover',
+    'StaticPage': 'discover',
 }
 
 
@@ -196,8 +203,47 @@ def media(instance, attribute):
     return '%s?%s' % (url, qs)
 
 
+@register.simple_tag
+def thumbnail(instance, attribute, width):
+    """The URL of the thumbnail of an image, or of the image if there is
+    no thumbnail of that width (yet)"""
+    name = get_thumbnail(getattr(instance, attribute).name, width)
+
+    if name is None:
+        return media(instance, attribute)
+
+    qs = 'mtime={0.modified_at:%Y-%m-%dT%H:%M:%S%Z}'.format(instance)
+
+    return '%s?%s' % (default_storage.url(name), qs)
+
+
+@register.simple_tag
+def thumbnail_srcset(instance, attribute):
+    """The srcset of an image, listing its available thumbnails"""
+    name = getattr(instance, attribute).name
+    qs = 'mtime={0.modified_at:%Y-%m-%dT%H:%M:%S%Z}'.format(instance)
+    candidates = []
+
+    for width in settings.THUMBNAIL_WIDTHS:
+        thumbnail_name = get_thumbnail(name, width)
+
+        if thumbnail_name is not None:
+            candidates.append('%s?%s %sw' % (
+                default_storage.url(thumbnail_name), qs, width))
+
+    return ', '.join(candidates)
+
+
 @register.filter
 def summarize_html(text, length):
     filtered = clean_html(text, with_media=False)
 
     return truncatechars_html(filtered, length)
+
+
+@register.filter(is_safe=True)
+def highlight(snippet):
+    """Mark the matching terms in the snippet of a search result"""
+    escaped = conditional_escape(snippet)
+    return mark_safe(escaped.replace(HIGHLIGHT_START, '<mark>').replace(
+        HIGHLIGHT_END, '</mark>'))
@@ -0,0 +1,115 @@
+import os
+
+from django.core.files.base import ContentFile
+import pytest
+
+from ..storage import BLOBS_DIR, DeduplicatedStorage
+
+
+pytestmark = pytest.mark.usefixtures('setup_dirs')
+
+
+@pytest.fixture
+def storage(settings):
+    settings.MEDIA_DEDUPLICATION = True
+    return DeduplicatedStorage()
+
+
+def get_blobs(storage):
+    return sorted(
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(storage.path(BLOBS_DIR))
+        for filename in filenames)
+
+
+def test_identical_files_share_their_content(storage):
+    first = storage.save('first/video.mp4', ContentFile(b'A video'))
+    second = storage.save('second/video.mp4', ContentFile(b'A video'))
+    other = storage.save('other/video.mp4', ContentFile(b'Another video'))
+
+    with storage.open(second) as f:
+        assert f.read() == b'A video'
+
+    first_stat = os.stat(storage.path(first))
+    second_stat = os.stat(storage.path(second))
+    assert first_stat.st_ino == second_stat.st_ino
+    assert first_stat.st_nlink == 3
+    assert os.stat(storage.path(other)).st_ino != first_stat.st_ino
+    assert len(get_blobs(storage)) == 2
+
+
+def test_identical_files_with_the_same_name(storage):
+    first = storage.save('video.mp4', ContentFile(b'A video'))
+    second = storage.save('video.mp4', ContentFile(b'A video'))
+
+    assert first == 'video.mp4'
+    assert second != first
+    assert os.stat(storage.path(second)).st_nlink == 3
+
+
+def test_deduplication_can_be_disabled(storage, settings):
+    settings.MEDIA_DEDUPLICATION = False
+    first = storage.save('first.mp4', ContentFile(b'A video'))
+    second = storage.save('second.mp4', ContentFile(b'A video'))
+
+    assert os.stat(storage.path(first)).st_nlink == 1
+    assert os.stat(storage.path(second)).st_nlink == 1
+    assert get_blobs(storage) == []
+
+
+def test_prune_removes_the_unused_contents(storage):
+    first = storage.save('first.mp4', ContentFile(b'A video'))
+    second = storage.save('second.mp4', ContentFile(b'A video'))
+    other = storage.save('other.mp4', ContentFile(b'Another video'))
+
+    storage.delete(first)
+    storage.delete(other)
+
+    assert storage.prune() == 1
+    assert len(get_blobs(storage)) == 1
+
+    with storage.open(second) as f:
+        assert f.read() == b'A video'
+
+    storage.delete(second)
+
+    assert storage.prune() == 1
+    assert get_blobs(storage) == []
+
+
+def test_prune_while_saving_keeps_the_new_content(storage, mocker):
+    link = os.link
+
+    def prune_then_link(src, dst):
+        if not dst.startswith(storage.path(BLOBS_DIR)):
+            # The blob is written, the file is not linked to it yet
+            storage.prune()
+
+        link(src, dst)
+
+    mocker.patch('ideascube.storage.os.link', side_effect=prune_then_link)
+    name = storage.save('video.mp4', ContentFile(b'A video'))
+
+    assert os.stat(storage.path(name)).st_nlink == 2
+    assert len(get_blobs(storage)) == 1
+
+
+def test_prune_while_saving_an_unused_content(storage, mocker):
+    storage.delete(storage.save('video.mp4', ContentFile(b'A video')))
+    link = os.link
+
+    def prune_then_link(src, dst):
+        if not dst.startswith(storage.path(BLOBS_DIR)):
+            # The existing blob is not used by any file yet
+            storage.prune()
+
+        link(src, dst)
+
+    mocker.patch('ideascube.storage.os.link', side_effect=prune_then_link)
+    name = storage.save('video.mp4', ContentFile(b'A video'))
+
+    with storage.open(name) as f:
+        assert f.read() == b'A video'
+
+    assert os.stat(storage.path(name)).st_nlink == 2
+    assert len(get_blobs(storage)) == 1
@@ -201,3 +201,10 @@ def test_summarize_html(html, length, expected):
     from ideascube.templatetags.ideascube_tags import summarize_html
 
     assert summarize_html(html, length) == expected
+
+
+def test_highlight():
+    from ideascube.templatetags.ideascube_tags import highlight
+
+    assert highlight('<b>Rock</b> & \x02roll\x03…') == (
+        '&lt;b&gt;Rock&lt;/b&gt; &amp; <mark>roll</mark>…')
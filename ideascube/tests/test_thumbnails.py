@@ -0,0 +1,164 @@
+import os
+
+import pytest
+from PIL import Image
+
+from ideascube.blog.tests.factories import ContentFactory
+from ideascube.mediacenter.tests.factories import DocumentFactory
+
+from ..templatetags.ideascube_tags import thumbnail, thumbnail_srcset
+from ..thumbnails import (
+    ThumbnailsWorker, generate_thumbnails, get_thumbnail, get_thumbnail_name)
+
+
+pytestmark = pytest.mark.usefixtures('setup_dirs')
+
+
+@pytest.fixture
+def widths(settings):
+    settings.THUMBNAIL_WIDTHS = (10, 20)
+    return settings.THUMBNAIL_WIDTHS
+
+
+def make_image(settings, name, size=(40, 30), color='red', **kwargs):
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = kwargs.pop('mode', 'RGB')
+    Image.new(mode, size, color).save(path, **kwargs)
+    return path
+
+
+def open_thumbnail(settings, name, width):
+    return Image.open(os.path.join(
+        settings.MEDIA_ROOT, get_thumbnail(name, width)))
+
+
+def test_generate_thumbnails(settings, widths):
+    make_image(settings, 'blog/image/a.png')
+
+    generate_thumbnails('blog/image/a.png')
+
+    assert get_thumbnail('blog/image/a.png', 10) == get_thumbnail_name(
+        'blog/image/a.png', 10)
+
+    with open_thumbnail(settings, 'blog/image/a.png', 10) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (10, 8)
+
+    with open_thumbnail(settings, 'blog/image/a.png', 20) as image:
+        assert image.size == (20, 15)
+
+
+def test_generate_thumbnails_does_not_enlarge_images(settings):
+    settings.THUMBNAIL_WIDTHS = (20, 40, 80)
+    make_image(settings, 'a.png')
+
+    generate_thumbnails('a.png')
+
+    assert get_thumbnail('a.png', 20) is not None
+    assert get_thumbnail('a.png', 40) is None
+    assert get_thumbnail('a.png', 80) is None
+
+
+def test_generate_thumbnails_shares_the_thumbnails_of_identical_images(
+        settings, widths):
+    make_image(settings, 'a.png')
+    make_image(settings, 'b.png')
+
+    generate_thumbnails('a.png')
+    generate_thumbnails('b.png')
+
+    a = os.stat(os.path.join(settings.MEDIA_ROOT, get_thumbnail('a.png', 10)))
+    b = os.stat(os.path.join(settings.MEDIA_ROOT, get_thumbnail('b.png', 10)))
+    assert (a.st_ino, a.st_dev) == (b.st_ino, b.st_dev)
+
+
+def test_generate_thumbnails_when_the_image_changed(settings, widths):
+    path = make_image(settings, 'a.png')
+    generate_thumbnails('a.png')
+    thumbnail_path = os.path.join(
+        settings.MEDIA_ROOT, get_thumbnail('a.png', 10))
+    os.utime(thumbnail_path, (1000, 1000))
+    make_image(settings, 'a.png', color='blue')
+
+    assert get_thumbnail('a.png', 10) is None
+
+    generate_thumbnails('a.png')
+
+    assert os.stat(thumbnail_path).st_mtime >= os.stat(path).st_mtime
+
+    with open_thumbnail(settings, 'a.png', 10) as image:
+        red, green, blue = image.getpixel((5, 4))
+        assert blue > 200 and red < 50
+
+
+def test_generate_thumbnails_flattens_the_transparency(settings, widths):
+    make_image(settings, 'a.png', mode='RGBA', color=(0, 0, 0, 0))
+
+    generate_thumbnails('a.png')
+
+    with open_thumbnail(settings, 'a.png', 10) as image:
+        assert min(image.getpixel((5, 4))) > 240
+
+
+def test_generate_thumbnails_ignores_other_files(settings, widths):
+    path = os.path.join(settings.MEDIA_ROOT, 'a.pdf')
+
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4')
+
+    generate_thumbnails('a.pdf')
+    generate_thumbnails('missing.png')
+
+    assert get_thumbnail('a.pdf', 10) is None
+    assert get_thumbnail('missing.png', 10) is None
+
+
+def test_worker_generates_the_scheduled_thumbnails(settings, widths):
+    make_image(settings, 'a.png')
+    make_image(settings, 'b.png', color='blue')
+    worker = ThumbnailsWorker()
+
+    worker.schedule('a.png')
+    worker.schedule('b.png')
+    worker.join()
+
+    assert get_thumbnail('a.png', 10) is not None
+    assert get_thumbnail('b.png', 20) is not None
+
+
+@pytest.mark.django_db
+def test_saving_an_object_generates_its_thumbnails(settings, widths):
+    make_image(settings, 'mediacenter/preview/a.png')
+
+    document = DocumentFactory(preview='mediacenter/preview/a.png')
+
+    assert get_thumbnail(document.preview.name, 10) is not None
+    assert get_thumbnail(document.original.name, 10) is None
+
+
+@pytest.mark.django_db
+def test_thumbnail(settings, widths):
+    make_image(settings, 'blog/image/a.png')
+    content = ContentFactory(image='blog/image/a.png')
+    qs = 'mtime={:%Y-%m-%dT%H:%M:%S%Z}'.format(content.modified_at)
+
+    assert thumbnail(content, 'image', 10) == (
+        '/media/thumbnails/files/blog/image/a.png.10.jpg?' + qs)
+    assert thumbnail(content, 'image', 80) == (
+        '/media/blog/image/a.png?' + qs)
+    assert thumbnail_srcset(content, 'image') == (
+        '/media/thumbnails/files/blog/image/a.png.10.jpg?{0} 10w, '
+        '/media/thumbnails/files/blog/image/a.png.20.jpg?{0} 20w'.format(qs))
+
+
+def test_generate_thumbnails_does_not_hash_small_images(settings, mocker):
+    settings.THUMBNAIL_WIDTHS = (20, 40)
+    make_image(settings, 'a.png')
+    generate_thumbnails('a.png')
+    get_file_sha256 = mocker.patch('ideascube.thumbnails.get_file_sha256')
+
+    generate_thumbnails('a.png')
+
+    assert get_thumbnail('a.png', 20) is not None
+    assert get_file_sha256.call_count == 0
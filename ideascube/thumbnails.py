@@ -0,0 +1,262 @@
+"""Smaller versions of the images of the media storage
+
+The images which are uploaded or installed with the packages are often
+camera photos, far bigger than what the pages show. A thumbnail of each of
+THUMBNAIL_WIDTHS is generated once, in the background, and cached by the
+hash of the image content, so that identical images share their thumbnails.
+
+The thumbnails of an image are hard links to the cached ones, named after
+the image, so that the pages find them without reading the image.
+
+The models list their image fields in thumbnail_fields.
+"""
+import logging
+import os
+import queue
+import shutil
+import threading
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image
+
+from ideascube.utils import get_file_sha256
+
+
+logger = logging.getLogger(__name__)
+
+# In the media storage
+THUMBNAILS_DIR = 'thumbnails'
+
+JPEG_QUALITY = 80
+
+# The EXIF tag telling how the camera was held, and how to undo it
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+ORIENTATION_TRANSPOSITIONS = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.TRANSPOSE,),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
+    8: (Image.ROTATE_90,),
+}
+
+
+def get_thumbnail_name(name, width):
+    """Return the name of the thumbnail of an image, in the media storage"""
+    return os.path.join(
+        THUMBNAILS_DIR, 'files', '{}.{}.jpg'.format(name, width))
+
+
+def _get_cached_path(digest, width):
+    return os.path.join(
+        settings.MEDIA_ROOT, THUMBNAILS_DIR, 'cache', digest[:2],
+        '{}.{}.jpg'.format(digest, width))
+
+
+def get_thumbnail(name, width):
+    """Return the name of the thumbnail of an image in the media storage
+
+    None if it was not generated since the image was last modified, for
+    example because the image is smaller than that.
+    """
+    if not name:
+        return None
+
+    thumbnail = get_thumbnail_name(name, width)
+
+    try:
+        thumbnail_mtime = os.stat(
+            os.path.join(settings.MEDIA_ROOT, thumbnail)).st_mtime
+        image_mtime = os.stat(
+            os.path.join(settings.MEDIA_ROOT, name)).st_mtime
+
+    except OSError:
+        return None
+
+    return thumbnail if thumbnail_mtime >= image_mtime else None
+
+
+def _get_orientation(image):
+    try:
+        return image._getexif()[EXIF_ORIENTATION]
+
+    except (AttributeError, KeyError, IndexError, TypeError):
+        return None
+
+
+def _prepare(image, width, orientation):
+    """Load the image upright and in RGB, at least width pixels wide"""
+    # JPEG images can be decoded directly at a lower resolution, which is
+    # much faster for camera photos
+    image.draft('RGB', (width, width))
+
+    for transposition in ORIENTATION_TRANSPOSITIONS.get(orientation, ()):
+        image = image.transpose(transposition)
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Transparent areas would be black in a JPEG
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.split()[-1])
+        return background
+
+    return image.convert('RGB')
+
+
+def _write_thumbnail(image, width, path):
+    height = max(1, round(image.height * width / image.width))
+    thumbnail = image.resize((width, height), Image.LANCZOS)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Never leave a partial file where the pages would find it
+    tmp_path = '{}.tmp'.format(path)
+    thumbnail.save(
+        tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True,
+        progressive=True)
+    os.replace(tmp_path, path)
+
+
+def _link(cached_path, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.tmp'.format(path)
+
+    try:
+        os.link(cached_path, tmp_path)
+
+    except OSError:
+        # Not all file systems have hard links
+        shutil.copyfile(cached_path, tmp_path)
+
+    os.replace(tmp_path, path)
+
+    # Newer than the image, even if it was cached before
+    os.utime(path)
+
+
+def generate_thumbnails(name):
+    """Generate the missing thumbnails of an image of the media storage
+
+    Files which are not images are ignored, and so are the widths which
+    the image is not bigger than.
+    """
+    widths = [
+        w for w in settings.THUMBNAIL_WIDTHS if not get_thumbnail(name, w)]
+
+    if not widths:
+        return
+
+    path = os.path.join(settings.MEDIA_ROOT, name)
+
+    try:
+        image = Image.open(path)
+
+    except OSError:
+        # Not an image, or not there any more
+        return
+
+    with image:
+        # Only the header was read so far, which tells the size of the image
+        orientation = _get_orientation(image)
+        image_width = image.width
+
+        if orientation in ROTATED_ORIENTATIONS:
+            image_width = image.height
+
+        # The image itself is small enough for the other widths, it does not
+        # even need to be hashed
+        widths = [w for w in widths if w < image_width]
+
+        if not widths:
+            return
+
+        digest = get_file_sha256(path)
+        missing = [
+            w for w in widths if not os.path.exists(_get_cached_path(digest, w))]
+
+        if missing:
+            image = _prepare(image, max(missing), orientation)
+
+        for width in widths:
+            cached_path = _get_cached_path(digest, width)
+            thumbnail_path = os.path.join(
+                settings.MEDIA_ROOT, get_thumbnail_name(name, width))
+
+            if width in missing:
+                _write_thumbnail(image, width, cached_path)
+
+            _link(cached_path, thumbnail_path)
+
+
+class ThumbnailsWorker(object):
+    """Generate the thumbnails of the scheduled images one after the other,
+    in a thread which stops when there are no more"""
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def schedule(self, name):
+        self.queue.put(name)
+
+        with self.lock:
+            if self.thread is None:
+                # Not a daemon, so that commands wait for the thumbnails
+                self.thread = threading.Thread(
+                    target=self.run, name='thumbnails')
+                self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                name = self.queue.get(timeout=1)
+
+            except queue.Empty:
+                with self.lock:
+                    if self.queue.empty():
+                        self.thread = None
+                        return
+
+                continue
+
+            try:
+                generate_thumbnails(name)
+
+            except Exception:
+                logger.exception(
+                    'Could not generate the thumbnails of %s', name)
+
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """Wait for all the scheduled thumbnails"""
+        self.queue.join()
+
+
+_worker = ThumbnailsWorker()
+
+
+def schedule_thumbnails(name):
+    """Generate the thumbnails of an image of the media storage
+
+    That is in the background, unless the THUMBNAILS_IN_BACKGROUND setting
+    is disabled.
+    """
+    if settings.THUMBNAILS_IN_BACKGROUND:
+        _worker.schedule(name)
+
+    else:
+        generate_thumbnails(name)
+
+
+@receiver(post_save)
+def generate_saved_thumbnails(sender, instance, **kwargs):
+    for field_name in getattr(sender, 'thumbnail_fields', ()):
+        name = getattr(instance, field_name).name
+
+        if name:
+            schedule_thumbnails(name)